@@ -0,0 +1,4 @@
+# Celery ilovasi Django bilan birga yuklanadi, shunda .delay() sozlangan broker'dan foydalanadi
+from .celery import app as celery_app
+
+__all__ = ('celery_app',)
@@ -5,9 +5,11 @@ from django.shortcuts import redirect
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.utils.html import format_html
 from django.urls import reverse
+from django.db import transaction
+from django.utils import timezone
 from .models import (
     User, Role, University, Faculty, Department, Program, Group,
-    Subject, TeachingAllocation, AcademicYear, AuditLog, JobRun,
+    Subject, TeachingAllocation, AcademicYear, AuditLog, JobRun, EmailOutbox, UploadSession, StoredBlob,
     DocumentType, Hujjat, ApprovalStep, ApprovalLog, Notification, RequestLog, SecurityPolicy
 )
 from import_export import resources, fields
@@ -17,6 +19,7 @@ from import_export.widgets import ForeignKeyWidget
 # ==================== ROLE ADMIN ====================
 from import_export.widgets import Widget
 from django.contrib.auth.hashers import make_password
+from .roles import RoleRegistry
 import json
 
 class RoleCodesWidget(Widget):
@@ -673,7 +676,10 @@ class DocumentAdmin(admin.ModelAdmin):
         'updated_at', 
         'completed_at',
         'file_size',
-        'get_expected_approver'
+        'get_expected_approver',
+        'final_pdf_status',
+        'final_pdf_attempts',
+        'final_pdf_started_at',
     ]
     
     fieldsets = (
@@ -684,7 +690,8 @@ class DocumentAdmin(admin.ModelAdmin):
             'fields': ('status', 'current_step', 'get_expected_approver')
         }),
         ('Verification', {
-            'fields': ('uuid', 'verification_code', 'qr_code_image', 'final_pdf')
+            'fields': ('uuid', 'verification_code', 'qr_code_image', 'final_pdf',
+                       'final_pdf_status', 'final_pdf_attempts', 'final_pdf_started_at')
         }),
         ('Timestamps', {
             'fields': ('uploaded_at', 'updated_at', 'completed_at')
@@ -692,6 +699,18 @@ class DocumentAdmin(admin.ModelAdmin):
     )
     
     inlines = [ApprovalStepInline, ApprovalLogInline]
+    actions = ['restamp_final_pdf']
+    
+    @admin.action(description="QR kodli PDF'ni qayta tayyorlash (urinishlar hisobini tiklab)")
+    def restamp_final_pdf(self, request, queryset):
+        from .qr_service import QRCodeService
+
+        documents = list(queryset.filter(status='approved'))
+        for document in documents:
+            document.final_pdf_attempts = 0
+            document.final_pdf_status = 'none'
+            QRCodeService.request_final_pdf(document)
+        self.message_user(request, f"{len(documents)} ta hujjat navbatga qo'yildi.")
     
     def get_department(self, obj):
         if obj.uploaded_by and obj.uploaded_by.department:
@@ -729,6 +748,12 @@ class DocumentAdmin(admin.ModelAdmin):
             'uploaded_by__department'
             # uploaded_by__role kerak emas endi
         )
+    
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # Holat yoki joriy bosqich qo'lda o'zgartirilgan bo'lishi mumkin
+        if change and {'status', 'current_step'} & set(form.changed_data):
+            obj.sync_current_step_flag()
 
 
 
@@ -932,6 +957,7 @@ class JobRunAdmin(admin.ModelAdmin):
         'last_success_at',
         'last_error',
         'last_duration_ms',
+        'metrics',
     ]
 
     def has_add_permission(self, request):
@@ -940,15 +966,57 @@ class JobRunAdmin(admin.ModelAdmin):
     def has_change_permission(self, request, obj=None):
         return False
 
+@admin.register(EmailOutbox)
+class EmailOutboxAdmin(admin.ModelAdmin):
+    list_display = ['to_email', 'subject', 'notification_type', 'status', 'attempts', 'next_attempt_at', 'sent_at']
+    list_filter = ['status', 'notification_type', 'created_at']
+    search_fields = ['to_email', 'subject']
+    readonly_fields = [
+        'to_email',
+        'subject',
+        'message',
+        'html_message',
+        'notification_type',
+        'document',
+        'dedup_key',
+        'status',
+        'attempts',
+        'next_attempt_at',
+        'last_error',
+        'created_at',
+        'sent_at',
+    ]
+    actions = ['retry_now']
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.action(description="Tanlangan xatlarni hozir qayta yuborish")
+    def retry_now(self, request, queryset):
+        from .mailer import EmailOutboxService
+
+        now = timezone.now()
+        pending_keys = EmailOutbox.objects.filter(status='pending').values('dedup_key')
+        # Xuddi shu xat navbatda bo'lsa, muvaffaqiyatsizini qayta qo'shmaslik (dedup cheklovi)
+        updated = queryset.filter(status='failed').exclude(dedup_key__in=pending_keys).update(
+            status='pending', attempts=0, next_attempt_at=now
+        )
+        updated += queryset.filter(status='pending').update(next_attempt_at=now)
+        transaction.on_commit(EmailOutboxService.schedule_drain)
+        self.message_user(request, f"{updated} ta xat navbatga qaytarildi.")
+
+
 # ==================== CUSTOM ACTIONS ====================
 
 @admin.action(description="Tanlangan rollarni faollashtirish")
 def activate_roles(modeladmin, request, queryset):
     queryset.update(is_active=True)
+    RoleRegistry.invalidate()
 
 @admin.action(description="Tanlangan rollarni faolsizlashtirish")
 def deactivate_roles(modeladmin, request, queryset):
     queryset.update(is_active=False)
+    RoleRegistry.invalidate()
 
 @admin.action(description="Tanlangan rollarni standart qilish")
 def make_default_roles(modeladmin, request, queryset):
@@ -957,6 +1025,7 @@ def make_default_roles(modeladmin, request, queryset):
         Role.objects.filter(role_type=role.role_type).update(is_default=False)
     # Keyin tanlanganlarni standart qilish
     queryset.update(is_default=True)
+    RoleRegistry.invalidate()
 
 # Role admin uchun action'larni qo'shish
 RoleAdmin.actions = [activate_roles, deactivate_roles, make_default_roles]
@@ -1020,3 +1089,48 @@ def add_role_to_users_view(request):
         'user_ids': user_ids,
         'roles': roles,
     })
+
+
+@admin.register(UploadSession)
+class UploadSessionAdmin(admin.ModelAdmin):
+    list_display = ['file_name', 'user', 'document_type', 'status', 'received_bytes', 'total_size', 'updated_at']
+    list_filter = ['status', 'document_type']
+    search_fields = ['file_name', 'user__username']
+    readonly_fields = [
+        'id',
+        'user',
+        'document_type',
+        'file_name',
+        'total_size',
+        'chunk_size',
+        'received_chunks',
+        'received_bytes',
+        'status',
+        'document',
+        'created_at',
+        'updated_at',
+    ]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(StoredBlob)
+class StoredBlobAdmin(admin.ModelAdmin):
+    list_display = ['name', 'size', 'ref_count', 'created_at', 'updated_at']
+    list_filter = ['ref_count']
+    search_fields = ['sha256', 'name']
+    readonly_fields = ['sha256', 'name', 'size', 'ref_count', 'derivation_key', 'created_at', 'updated_at']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        # Fayllar faqat collect_unreferenced_blobs orqali o'chiriladi
+        return False
@@ -0,0 +1,253 @@
+"""
+Approver directory: (role, scope) -> approver user id.
+
+Workflow instantiation asks "who approves role X for this uploader?".  The
+answer depends only on the uploader's faculty/department (or on the
+subject/group/year allocation for teacher steps), so it is cached per scope
+in the cache backend instead of being queried for every document.
+
+Entries are refreshed on commit whenever a User's active role or
+organisational fields change, or a TeachingAllocation is saved/deleted
+(see signals.py).  flush() bumps the key prefix and drops everything at once.
+"""
+
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+
+from .roles import RoleRegistry
+
+
+# Faqat rol tipi bo'yicha (butun universitet uchun bitta) tasdiqlovchilar
+GLOBAL_ROLES = ('director', 'director_deputy', 'academic_office', 'registration_office')
+
+# Topilmagan tasdiqlovchi ham keshlanadi, aks holda har safar bazaga boriladi
+MISSING = 0
+
+
+class ApproverDirectory:
+    VERSION_KEY = "approvers:version"
+
+    # ==================== PUBLIC API ====================
+
+    @classmethod
+    def resolve_for_document(cls, document, roles):
+        """Bitta hujjat uchun {rol: user_id}"""
+        return cls.resolve_many([document], roles)[0]
+
+    @classmethod
+    def resolve_many(cls, documents, roles=None):
+        """
+        Ko'p hujjat uchun tasdiqlovchilarni bir vaqtda aniqlash (import, qayta
+        yo'naltirish). Har bir hujjat uchun {rol: user_id} ro'yxatini qaytaradi.
+        `roles` berilmasa hujjat turining approval_workflow'i olinadi, shuning uchun
+        katta ro'yxatlar uchun select_related('uploaded_by', 'document_type') tavsiya etiladi.
+        """
+        plans = []
+        wanted = set()
+        for document in documents:
+            document_roles = roles if roles is not None else (document.document_type.approval_workflow or [])
+            keys = {}
+            for role in dict.fromkeys(document_roles):
+                role_keys = cls._keys_for(document, role)
+                if role_keys:
+                    keys[role] = role_keys
+                    wanted.update(role_keys)
+            plans.append(keys)
+
+        values = cls._get_many(wanted)
+
+        results = []
+        for keys in plans:
+            resolved = {}
+            for role, role_keys in keys.items():
+                for key in role_keys:
+                    user_id = values.get(key, MISSING)
+                    if user_id != MISSING:
+                        resolved[role] = user_id
+                        break
+            results.append(resolved)
+        return results
+
+    @classmethod
+    def refresh(cls, keys):
+        """Berilgan kalitlarni bazadan qayta hisoblab keshga yozish"""
+        keys = set(keys)
+        if not keys:
+            return {}
+        values = cls._compute(keys)
+        cls._store(values)
+        return values
+
+    @classmethod
+    def refresh_on_commit(cls, keys):
+        keys = set(keys)
+        if keys:
+            transaction.on_commit(lambda: cls.refresh(keys))
+
+    @classmethod
+    def flush(cls):
+        """Butun katalogni bekor qilish (masalan, rol tipi o'zgarganda)"""
+        try:
+            cache.set(cls.VERSION_KEY, uuid.uuid4().hex, None)
+        except Exception:
+            pass
+
+    # ==================== SCOPE KEYS ====================
+
+    @staticmethod
+    def _keys_for(document, role):
+        """
+        Rol uchun tekshiriladigan kalitlar, ustuvorlik tartibida.
+        Kalit: (rol, scope) - scope fakultet/kafedra id si yoki fan taqsimoti.
+        """
+        uploader = document.uploaded_by
+        if role == 'department_head':
+            return [(role, uploader.department_id)] if uploader.department_id else []
+        if role == 'faculty_dean':
+            return [(role, uploader.faculty_id)] if uploader.faculty_id else []
+        if role == 'dean_deputy':
+            return [(role, uploader.faculty_id)]
+        if role in GLOBAL_ROLES:
+            return [(role, None)]
+        if role == 'teacher':
+            keys = []
+            # Agar hujjat aniq bir fan va guruhga bog'langan bo'lsa, o'sha fandan dars beruvchi
+            if document.subject_id and document.related_group_id and document.academic_year_id:
+                keys.append(
+                    ('allocation', (document.subject_id, document.related_group_id, document.academic_year_id))
+                )
+            # Aks holda kafedradagi istalgan o'qituvchi
+            keys.append((role, uploader.department_id))
+            return keys
+        return []
+
+    @staticmethod
+    def keys_for_user_scope(scope):
+        """
+        Foydalanuvchi qaysi kalitlarga nomzod bo'lishi mumkin.
+        scope: User.APPROVER_SCOPE_FIELDS qiymatlari.
+        """
+        if scope is None:
+            return set()
+        active_role_id, faculty_id, department_id, managed_department_id, managed_faculty_id = scope
+        role = RoleRegistry.get_by_id(active_role_id)
+        role_type = role.role_type if role else None
+
+        keys = set()
+        if managed_department_id:
+            keys.add(('department_head', managed_department_id))
+        if managed_faculty_id:
+            keys.add(('faculty_dean', managed_faculty_id))
+        if role_type == 'dean_deputy':
+            keys.add(('dean_deputy', faculty_id))
+        elif role_type in GLOBAL_ROLES:
+            keys.add((role_type, None))
+        elif role_type == 'teacher':
+            keys.add(('teacher', department_id))
+        return keys
+
+    # ==================== CACHE ====================
+
+    @classmethod
+    def _get_many(cls, keys):
+        if not keys:
+            return {}
+        prefix = cls._prefix()
+        cache_keys = {cls._cache_key(prefix, key): key for key in keys}
+        try:
+            cached = cache.get_many(list(cache_keys))
+        except Exception:
+            cached = {}
+        values = {cache_keys[cache_key]: value for cache_key, value in cached.items()}
+
+        missing = set(keys) - set(values)
+        if missing:
+            computed = cls._compute(missing)
+            cls._store(computed, prefix)
+            values.update(computed)
+        return values
+
+    @classmethod
+    def _store(cls, values, prefix=None):
+        if not values:
+            return
+        prefix = prefix or cls._prefix()
+        timeout = getattr(settings, "APPROVER_DIRECTORY_TTL", 24 * 60 * 60)
+        try:
+            cache.set_many(
+                {cls._cache_key(prefix, key): value for key, value in values.items()},
+                timeout,
+            )
+        except Exception:
+            pass
+
+    @classmethod
+    def _prefix(cls):
+        try:
+            version = cache.get(cls.VERSION_KEY)
+            if version is None:
+                cache.add(cls.VERSION_KEY, uuid.uuid4().hex, None)
+                version = cache.get(cls.VERSION_KEY)
+        except Exception:
+            version = None
+        return f"approvers:{version}"
+
+    @staticmethod
+    def _cache_key(prefix, key):
+        role, scope = key
+        if isinstance(scope, tuple):
+            scope = "-".join(str(part) for part in scope)
+        return f"{prefix}:{role}:{scope}"
+
+    # ==================== DATABASE ====================
+
+    @classmethod
+    def _compute(cls, keys):
+        """Kalitlar uchun tasdiqlovchilarni ikki so'rovgacha hisoblash"""
+        from .models import TeachingAllocation, User
+
+        values = {key: MISSING for key in keys}
+        allocation_keys = [key for key in keys if key[0] == 'allocation']
+        user_keys = [key for key in keys if key[0] != 'allocation']
+
+        if allocation_keys:
+            condition = Q()
+            for _, (subject_id, group_id, academic_year_id) in allocation_keys:
+                condition |= Q(subject_id=subject_id, group_id=group_id, academic_year_id=academic_year_id)
+            rows = TeachingAllocation.objects.filter(condition).order_by('pk').values_list(
+                'subject_id', 'group_id', 'academic_year_id', 'teacher_id'
+            )
+            for subject_id, group_id, academic_year_id, teacher_id in rows:
+                key = ('allocation', (subject_id, group_id, academic_year_id))
+                if values.get(key) == MISSING:
+                    values[key] = teacher_id
+
+        if user_keys:
+            condition = Q()
+            for role, scope in user_keys:
+                condition |= cls._user_condition(role, scope)
+            rows = User.objects.filter(condition).order_by('pk').values_list(
+                'pk', *User.APPROVER_SCOPE_FIELDS
+            )
+            for pk, *scope in rows:
+                for key in cls.keys_for_user_scope(scope):
+                    if values.get(key) == MISSING:
+                        values[key] = pk
+
+        return values
+
+    @staticmethod
+    def _user_condition(role, scope):
+        if role == 'department_head':
+            return Q(managed_department_id=scope)
+        if role == 'faculty_dean':
+            return Q(managed_faculty_id=scope)
+        if role == 'dean_deputy':
+            return Q(active_role__role_type=role, faculty_id=scope)
+        if role == 'teacher':
+            return Q(active_role__role_type=role, department_id=scope)
+        return Q(active_role__role_type=role)
@@ -6,6 +6,7 @@ class DocumentsConfig(AppConfig):
     name = 'documents'
 
     def ready(self):
+        from documents import signals  # noqa: F401
         from documents.seed import seed_demo_data
 
         def _seed(sender, **kwargs):
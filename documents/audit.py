@@ -0,0 +1,177 @@
+"""
+Buffered writer for HTTP audit records.
+
+AuditRequestMiddleware hands every request to RequestLogBuffer instead of
+writing to the database itself.  Entries wait in a bounded in-process queue
+and a daemon thread writes them to logs/audit.log and to request_logs with a
+single bulk_create per batch.  When the queue is full the entry is written
+only to the audit file and counted as dropped, so a slow database never
+blocks the request thread.
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+
+
+class RequestLogBuffer:
+
+    def __init__(self, max_size=10000, batch_size=100, flush_interval_ms=1000):
+        self.max_size = max_size
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(flush_interval_ms, 1) / 1000.0
+        self.logger = logging.getLogger("audit")
+
+        self._lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        self._pid = None
+
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            max_size=getattr(settings, "AUDIT_LOG_QUEUE_SIZE", 10000),
+            batch_size=getattr(settings, "AUDIT_LOG_BATCH_SIZE", 100),
+            flush_interval_ms=getattr(settings, "AUDIT_LOG_FLUSH_INTERVAL_MS", 1000),
+        )
+
+    def submit(self, log_entry, record):
+        """
+        Navbatga yozuv qo'shish. Navbat to'la bo'lsa yozuv faqat faylga
+        tushadi va `dropped` hisoblagichi oshadi.
+        """
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait((log_entry, record))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+                dropped_total = self.dropped
+            overflow_entry = dict(log_entry, db_dropped=True, dropped_total=dropped_total)
+            self._write_file([overflow_entry])
+            return False
+
+        with self._lock:
+            self.enqueued += 1
+        return True
+
+    def write_now(self, log_entry, record):
+        """Navbatsiz, joriy oqimda yozish (AUDIT_LOG_ASYNC=False uchun)."""
+        self._write_batch([(log_entry, record)])
+
+    def flush(self):
+        """Navbatdagi barcha yozuvlarni joriy oqimda yozib tugatish."""
+        if self._queue is None or self._pid != os.getpid():
+            return
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+            if len(batch) >= self.batch_size:
+                self._write_batch(batch)
+                batch = []
+        if batch:
+            self._write_batch(batch)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queued": self._queue.qsize() if self._queue is not None else 0,
+                "enqueued": self.enqueued,
+                "written": self.written,
+                "dropped": self.dropped,
+                "failed": self.failed,
+            }
+
+    def _ensure_worker(self):
+        pid = os.getpid()
+        if self._pid == pid and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == pid and self._thread is not None and self._thread.is_alive():
+                return
+            # Fork'dan keyin (gunicorn) oqim yangi jarayonda mavjud bo'lmaydi
+            if self._pid != pid or self._queue is None:
+                self._queue = queue.Queue(maxsize=self.max_size)
+            self._pid = pid
+            self._thread = threading.Thread(
+                target=self._run,
+                name="request-log-flusher",
+                daemon=True,
+            )
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            if batch:
+                self._write_batch(batch)
+
+    def _collect_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write_batch(self, batch):
+        from .models import RequestLog
+
+        self._write_file([log_entry for log_entry, _ in batch])
+
+        close_old_connections()
+        try:
+            RequestLog.objects.bulk_create(
+                [RequestLog(**record) for _, record in batch],
+                batch_size=self.batch_size,
+            )
+        except Exception:
+            # Audit yozuvi hech qachon so'rov oqimini buzmasligi kerak
+            with self._lock:
+                self.failed += len(batch)
+        else:
+            with self._lock:
+                self.written += len(batch)
+        finally:
+            close_old_connections()
+
+    def _write_file(self, entries):
+        for entry in entries:
+            try:
+                self.logger.info(json.dumps(entry, ensure_ascii=False, default=str))
+            except Exception:
+                pass
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_request_log_buffer():
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = RequestLogBuffer.from_settings()
+                atexit.register(_buffer.flush)
+    return _buffer
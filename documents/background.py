@@ -0,0 +1,110 @@
+"""
+In-process background execution for deployments without a Celery broker.
+
+Heavy follow-up work (final PDF stamping, draining the email outbox) must
+not run inside the request that triggered it.  With a broker it goes to a
+Celery worker; without one it is handed to BackgroundRunner, which keeps
+one single-thread executor per pool in each process, so at most one job
+per pool competes with the page threads and everything else waits in the
+pool's queue.
+
+Executor threads are not daemons: when gunicorn recycles the worker
+(--max-requests) the interpreter finishes the running and queued jobs
+before exiting.  A hard kill still loses them, which is why the jobs
+themselves are safe to lose (leases, outbox rows) and are picked up again
+by the next request or scheduled run.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection
+
+
+class BackgroundRunner:
+    _lock = threading.Lock()
+    _executors = {}
+    _pending = set()
+    _timers = {}
+
+    @classmethod
+    def submit(cls, pool, func, *args, key=None):
+        """
+        func(*args) ni pool navbatiga qo'yish. key berilsa va shu kalitli ish hali
+        boshlanmagan bo'lsa, yangisi qo'shilmaydi (bir nechta chaqiruv bittaga birlashadi).
+        """
+        with cls._lock:
+            if key is not None:
+                if key in cls._pending:
+                    return False
+                cls._pending.add(key)
+            executor = cls._executor(pool)
+        executor.submit(cls._run, func, args, key)
+        return True
+
+    @classmethod
+    def submit_later(cls, delay_seconds, pool, func, *args, key):
+        """Ishni delay_seconds'dan keyin navbatga qo'yish. Kalit bo'yicha eng erta muddat saqlanadi"""
+        delay_seconds = max(delay_seconds, 1)
+        due_at = time.monotonic() + delay_seconds
+        with cls._lock:
+            current = cls._timers.get(key)
+            if current is not None and current.due_at <= due_at:
+                return False
+            if current is not None:
+                current.cancel()
+            timer = threading.Timer(delay_seconds, cls._fire, args=(key, pool, func, args))
+            timer.daemon = True
+            timer.due_at = due_at
+            cls._timers[key] = timer
+        timer.start()
+        return True
+
+    @classmethod
+    def is_scheduled(cls, key):
+        """Kalitli ish navbatda yoki taymerda kutib turibdimi (joriy jarayonda)"""
+        with cls._lock:
+            return key in cls._pending or key in cls._timers
+
+    @classmethod
+    def _fire(cls, key, pool, func, args):
+        with cls._lock:
+            cls._timers.pop(key, None)
+        cls.submit(pool, func, *args, key=key)
+
+    @classmethod
+    def _executor(cls, pool):
+        # Fork'dan (gunicorn) oldin yaratilgan executor'ning oqimlari yangi jarayonda yo'q
+        pid = os.getpid()
+        entry = cls._executors.get(pool)
+        if entry is None or entry[0] != pid:
+            if entry is not None:
+                cls._pending.clear()
+                cls._timers.clear()
+            entry = (pid, ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"background-{pool}"))
+            cls._executors[pool] = entry
+        return entry[1]
+
+    @classmethod
+    def _run(cls, func, args, key):
+        if key is not None:
+            with cls._lock:
+                cls._pending.discard(key)
+        try:
+            func(*args)
+        except Exception as e:
+            print(f"Background job {getattr(func, '__qualname__', func)} failed: {str(e)}")
+        finally:
+            connection.close()
+
+    @classmethod
+    def stats(cls):
+        """Jarayondagi navbatlar (jobs_health)"""
+        with cls._lock:
+            return {
+                pool: executor._work_queue.qsize()
+                for pool, (pid, executor) in cls._executors.items()
+                if pid == os.getpid()
+            }
@@ -0,0 +1,237 @@
+"""
+Content-addressed storage for document files.
+
+Every uploaded file and every stamped final PDF is stored under the SHA-256
+of its bytes (``blobs/ab/<sha256>.pdf``).  A teacher re-submitting the same
+syllabus after a rejection therefore costs one hashing pass and one UPDATE:
+the bytes already on disk are referenced again instead of copied.
+
+StoredBlob.ref_count counts the Hujjat.file / Hujjat.final_pdf values that
+point at a blob.  Releasing the last reference does not delete anything
+immediately - a concurrent upload of the same content may be about to reuse
+it - collect_garbage() removes blobs that stayed unreferenced for a grace
+period, after re-checking the documents table.
+
+A new blob's file is written inside the transaction that creates its row,
+and Django has no rollback hook: when an outer transaction rolls back, the
+file stays on disk without a row.  collect_garbage() therefore also sweeps
+files under ``blobs/`` that have no StoredBlob row and are older than the
+grace period.  With a broker the collection runs from Celery Beat; without
+one, schedule_gc() keeps a BackgroundRunner timer armed for the next run.
+"""
+
+import hashlib
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Hujjat, JobRun, StoredBlob
+
+
+class BlobStore:
+    PREFIX = 'blobs'
+    GC_SCHEDULED_KEY = 'blobs:gc'
+    GC_TASK_NAME = 'documents.tasks.collect_unreferenced_blobs'
+
+    @staticmethod
+    def storage():
+        return Hujjat._meta.get_field('file').storage
+
+    @classmethod
+    def blob_name(cls, sha256, extension=''):
+        return f"{cls.PREFIX}/{sha256[:2]}/{sha256}{extension}"
+
+    @staticmethod
+    def digest(content):
+        """Faylni bir marta oqim bilan o'qib SHA-256 hisoblash (xotiraga yig'ilmaydi)"""
+        hasher = hashlib.sha256()
+        for chunk in content.chunks():
+            hasher.update(chunk)
+        return hasher.hexdigest()
+
+    # ==================== PUT / REFERENCES ====================
+
+    @classmethod
+    def put(cls, content, extension='', derivation_key=None):
+        """
+        Mazmunni saqlash va unga bitta havola olish. Bunday mazmun allaqachon
+        bo'lsa, storage'ga hech narsa yozilmaydi. StoredBlob qaytaradi.
+        """
+        sha256 = cls.digest(content)
+        with transaction.atomic():
+            # sha256 unique: bir xil yangi faylni parallel yozayotganlar shu qatorda navbatga turadi
+            blob, created = StoredBlob.objects.select_for_update().get_or_create(
+                sha256=sha256,
+                defaults={
+                    'name': cls.blob_name(sha256, extension),
+                    'size': content.size,
+                    'ref_count': 1,
+                    'derivation_key': derivation_key,
+                },
+            )
+            if created:
+                cls._write(blob, content)
+                # Tranzaksiya bekor qilinsa fayl qatorsiz qoladi - uni GC tozalaydi
+                cls.schedule_gc()
+            else:
+                blob.ref_count += 1
+                update_fields = ['ref_count', 'updated_at']
+                if derivation_key and not blob.derivation_key:
+                    blob.derivation_key = derivation_key
+                    update_fields.append('derivation_key')
+                blob.save(update_fields=update_fields)
+        return blob
+
+    @classmethod
+    def _write(cls, blob, content):
+        storage = cls.storage()
+        # Bekor qilingan tranzaksiyadan qolgan (yarim yozilgan bo'lishi mumkin) fayl
+        if storage.exists(blob.name):
+            storage.delete(blob.name)
+        saved_name = storage.save(blob.name, content)
+        if saved_name != blob.name:
+            blob.name = saved_name
+            blob.save(update_fields=['name', 'updated_at'])
+
+    @classmethod
+    def store(cls, field_file, previous_name=None):
+        """
+        Hali saqlanmagan FieldFile'ni blob sifatida saqlash (Hujjat.save).
+        Almashtirilgan eski faylning havolasi bo'shatiladi.
+        """
+        extension = os.path.splitext(field_file.name)[1].lower()
+        blob = cls.put(field_file.file, extension)
+        field_file.name = blob.name
+        field_file._committed = True
+        if previous_name:
+            cls.release(previous_name)
+        return blob
+
+    @staticmethod
+    def acquire(blob):
+        StoredBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1, updated_at=timezone.now())
+
+    @classmethod
+    def release(cls, name):
+        """Havolani bo'shatish. Blob bo'lmagan (eski yo'ldagi) fayllarga ta'sir qilmaydi"""
+        if not name:
+            return
+        released = StoredBlob.objects.filter(name=name, ref_count__gt=0).update(
+            ref_count=F('ref_count') - 1, updated_at=timezone.now()
+        )
+        if released:
+            cls.schedule_gc()
+
+    @staticmethod
+    def find_derived(derivation_key):
+        if not derivation_key:
+            return None
+        return StoredBlob.objects.filter(derivation_key=derivation_key).first()
+
+    # ==================== GARBAGE COLLECTION ====================
+
+    @classmethod
+    def collect_garbage(cls, grace_hours=None):
+        """
+        Havolasiz qolgan blob'larni o'chirish. Har bir nomzod qulf ostida hujjatlar
+        jadvalidan qayta tekshiriladi: hisob adashgan bo'lsa, o'chirilmaydi, tuzatiladi.
+        """
+        if grace_hours is None:
+            grace_hours = getattr(settings, 'BLOB_GC_GRACE_HOURS', 24)
+        cutoff = timezone.now() - timedelta(hours=grace_hours)
+        storage = cls.storage()
+        result = {'deleted': 0, 'freed_bytes': 0, 'repaired': 0, 'orphans': 0}
+
+        result['orphans'] = cls._sweep_orphan_files(storage, cutoff)
+
+        candidate_ids = list(
+            StoredBlob.objects.filter(ref_count=0, updated_at__lt=cutoff).values_list('pk', flat=True)
+        )
+        for blob_id in candidate_ids:
+            with transaction.atomic():
+                blob = StoredBlob.objects.select_for_update().filter(pk=blob_id, ref_count=0).first()
+                if blob is None:
+                    continue
+                references = Hujjat.objects.filter(Q(file=blob.name) | Q(final_pdf=blob.name)).count()
+                if references:
+                    blob.ref_count = references
+                    blob.save(update_fields=['ref_count', 'updated_at'])
+                    result['repaired'] += 1
+                    continue
+                try:
+                    storage.delete(blob.name)
+                except Exception as e:
+                    print(f"Blob delete failed ({blob.name}): {str(e)}")
+                    continue
+                blob.delete()
+                result['deleted'] += 1
+                result['freed_bytes'] += blob.size
+        return result
+
+    @classmethod
+    def _sweep_orphan_files(cls, storage, cutoff):
+        """
+        blobs/ ostidagi StoredBlob qatori yo'q fayllarni o'chirish (bekor qilingan
+        tranzaksiyalardan qolganlar). Yangi fayllarga grace muddati tegmaydi:
+        ularning qatori hali commit bo'lmagan bo'lishi mumkin.
+        """
+        deleted = 0
+        try:
+            directories, _ = storage.listdir(cls.PREFIX)
+        except FileNotFoundError:
+            return deleted
+        for directory in directories:
+            _, files = storage.listdir(f"{cls.PREFIX}/{directory}")
+            names = [f"{cls.PREFIX}/{directory}/{file_name}" for file_name in files]
+            known = set(StoredBlob.objects.filter(name__in=names).values_list('name', flat=True))
+            for name in names:
+                if name in known:
+                    continue
+                try:
+                    if storage.get_modified_time(name) >= cutoff:
+                        continue
+                    storage.delete(name)
+                except Exception as e:
+                    print(f"Orphan blob delete failed ({name}): {str(e)}")
+                    continue
+                deleted += 1
+        return deleted
+
+    @classmethod
+    def schedule_gc(cls):
+        """
+        Brokersiz rejimda keyingi GC'ni jarayon taymeriga qo'yish. Muddat JobRun'dagi
+        oxirgi ishga tushirishdan hisoblanadi, shuning uchun worker qayta ishga
+        tushishi GC'ni kechiktirmaydi. Broker bo'lsa GC'ni Celery Beat boshqaradi.
+        """
+        if getattr(settings, 'CELERY_BROKER_URL', ''):
+            return
+        from .background import BackgroundRunner
+
+        if BackgroundRunner.is_scheduled(cls.GC_SCHEDULED_KEY):
+            return
+        interval = timedelta(hours=getattr(settings, 'BLOB_GC_INTERVAL_HOURS', 24))
+        last_run_at = (
+            JobRun.objects.filter(task_name=cls.GC_TASK_NAME)
+            .values_list('last_run_at', flat=True)
+            .first()
+        )
+        delay = 0
+        if last_run_at is not None:
+            delay = (last_run_at + interval - timezone.now()).total_seconds()
+        BackgroundRunner.submit_later(
+            delay, 'maintenance', cls._collect_in_background, key=cls.GC_SCHEDULED_KEY
+        )
+
+    @classmethod
+    def _collect_in_background(cls):
+        from .tasks import collect_unreferenced_blobs
+
+        try:
+            collect_unreferenced_blobs()
+        finally:
+            cls.schedule_gc()
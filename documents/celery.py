@@ -1,26 +1,50 @@
+import os
+
 from celery import Celery
 from celery.schedules import crontab
 
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'unidoc.settings')
+
 app = Celery('university_workflow')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
 
 # Scheduled Tasks
 app.conf.beat_schedule = {
-    'auto-approve-overdue-hourly': {
-        'task': 'documents.tasks.auto_approve_overdue_documents',
-        'schedule': crontab(minute=0),  # Every hour
+    'process-deadline-events': {
+        'task': 'documents.tasks.process_deadline_events',
+        'schedule': crontab(),  # Every minute (only due DeadlineEvent rows)
     },
-    'send-deadline-reminders': {
-        'task': 'documents.tasks.send_deadline_reminders',
-        'schedule': crontab(minute=0, hour='*/6'),  # Every 6 hours
+    'stamp-missing-final-pdfs': {
+        'task': 'documents.tasks.generate_final_pdfs_batch',
+        'schedule': crontab(minute=15),  # Hourly retry of failed/missed PDF stamping
+    },
+    'auto-approve-overdue-sweep': {
+        'task': 'documents.tasks.auto_approve_overdue_documents',
+        'schedule': crontab(minute=30, hour=3),  # Daily full sweep as a safety net
     },
     'cleanup-old-notifications': {
         'task': 'documents.tasks.cleanup_old_notifications',
         'schedule': crontab(minute=0, hour=2),  # Daily at 2 AM
     },
+    'reconcile-notification-counters': {
+        'task': 'documents.tasks.reconcile_notification_counters',
+        'schedule': crontab(minute=15, hour=2),  # Daily: fix drift from deletes that bypass the service
+    },
+    'cleanup-upload-sessions': {
+        'task': 'documents.tasks.cleanup_upload_sessions',
+        'schedule': crontab(minute=45, hour=2),  # Daily: abandoned chunked uploads
+    },
+    'collect-unreferenced-blobs': {
+        'task': 'documents.tasks.collect_unreferenced_blobs',
+        'schedule': crontab(minute=0, hour=4),  # Daily: files no document references
+    },
     'send-daily-summaries': {
         'task': 'documents.tasks.send_daily_summary_emails',
         'schedule': crontab(minute=0, hour=9),  # Daily at 9 AM
     },
+    'drain-email-outbox': {
+        'task': 'documents.tasks.drain_email_outbox',
+        'schedule': crontab(),  # Every minute (retries and missed wake-ups)
+    },
 }
\ No newline at end of file
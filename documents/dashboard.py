@@ -0,0 +1,59 @@
+"""
+Dashboard statistics.
+
+All of a user's document status counts come from one aggregate query, and
+the resulting blob is cached for a short time.  The workflow
+(ApprovalWorkflowService, Hujjat.save, NotificationService) drops the blob
+of every affected user after commit, so the TTL only bounds staleness for
+changes that bypass those paths.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q
+
+
+class DashboardStatsService:
+    CACHE_KEY = "dashboard:stats:{user_id}"
+
+    @classmethod
+    def get_stats(cls, user):
+        """Foydalanuvchi statistikasi (faol rol bo'yicha keshlanadi)"""
+        role_type = user.get_active_role_type()
+        key = cls.CACHE_KEY.format(user_id=user.pk)
+        stats = cache.get(key)
+        if stats is None or stats.get('role_type') != role_type:
+            stats = cls.compute(user)
+            stats['role_type'] = role_type
+            cache.set(key, stats, getattr(settings, "DASHBOARD_STATS_TTL", 60))
+        return stats
+
+    @classmethod
+    def compute(cls, user):
+        from .models import Hujjat
+        from .notifications import NotificationService
+        from .services import ApprovalWorkflowService
+
+        counts = Hujjat.objects.filter(uploaded_by=user).aggregate(
+            my_documents_total=Count('id'),
+            my_approved=Count('id', filter=Q(status='approved')),
+            my_pending=Count('id', filter=Q(status='pending_approval')),
+            my_rejected=Count('id', filter=Q(status='rejected')),
+        )
+        counts['pending_approvals'] = ApprovalWorkflowService.get_pending_approvals_for_user(user).count()
+        counts['unread_notifications'] = NotificationService.get_unread_count(user)
+        return counts
+
+    @classmethod
+    def invalidate(cls, *user_ids):
+        """Tranzaksiya yakunlangach foydalanuvchilar statistikasini tashlab yuborish"""
+        keys = [cls.CACHE_KEY.format(user_id=user_id) for user_id in set(user_ids) if user_id]
+        if keys:
+            transaction.on_commit(lambda: cache.delete_many(keys))
+
+    @classmethod
+    def invalidate_for_document(cls, document):
+        """Hujjat muallifi va barcha bosqich tasdiqlovchilari"""
+        approver_ids = document.approval_steps.exclude(approver=None).values_list('approver_id', flat=True)
+        cls.invalidate(document.uploaded_by_id, *approver_ids)
@@ -0,0 +1,173 @@
+"""
+Deadline scheduler.
+
+Instead of scanning every pending step on a timer, each step that becomes
+the current one (or whose deadline changes) gets DeadlineEvent rows for
+its 24h reminder, 2h reminder and overdue marks.  A minutely task takes
+only the events that are due, so the steady-state cost follows the number
+of deadlines reached, not the size of the pending backlog.
+
+Events are hints, not state: when an event fires, the step is re-checked
+(still pending, still current, deadline still in range) before anything
+is done, so stale events are simply dropped.  An event is deleted in the
+same transaction that handles it, so a failure or a crashed worker leaves
+it in place for the next run; an overdue event whose document was locked
+by an interactive approval is pushed back a minute instead of being lost.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+
+def event_times(deadline, has_approver, now=None):
+    """
+    Bosqich uchun [(tur, vaqt)] ro'yxati. Eslatmalar faqat tasdiqlovchi bo'lsa va
+    deadline hali o'tmagan bo'lsa; kechasi tushadigan 2 soatlik eslatma kechki
+    EARLY_NOTIFY_HOUR ga suriladi.
+    """
+    from .services import ApprovalWorkflowService
+
+    now = now or timezone.now()
+    events = [('overdue', deadline)]
+    if not has_approver or deadline <= now:
+        return events
+
+    events.append(('reminder_24h', deadline - timedelta(hours=24)))
+
+    reminder_2h = deadline - timedelta(hours=2)
+    night_start, night_end = ApprovalWorkflowService.NIGHT_HOURS
+    local = timezone.localtime(reminder_2h)
+    if local.hour >= night_start or local.hour < night_end:
+        evening = local.replace(
+            hour=ApprovalWorkflowService.EARLY_NOTIFY_HOUR, minute=0, second=0, microsecond=0
+        )
+        if local.hour < night_end:
+            evening -= timedelta(days=1)
+        reminder_2h = max(evening, now)
+    events.append(('reminder_2h', reminder_2h))
+    return events
+
+
+class DeadlineScheduler:
+
+    @staticmethod
+    def schedule(steps):
+        """
+        Bosqichlar uchun hodisalarni (qayta) yaratish. Bosqich joriy bo'lganda
+        yoki deadline'i o'zgarganda chaqiriladi; eski hodisalar almashtiriladi.
+        """
+        from .models import DeadlineEvent
+
+        steps = [step for step in steps if step is not None and step.pk]
+        if not steps:
+            return
+        now = timezone.now()
+        events = [
+            DeadlineEvent(step_id=step.pk, kind=kind, due_at=due_at)
+            for step in steps
+            if step.status == 'pending'
+            for kind, due_at in event_times(step.deadline, bool(step.approver_id), now)
+        ]
+        DeadlineEvent.objects.filter(step_id__in=[step.pk for step in steps]).delete()
+        DeadlineEvent.objects.bulk_create(events)
+
+    @staticmethod
+    def cancel(step_ids):
+        from .models import DeadlineEvent
+
+        DeadlineEvent.objects.filter(step_id__in=list(step_ids)).delete()
+
+    # ==================== PROCESSING ====================
+
+    @classmethod
+    def process_due(cls, batch_size=None):
+        """Vaqti kelgan hodisalarni bajarish. Natijalar yig'indisini qaytaradi"""
+        batch_size = batch_size or getattr(settings, 'DEADLINE_EVENT_BATCH_SIZE', 1000)
+        totals = {
+            'events': 0, 'approved_steps': 0, 'skipped_steps': 0,
+            'notified_24h': 0, 'notified_2h': 0, 'deferred_events': 0,
+        }
+        while True:
+            # Hodisa ishlovi bilan bir tranzaksiyada o'chadi: xato bo'lsa yoki jarayon yiqilsa qoladi
+            with transaction.atomic():
+                events = cls._claim(batch_size)
+                if not events:
+                    break
+                result = cls._handle(events)
+            totals['events'] += len(events)
+            for key in result:
+                totals[key] += result[key]
+            if len(events) < batch_size:
+                break
+        return totals
+
+    @staticmethod
+    def _claim(batch_size):
+        """
+        Vaqti kelgan hodisalarni bloklash (parallel ishchilar bir-birini kutmaydi).
+        Ochiq tranzaksiya ichida chaqiriladi; o'chirish _handle'da.
+        """
+        from .models import DeadlineEvent
+
+        return list(
+            DeadlineEvent.objects.select_for_update(skip_locked=True)
+            .filter(due_at__lte=timezone.now())
+            .order_by('due_at')
+            .values_list('pk', 'step_id', 'kind')[:batch_size]
+        )
+
+    @staticmethod
+    def _handle(events):
+        from .models import ApprovalStep, DeadlineEvent
+        from .services import ApprovalWorkflowService
+
+        now = timezone.now()
+        result = {}
+        step_ids = {kind: set() for kind, _ in DeadlineEvent.KIND_CHOICES}
+        for _, step_id, kind in events:
+            step_ids[kind].add(step_id)
+        deferred_step_ids = set()
+
+        current_pending = ApprovalStep.objects.filter(is_current=True, status='pending')
+
+        if step_ids['overdue']:
+            document_ids = list(
+                current_pending.filter(pk__in=step_ids['overdue'], deadline__lte=now)
+                .values_list('document_id', flat=True)
+            )
+            if document_ids:
+                approved = ApprovalWorkflowService.auto_approve_overdue_documents(document_ids=document_ids)
+                result['approved_steps'] = approved['approved_steps']
+                result['skipped_steps'] = approved['skipped_steps']
+                # SKIP LOCKED: hozir qo'lda tasdiqlanayotgan hujjatlar o'tkazib yuborilgan - hodisasi qoladi
+                deferred_step_ids = set(
+                    current_pending.filter(
+                        pk__in=step_ids['overdue'], deadline__lte=now, document__status='pending_approval'
+                    ).values_list('pk', flat=True)
+                )
+
+        reminder_ids = step_ids['reminder_24h'] | step_ids['reminder_2h']
+        if reminder_ids:
+            steps = list(
+                current_pending.filter(pk__in=reminder_ids, deadline__gt=now, approver__isnull=False)
+                .select_related('document', 'document__uploaded_by', 'approver')
+            )
+            notified = ApprovalWorkflowService._notify_deadline_steps(
+                [step for step in steps if step.pk in step_ids['reminder_24h']],
+                [step for step in steps if step.pk in step_ids['reminder_2h']],
+                now,
+            )
+            result.update(notified)
+
+        handled = [pk for pk, step_id, kind in events if not (kind == 'overdue' and step_id in deferred_step_ids)]
+        DeadlineEvent.objects.filter(pk__in=handled).delete()
+        if deferred_step_ids:
+            # Shu ishga tushirishda qayta olinmasligi uchun bir daqiqaga suriladi
+            DeadlineEvent.objects.filter(step_id__in=deferred_step_ids, kind='overdue').update(
+                due_at=now + timedelta(minutes=1)
+            )
+        result['deferred_events'] = len(events) - len(handled)
+        return result
@@ -0,0 +1,152 @@
+"""
+Notification change events for the SSE stream.
+
+NotificationService publishes "something changed for user N" after commit;
+each open /api/notifications/stream/ connection waits on an asyncio queue
+and recomputes its unread count only when woken.  Idle subscribers cost a
+queue and a coroutine, not a thread.
+
+With REDIS_URL set, events travel over Redis pub/sub, so publishers in
+other processes (Celery workers, other web workers) reach every
+subscriber.  Each process holds one pattern subscription and fans
+messages out to its local queues.  Without Redis, events are delivered
+in-process only.
+"""
+
+import asyncio
+import json
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+
+
+class NotificationSubscription:
+
+    def __init__(self, bus, user_id):
+        self.bus = bus
+        self.user_id = user_id
+        self.loop = None
+        # Faqat "o'zgardi" signali kerak: navbatda bittadan ortiq xabar saqlanmaydi
+        self.queue = asyncio.Queue(maxsize=1)
+
+    async def __aenter__(self):
+        self.loop = asyncio.get_running_loop()
+        self.bus._add(self)
+        await self.bus._ensure_listener()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.bus._remove(self)
+
+    async def wait(self, timeout):
+        """O'zgarish bo'lsa True, timeout tugasa False"""
+        try:
+            await asyncio.wait_for(self.queue.get(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def _offer(self, message):
+        if not self.queue.full():
+            self.queue.put_nowait(message)
+
+
+class NotificationEventBus:
+    CHANNEL_PREFIX = "notifications:user:"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+        self._listeners = {}
+        self._client = None
+
+    @property
+    def redis_url(self):
+        return getattr(settings, "REDIS_URL", "")
+
+    def subscribe(self, user_id):
+        return NotificationSubscription(self, user_id)
+
+    def publish(self, user_id, event="changed"):
+        """Foydalanuvchi obunachilariga xabar berish (istalgan oqimdan chaqirish mumkin)"""
+        message = json.dumps({"user_id": user_id, "event": event})
+        if self.redis_url:
+            try:
+                self._get_client().publish(f"{self.CHANNEL_PREFIX}{user_id}", message)
+                return
+            except Exception as e:
+                print(f"Notification event publish failed: {e}")
+        self._dispatch(user_id, message)
+
+    def _dispatch(self, user_id, message):
+        with self._lock:
+            subscriptions = list(self._subscribers.get(user_id, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription._offer, message)
+            except RuntimeError:
+                # Event loop yopilgan - obuna tez orada o'chiriladi
+                pass
+
+    def _add(self, subscription):
+        with self._lock:
+            self._subscribers[subscription.user_id].add(subscription)
+
+    def _remove(self, subscription):
+        with self._lock:
+            subscriptions = self._subscribers.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscribers[subscription.user_id]
+
+    def _get_client(self):
+        if self._client is None:
+            import redis
+            self._client = redis.Redis.from_url(self.redis_url)
+        return self._client
+
+    async def _ensure_listener(self):
+        if not self.redis_url:
+            return
+        loop = asyncio.get_running_loop()
+        task = self._listeners.get(loop)
+        if task is None or task.done():
+            self._listeners[loop] = loop.create_task(self._listen())
+
+    async def _listen(self):
+        """Har bir event loop uchun bitta Redis obunasi"""
+        import redis.asyncio as aioredis
+
+        while True:
+            client = aioredis.Redis.from_url(self.redis_url)
+            pubsub = client.pubsub()
+            try:
+                await pubsub.psubscribe(f"{self.CHANNEL_PREFIX}*")
+                async for item in pubsub.listen():
+                    if item.get("type") != "pmessage":
+                        continue
+                    channel = item["channel"]
+                    if isinstance(channel, bytes):
+                        channel = channel.decode()
+                    try:
+                        user_id = int(channel[len(self.CHANNEL_PREFIX):])
+                    except ValueError:
+                        continue
+                    data = item["data"]
+                    self._dispatch(user_id, data.decode() if isinstance(data, bytes) else data)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Notification event listener error: {e}")
+                await asyncio.sleep(5)
+            finally:
+                try:
+                    await pubsub.aclose()
+                    await client.aclose()
+                except Exception:
+                    pass
+
+
+notification_bus = NotificationEventBus()
@@ -0,0 +1,269 @@
+"""
+Transactional email outbox.
+
+NotificationService never talks to SMTP directly: it writes an EmailOutbox
+row in the same transaction as the notification, so a slow mail server can
+no longer hold the document row lock or the user's request.  After commit
+a Celery worker drains the outbox in batches over one SMTP connection;
+failed messages are retried with exponential backoff.  Without a broker
+the drain runs on BackgroundRunner's single-thread "email" queue instead
+of in the request, and a timer re-arms it for the earliest retry, so
+backed-off messages go out without waiting for the next enqueue.
+
+Rows are claimed with SELECT ... FOR UPDATE SKIP LOCKED and leased by
+pushing next_attempt_at forward, so several workers can drain at once and
+a worker that dies mid-batch only delays its messages until the lease ends.
+
+BulkMailDispatcher covers scheduled bulk mail (daily summaries): messages
+are built in memory and sent in chunks over a single connection.
+"""
+
+import hashlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .models import EmailOutbox
+
+
+class EmailOutboxService:
+    DRAIN_SCHEDULED_KEY = "email_outbox:drain_scheduled"
+
+    # ==================== ENQUEUE ====================
+
+    @classmethod
+    def enqueue(cls, to_email, subject, message, notification_type='', document=None):
+        """
+        Xatni navbatga qo'yish (joriy tranzaksiya ichida).
+        Bir xil qabul qiluvchi + tur + hujjat + mavzu navbatda bo'lsa, qayta qo'shilmaydi.
+        """
+        if not to_email:
+            return False
+
+        entry = EmailOutbox(
+            to_email=to_email,
+            subject=subject[:255],
+            message=message,
+            html_message=cls._render_html(subject, message, notification_type, document) or '',
+            notification_type=notification_type or '',
+            document=document,
+            dedup_key=cls.dedup_key(to_email, subject, notification_type, document),
+        )
+        EmailOutbox.objects.bulk_create([entry], ignore_conflicts=True)
+        transaction.on_commit(cls.schedule_drain)
+        return True
+
+    @staticmethod
+    def dedup_key(to_email, subject, notification_type='', document=None):
+        document_id = document.pk if document is not None else ''
+        raw = f"{to_email.lower()}|{notification_type}|{document_id}|{subject}"
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    @staticmethod
+    def _render_html(subject, message, notification_type, document):
+        if document is None:
+            return None
+        try:
+            return render_to_string('emails/notification.html', {
+                'subject': subject,
+                'message': message,
+                'notification_type': notification_type,
+                'document': document,
+                'site_url': getattr(settings, 'SITE_URL', 'http://localhost:8000'),
+            })
+        except Exception as e:
+            # Shablon bo'lmasa xat oddiy matn sifatida yuboriladi
+            print(f"Email template rendering failed: {str(e)}")
+            return None
+
+    @classmethod
+    def schedule_drain(cls):
+        """
+        Commit'dan keyin yuborishni boshlash. Broker sozlangan bo'lsa Celery
+        vazifasi (bir necha soniya ichidagi chaqiruvlar bittaga birlashtiriladi),
+        aks holda jarayonning fon navbatida (so'rov SMTP'ni kutmaydi).
+        """
+        if not getattr(settings, 'CELERY_BROKER_URL', ''):
+            from .background import BackgroundRunner
+            BackgroundRunner.submit('email', cls._drain_in_background, key=cls.DRAIN_SCHEDULED_KEY)
+            return
+        try:
+            if not cache.add(cls.DRAIN_SCHEDULED_KEY, 1, getattr(settings, 'EMAIL_OUTBOX_COALESCE_SECONDS', 2)):
+                return
+        except Exception:
+            pass
+        try:
+            from .tasks import drain_email_outbox
+            drain_email_outbox.delay()
+        except Exception as e:
+            # Navbat yo'qolmaydi - har daqiqalik beat vazifasi uni yuboradi
+            print(f"Email outbox drain scheduling failed: {str(e)}")
+
+    @classmethod
+    def _drain_in_background(cls):
+        """Brokersiz rejim: navbatni yuborib, keyingi qayta urinish vaqtiga taymer qo'yish"""
+        from .background import BackgroundRunner
+
+        cls.drain()
+        next_attempt_at = (
+            EmailOutbox.objects.filter(status='pending')
+            .order_by('next_attempt_at')
+            .values_list('next_attempt_at', flat=True)
+            .first()
+        )
+        if next_attempt_at is not None:
+            delay = (next_attempt_at - timezone.now()).total_seconds()
+            BackgroundRunner.submit_later(
+                delay, 'email', cls._drain_in_background, key=cls.DRAIN_SCHEDULED_KEY
+            )
+
+    # ==================== DRAIN ====================
+
+    @classmethod
+    def drain(cls, batch_size=None, max_batches=None):
+        """Navbatdagi xatlarni paketlab yuborish. {'sent', 'retried', 'failed'} qaytaradi"""
+        batch_size = batch_size or getattr(settings, 'EMAIL_OUTBOX_BATCH_SIZE', 50)
+        totals = {'sent': 0, 'retried': 0, 'failed': 0}
+        connection = None
+        batches = 0
+        try:
+            while max_batches is None or batches < max_batches:
+                entries = cls._claim(batch_size)
+                if not entries:
+                    break
+                batches += 1
+                if connection is None:
+                    try:
+                        connection = get_connection(fail_silently=False)
+                        connection.open()
+                    except Exception as e:
+                        # SMTP ishlamayapti - paket keyinroq qayta urinib ko'riladi
+                        print(f"Email connection failed: {str(e)}")
+                        result = cls._record_results([], entries, str(e))
+                        totals['retried'] += result['retried']
+                        totals['failed'] += result['failed']
+                        connection = None
+                        break
+                result = cls._send_batch(connection, entries)
+                for key in totals:
+                    totals[key] += result[key]
+                if len(entries) < batch_size:
+                    break
+        finally:
+            if connection is not None:
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+        return totals
+
+    @staticmethod
+    def _claim(batch_size):
+        """Paketni band qilish: boshqa ishchilar qulflangan qatorlarni o'tkazib yuboradi"""
+        now = timezone.now()
+        lease = timedelta(seconds=getattr(settings, 'EMAIL_OUTBOX_LEASE_SECONDS', 300))
+        with transaction.atomic():
+            entries = list(
+                EmailOutbox.objects.select_for_update(skip_locked=True)
+                .filter(status='pending', next_attempt_at__lte=now)
+                .order_by('next_attempt_at', 'pk')[:batch_size]
+            )
+            if entries:
+                EmailOutbox.objects.filter(pk__in=[entry.pk for entry in entries]).update(
+                    next_attempt_at=now + lease
+                )
+        return entries
+
+    @classmethod
+    def _send_batch(cls, connection, entries):
+        sent, retry = [], []
+        for entry in entries:
+            email = EmailMultiAlternatives(
+                subject=entry.subject,
+                body=entry.message,
+                from_email=settings.DEFAULT_FROM_EMAIL,
+                to=[entry.to_email],
+                connection=connection,
+            )
+            if entry.html_message:
+                email.attach_alternative(entry.html_message, 'text/html')
+            try:
+                connection.send_messages([email])
+                sent.append(entry)
+            except Exception as e:
+                print(f"Email sending failed: {str(e)}")
+                entry.last_error = str(e)[:1000]
+                retry.append(entry)
+        return cls._record_results(sent, retry)
+
+    @classmethod
+    def _record_results(cls, sent, retry, error=None):
+        result = {'sent': len(sent), 'retried': 0, 'failed': 0}
+        now = timezone.now()
+        for entry in sent:
+            entry.status = 'sent'
+            entry.sent_at = now
+            entry.attempts += 1
+            entry.last_error = ''
+        max_attempts = getattr(settings, 'EMAIL_OUTBOX_MAX_ATTEMPTS', 5)
+        for entry in retry:
+            if error is not None:
+                entry.last_error = error[:1000]
+            entry.attempts += 1
+            if entry.attempts >= max_attempts:
+                entry.status = 'failed'
+                result['failed'] += 1
+            else:
+                entry.next_attempt_at = now + cls.backoff(entry.attempts)
+                result['retried'] += 1
+
+        EmailOutbox.objects.bulk_update(
+            sent + retry, ['status', 'sent_at', 'attempts', 'last_error', 'next_attempt_at']
+        )
+        return result
+
+    @staticmethod
+    def backoff(attempts):
+        """1, 2, 4, 8 ... daqiqa, EMAIL_OUTBOX_MAX_BACKOFF_SECONDS bilan cheklangan"""
+        base = getattr(settings, 'EMAIL_OUTBOX_BACKOFF_SECONDS', 60)
+        ceiling = getattr(settings, 'EMAIL_OUTBOX_MAX_BACKOFF_SECONDS', 3600)
+        return timedelta(seconds=min(base * 2 ** (attempts - 1), ceiling))
+
+
+class BulkMailDispatcher:
+    """
+    Ko'p xatni bitta SMTP ulanishi orqali bo'laklab yuborish (kunlik
+    xulosalar kabi ommaviy jo'natmalar uchun). Ulanish fail_silently rejimida:
+    bitta yaroqsiz manzil bo'lakni to'xtatmaydi, faqat `failed` ga qo'shiladi.
+    """
+
+    def __init__(self, chunk_size=None):
+        self.chunk_size = chunk_size or getattr(settings, 'BULK_MAIL_CHUNK_SIZE', 100)
+        self.metrics = {'queued': 0, 'sent': 0, 'failed': 0, 'chunks': 0}
+
+    def send(self, messages):
+        """messages: EmailMessage ro'yxati. Yuborilganlar sonini qaytaradi"""
+        messages = list(messages)
+        self.metrics['queued'] += len(messages)
+        if not messages:
+            return 0
+
+        connection = get_connection(fail_silently=True)
+        connection.open()
+        try:
+            for start in range(0, len(messages), self.chunk_size):
+                chunk = messages[start:start + self.chunk_size]
+                for message in chunk:
+                    message.connection = connection
+                sent = connection.send_messages(chunk) or 0
+                self.metrics['chunks'] += 1
+                self.metrics['sent'] += sent
+                self.metrics['failed'] += len(chunk) - sent
+        finally:
+            connection.close()
+        return self.metrics['sent']
@@ -1,5 +1,4 @@
 from django.core.management.base import BaseCommand
-from django.db.models import F
 
 from documents import models
 from documents.services import ApprovalWorkflowService
@@ -10,10 +9,9 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
         pending_steps = models.ApprovalStep.objects.filter(
+            is_current=True,
             status='pending',
             approver__isnull=True,
-            document__status='pending_approval',
-            step_order=F('document__current_step'),
         ).select_related('document')
 
         documents = {step.document for step in pending_steps}
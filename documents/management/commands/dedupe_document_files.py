@@ -0,0 +1,55 @@
+import os
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from documents.blobs import BlobStore
+from documents.models import Hujjat
+
+
+class Command(BaseCommand):
+    help = "Move existing document files and final PDFs into content-addressed blob storage."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=None,
+            help="Ko'pi bilan shuncha hujjatni ko'chirish",
+        )
+
+    def handle(self, *args, **options):
+        storage = BlobStore.storage()
+        prefix = f"{BlobStore.PREFIX}/"
+        documents = Hujjat.objects.filter(
+            ~Q(file__startswith=prefix) | (Q(final_pdf__gt='') & ~Q(final_pdf__startswith=prefix))
+        ).order_by('pk')
+        if options['limit']:
+            documents = documents[:options['limit']]
+
+        moved = 0
+        freed_bytes = 0
+        for document in documents.iterator():
+            for field_name in ('file', 'final_pdf'):
+                field_file = getattr(document, field_name)
+                old_name = field_file.name
+                if not old_name or old_name.startswith(prefix):
+                    continue
+                if not storage.exists(old_name):
+                    self.stderr.write(f"Missing: {old_name} (hujjat #{document.pk})")
+                    continue
+
+                with storage.open(old_name, 'rb') as old_file:
+                    with transaction.atomic():
+                        blob = BlobStore.put(old_file, os.path.splitext(old_name)[1].lower())
+                        Hujjat.objects.filter(pk=document.pk).update(**{field_name: blob.name})
+                storage.delete(old_name)
+                moved += 1
+                # Mazmun avvaldan bor edi - eski nusxa butunlay tejaldi
+                if blob.ref_count > 1:
+                    freed_bytes += blob.size
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Moved {moved} file(s) into blob storage, {freed_bytes} byte(s) deduplicated.")
+        )
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from documents.models import NotificationCounter
+
+
+class Command(BaseCommand):
+    help = "Recompute unread notification counters from the notifications table."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            type=int,
+            action='append',
+            dest='user_ids',
+            help="Faqat shu foydalanuvchi(lar) uchun (bir necha marta berish mumkin)",
+        )
+
+    def handle(self, *args, **options):
+        rows = NotificationCounter.reconcile(options.get('user_ids'))
+        self.stdout.write(
+            self.style.SUCCESS(f"Reconciled {rows} counter row(s).")
+        )
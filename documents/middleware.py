@@ -1,8 +1,13 @@
 import json
-import logging
 import time
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
 from django.utils import timezone
-from .models import Role, RequestLog
+from .audit import get_request_log_buffer
+from .models import Role
+from .ratelimit import TokenBucketLimiter
+from .roles import RoleRegistry
+from .verification import VerificationCodeAllocator
 
 
 class ActiveRoleMiddleware:
@@ -24,13 +29,16 @@ class ActiveRoleMiddleware:
                 user.active_role = role_obj
             else:
                 request.session.pop(self.SESSION_ROLE_CODE_KEY, None)
-                if not user.active_role:
+                active_role = user._get_active_role()
+                if active_role:
+                    # Shablonlardagi user.active_role FK so'rovsiz ishlashi uchun
+                    user.active_role = active_role
+                else:
                     role_codes = user._get_role_codes()
                     if role_codes:
                         user.active_role = Role.get_role_by_code(role_codes[0])
-                        user.save(update_fields=['active_role'])
-            user._get_role_codes()
-            user.get_role_objects()
+                        if user.active_role:
+                            user.save(update_fields=['active_role'])
         return self.get_response(request)
 
     def _get_role_from_session(self, request):
@@ -40,15 +48,70 @@ class ActiveRoleMiddleware:
 
         role_name = request.session.get(self.SESSION_ROLE_NAME_KEY)
         if role_name:
-            return Role.objects.filter(name__iexact=role_name, is_active=True).first()
+            return RoleRegistry.get_by_name(role_name)
 
         return None
 
 
+class RateLimitMiddleware:
+    """
+    Token-bucket throttling for public verification endpoints (SecurityPolicy).
+    Sits before sessions and auditing, so a rejected request costs no query
+    and no RequestLog row. Views set request.verification_failed on a miss.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.paths = tuple(getattr(settings, "RATE_LIMIT_PATHS", ("/verify/",)))
+
+    def __call__(self, request):
+        if not request.path.startswith(self.paths):
+            return self.get_response(request)
+
+        ip = self._client_ip(request)
+        allowed, retry_after = TokenBucketLimiter.check(ip, self._submitted_code(request))
+        if not allowed:
+            return self._reject(request, retry_after)
+
+        response = self.get_response(request)
+        if getattr(request, "verification_failed", False):
+            TokenBucketLimiter.record_miss(ip)
+        return response
+
+    @staticmethod
+    def _client_ip(request):
+        # Faqat ishonchli proksilar qo'shgan X-Forwarded-For qiymati (mijoz birinchisini soxtalashtira oladi)
+        proxy_count = getattr(settings, "RATE_LIMIT_PROXY_COUNT", 0)
+        if proxy_count:
+            forwarded = [part.strip() for part in request.META.get("HTTP_X_FORWARDED_FOR", "").split(",") if part.strip()]
+            if len(forwarded) >= proxy_count:
+                return forwarded[-proxy_count]
+        return request.META.get("REMOTE_ADDR", "")
+
+    @staticmethod
+    def _submitted_code(request):
+        if request.method == "POST":
+            code = request.POST.get("verification_code", "")
+        else:
+            code = request.GET.get("code", "")
+        return VerificationCodeAllocator.normalize(code)
+
+    @staticmethod
+    def _reject(request, retry_after):
+        message = "Juda ko'p so'rov. Birozdan keyin qayta urinib ko'ring."
+        if request.GET.get("check") == "1":
+            response = JsonResponse({"exists": False, "error": message}, status=429)
+        else:
+            response = HttpResponse(message, status=429, content_type="text/plain; charset=utf-8")
+        response["Retry-After"] = str(retry_after)
+        return response
+
+
 class AuditRequestMiddleware:
     """
     Full audit logger for HTTP requests.
     Writes JSON lines to a file and stores structured data in DB.
+    Writes are batched by RequestLogBuffer outside the request thread.
     """
 
     SENSITIVE_KEYS = {
@@ -63,7 +126,8 @@ class AuditRequestMiddleware:
 
     def __init__(self, get_response):
         self.get_response = get_response
-        self.logger = logging.getLogger("audit")
+        self.buffer = get_request_log_buffer()
+        self.use_buffer = getattr(settings, "AUDIT_LOG_ASYNC", True)
 
     def __call__(self, request):
         start = time.monotonic()
@@ -150,19 +214,28 @@ class AuditRequestMiddleware:
         if request_body is not None:
             log_entry["request_body"] = request_body
 
-        self.logger.info(json.dumps(log_entry, ensure_ascii=False))
-
-        RequestLog.objects.create(
-            user=user_obj,
-            method=request.method,
-            path=path,
-            query_string=request.META.get("QUERY_STRING", ""),
-            status_code=response_status,
-            ip_address=request.META.get("REMOTE_ADDR"),
-            user_agent=request.META.get("HTTP_USER_AGENT", ""),
-            referrer=request.META.get("HTTP_REFERER", ""),
-            duration_ms=duration_ms,
-            request_body=request_body,
-            request_bytes=request.META.get("CONTENT_LENGTH") or None,
-            response_bytes=response_bytes,
-        )
+        request_bytes = request.META.get("CONTENT_LENGTH") or None
+        try:
+            request_bytes = int(request_bytes) if request_bytes is not None else None
+        except (TypeError, ValueError):
+            request_bytes = None
+
+        record = {
+            "user_id": user_obj.pk if user_obj else None,
+            "method": request.method,
+            "path": path,
+            "query_string": request.META.get("QUERY_STRING", ""),
+            "status_code": response_status,
+            "ip_address": request.META.get("REMOTE_ADDR"),
+            "user_agent": request.META.get("HTTP_USER_AGENT", ""),
+            "referrer": request.META.get("HTTP_REFERER", ""),
+            "duration_ms": duration_ms,
+            "request_body": request_body,
+            "request_bytes": request_bytes,
+            "response_bytes": response_bytes,
+        }
+
+        if self.use_buffer:
+            self.buffer.submit(log_entry, record)
+        else:
+            self.buffer.write_now(log_entry, record)
@@ -0,0 +1,36 @@
+from django.db import migrations, models
+
+
+SEQUENCE_NAME = "documents_verification_code_seq"
+
+
+def create_sequence(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(f"CREATE SEQUENCE IF NOT EXISTS {SEQUENCE_NAME} START 1")
+
+
+def drop_sequence(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(f"DROP SEQUENCE IF EXISTS {SEQUENCE_NAME}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("documents", "0007_rename_document_hujjat"),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name="hujjat",
+            options={"ordering": ["-uploaded_at"], "verbose_name": "Hujjat", "verbose_name_plural": "Hujjatlar"},
+        ),
+        migrations.AlterField(
+            model_name="hujjat",
+            name="verification_code",
+            field=models.CharField(editable=False, max_length=16, unique=True),
+        ),
+        migrations.RunPython(create_sequence, drop_sequence),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("documents", "0008_verification_code_sequence"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="hujjat",
+            index=models.Index(fields=["uploaded_at", "id"], name="documents_uploade_cf5c8e_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="hujjat",
+            index=models.Index(fields=["uploaded_by", "uploaded_at"], name="documents_uploade_409108_idx"),
+        ),
+    ]
@@ -0,0 +1,38 @@
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_role_type(apps, schema_editor):
+    """Tasdiqlovchiga yuborilgan xabarlar uchun o'sha hujjatdagi bosqich roli"""
+    Notification = apps.get_model("documents", "Notification")
+    ApprovalStep = apps.get_model("documents", "ApprovalStep")
+
+    step_role = ApprovalStep.objects.filter(
+        document_id=OuterRef("document_id"),
+        approver_id=OuterRef("recipient_id"),
+    ).order_by("step_order").values("role_required")[:1]
+
+    Notification.objects.filter(document__isnull=False).exclude(
+        recipient_id=F("document__uploaded_by_id"),
+    ).update(role_type=Coalesce(Subquery(step_role), Value("")))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("documents", "0009_hujjat_keyset_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="notification",
+            name="role_type",
+            field=models.CharField(blank=True, default="", max_length=30),
+        ),
+        migrations.AddIndex(
+            model_name="notification",
+            index=models.Index(fields=["recipient", "role_type", "is_read", "created_at"], name="notificatio_recipie_240ea3_idx"),
+        ),
+        migrations.RunPython(backfill_role_type, migrations.RunPython.noop),
+    ]
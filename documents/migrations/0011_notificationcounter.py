@@ -0,0 +1,46 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_counters(apps, schema_editor):
+    Notification = apps.get_model("documents", "Notification")
+    NotificationCounter = apps.get_model("documents", "NotificationCounter")
+
+    rows = (
+        Notification.objects.filter(is_read=False)
+        .values("recipient_id", "role_type")
+        .annotate(total=models.Count("id"))
+        .order_by()
+    )
+    NotificationCounter.objects.bulk_create(
+        [
+            NotificationCounter(recipient_id=row["recipient_id"], role_type=row["role_type"], unread=row["total"])
+            for row in rows
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("documents", "0010_notification_role_type"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="NotificationCounter",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("role_type", models.CharField(blank=True, default="", max_length=30)),
+                ("unread", models.IntegerField(default=0)),
+                ("recipient", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="notification_counters", to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                "db_table": "notification_counters",
+                "constraints": [models.UniqueConstraint(fields=("recipient", "role_type"), name="notification_counter_unique")],
+            },
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("documents", "0011_notificationcounter"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="EmailOutbox",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("to_email", models.EmailField(max_length=254)),
+                ("subject", models.CharField(max_length=255)),
+                ("message", models.TextField()),
+                ("html_message", models.TextField(blank=True)),
+                ("notification_type", models.CharField(blank=True, max_length=50)),
+                ("dedup_key", models.CharField(max_length=64)),
+                ("status", models.CharField(choices=[("pending", "Pending"), ("sent", "Sent"), ("failed", "Failed")], default="pending", max_length=20)),
+                ("attempts", models.PositiveSmallIntegerField(default=0)),
+                ("next_attempt_at", models.DateTimeField(default=django.utils.timezone.now)),
+                ("last_error", models.TextField(blank=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("sent_at", models.DateTimeField(blank=True, null=True)),
+                ("document", models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name="outgoing_emails", to="documents.hujjat")),
+            ],
+            options={
+                "db_table": "email_outbox",
+                "ordering": ["created_at"],
+                "indexes": [models.Index(fields=["status", "next_attempt_at"], name="email_outbo_status_c5a6aa_idx")],
+                "constraints": [models.UniqueConstraint(condition=models.Q(("status", "pending")), fields=("dedup_key",), name="email_outbox_pending_dedup")],
+            },
+        ),
+    ]
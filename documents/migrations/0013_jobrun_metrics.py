@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("documents", "0012_email_outbox"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="jobrun",
+            name="metrics",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,75 @@
+from datetime import timedelta
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+
+# Migratsiya vaqtidagi qiymatlar (ApprovalWorkflowService.NIGHT_HOURS / EARLY_NOTIFY_HOUR):
+# ilova kodi keyin o'zgarsa ham bu migratsiya natijasi o'zgarmasligi uchun shu yerga ko'chirilgan
+NIGHT_HOURS = (23, 6)
+EARLY_NOTIFY_HOUR = 21
+
+
+def event_times(deadline, has_approver, now):
+    events = [("overdue", deadline)]
+    if not has_approver or deadline <= now:
+        return events
+
+    events.append(("reminder_24h", deadline - timedelta(hours=24)))
+
+    reminder_2h = deadline - timedelta(hours=2)
+    night_start, night_end = NIGHT_HOURS
+    local = timezone.localtime(reminder_2h)
+    if local.hour >= night_start or local.hour < night_end:
+        evening = local.replace(hour=EARLY_NOTIFY_HOUR, minute=0, second=0, microsecond=0)
+        if local.hour < night_end:
+            evening -= timedelta(days=1)
+        reminder_2h = max(evening, now)
+    events.append(("reminder_2h", reminder_2h))
+    return events
+
+
+def backfill_events(apps, schema_editor):
+    ApprovalStep = apps.get_model("documents", "ApprovalStep")
+    DeadlineEvent = apps.get_model("documents", "DeadlineEvent")
+
+    steps = (
+        ApprovalStep.objects.filter(
+            status="pending",
+            document__status="pending_approval",
+            step_order=models.F("document__current_step"),
+        )
+        .values_list("pk", "deadline", "approver_id")
+        .iterator(chunk_size=1000)
+    )
+    now = timezone.now()
+    events = []
+    for pk, deadline, approver_id in steps:
+        for kind, due_at in event_times(deadline, approver_id is not None, now):
+            events.append(DeadlineEvent(step_id=pk, kind=kind, due_at=due_at))
+    DeadlineEvent.objects.bulk_create(events, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("documents", "0013_jobrun_metrics"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DeadlineEvent",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("kind", models.CharField(choices=[("reminder_24h", "Reminder 24h"), ("reminder_2h", "Reminder 2h"), ("overdue", "Overdue")], max_length=20)),
+                ("due_at", models.DateTimeField()),
+                ("step", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="deadline_events", to="documents.approvalstep")),
+            ],
+            options={
+                "db_table": "deadline_events",
+                "indexes": [models.Index(fields=["due_at"], name="deadline_ev_due_at_7c61e9_idx")],
+                "constraints": [models.UniqueConstraint(fields=("step", "kind"), name="deadline_event_unique")],
+            },
+        ),
+        migrations.RunPython(backfill_events, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+from django.db import migrations, models
+
+
+def backfill_is_current(apps, schema_editor):
+    ApprovalStep = apps.get_model("documents", "ApprovalStep")
+    ApprovalStep.objects.filter(
+        status="pending",
+        document__status="pending_approval",
+        step_order=models.F("document__current_step"),
+    ).update(is_current=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("documents", "0014_deadline_events"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="approvalstep",
+            name="is_current",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(backfill_is_current, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="approvalstep",
+            index=models.Index(condition=models.Q(("is_current", True)), fields=["approver", "deadline"], name="approval_step_current_appr_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="approvalstep",
+            index=models.Index(condition=models.Q(("is_current", True)), fields=["deadline"], name="approval_step_current_dl_idx"),
+        ),
+    ]
@@ -0,0 +1,24 @@
+from django.db import migrations, models
+
+
+def backfill_final_pdf_status(apps, schema_editor):
+    Hujjat = apps.get_model("documents", "Hujjat")
+    Hujjat.objects.filter(status="approved").exclude(final_pdf="").exclude(final_pdf__isnull=True).update(
+        final_pdf_status="ready"
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("documents", "0015_approvalstep_is_current"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="hujjat",
+            name="final_pdf_status",
+            field=models.CharField(choices=[("none", "Not requested"), ("pending", "Pending"), ("processing", "Processing"), ("ready", "Ready"), ("failed", "Failed")], default="none", max_length=20),
+        ),
+        migrations.RunPython(backfill_final_pdf_status, migrations.RunPython.noop),
+    ]
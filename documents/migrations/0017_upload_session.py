@@ -0,0 +1,36 @@
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("documents", "0016_hujjat_final_pdf_status"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UploadSession",
+            fields=[
+                ("id", models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ("file_name", models.CharField(max_length=255)),
+                ("total_size", models.BigIntegerField()),
+                ("chunk_size", models.PositiveIntegerField()),
+                ("received_chunks", models.JSONField(blank=True, default=list)),
+                ("received_bytes", models.BigIntegerField(default=0)),
+                ("status", models.CharField(choices=[("active", "Active"), ("completed", "Completed"), ("aborted", "Aborted")], default="active", max_length=20)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("document", models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name="upload_sessions", to="documents.hujjat")),
+                ("document_type", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="upload_sessions", to="documents.documenttype")),
+                ("user", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="upload_sessions", to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                "db_table": "upload_sessions",
+                "ordering": ["-created_at"],
+                "indexes": [models.Index(fields=["status", "updated_at"], name="upload_sess_status_7188ee_idx")],
+            },
+        ),
+    ]
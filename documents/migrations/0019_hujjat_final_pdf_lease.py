@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("documents", "0018_stored_blob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="hujjat",
+            name="final_pdf_started_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="hujjat",
+            name="final_pdf_attempts",
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
@@ -1,14 +1,14 @@
 
 
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import MinLengthValidator
 from django.utils import timezone
 from datetime import timedelta
 import uuid
-import random
-import string
 import json
+from .roles import RoleRegistry
+from .verification import VerificationCodeAllocator
 
 # ==================== ROLE MODELI ====================
 
@@ -89,19 +89,13 @@ class Role(models.Model):
     @classmethod
     def get_default_role_for_type(cls, role_type):
         """Berilgan rol tipi uchun standart rolni olish"""
-        try:
-            return cls.objects.get(role_type=role_type, is_default=True, is_active=True)
-        except cls.DoesNotExist:
-            # Agar standart rol topilmasa, birinchi faol rolni qaytarish
-            return cls.objects.filter(role_type=role_type, is_active=True).first()
+        # Standart rol topilmasa registry birinchi faol rolni qaytaradi
+        return RoleRegistry.get_default_for_type(role_type)
     
     @classmethod
     def get_role_by_code(cls, code):
         """Kod bo'yicha rolni olish"""
-        try:
-            return cls.objects.get(code=code, is_active=True)
-        except cls.DoesNotExist:
-            return None
+        return RoleRegistry.get_by_code(code)
     
     @classmethod
     def get_roles_by_type(cls, role_type):
@@ -303,12 +297,29 @@ class User(AbstractUser):
     email_notifications = models.BooleanField(default=True)
     push_notifications = models.BooleanField(default=True)
     
+    # ApproverDirectory kalitlariga ta'sir qiladigan maydonlar
+    APPROVER_SCOPE_FIELDS = (
+        'active_role_id', 'faculty_id', 'department_id',
+        'managed_department_id', 'managed_faculty_id',
+    )
+    
     class Meta:
         db_table = 'users'
         indexes = [
             models.Index(fields=['active_role', 'faculty', 'department']),
         ]
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        loaded = dict(zip(field_names, values))
+        if all(field in loaded for field in cls.APPROVER_SCOPE_FIELDS):
+            instance._loaded_approver_scope = tuple(loaded[field] for field in cls.APPROVER_SCOPE_FIELDS)
+        return instance
+    
+    def get_approver_scope(self):
+        return tuple(getattr(self, field) for field in self.APPROVER_SCOPE_FIELDS)
+    
     @property
     def role(self):
         """Legacy code uchun - faol rol turini qaytarish"""
@@ -324,6 +335,17 @@ class User(AbstractUser):
         full_name = " ".join(part for part in parts if part)
         return full_name.strip() or self.username
 
+    def _get_active_role(self):
+        """Faol rolni registry'dan olish (FK so'rovisiz)"""
+        if self.active_role_id is None:
+            return None
+        if User.active_role.is_cached(self):
+            return self.active_role
+        role = RoleRegistry.get_by_id(self.active_role_id)
+        if role is None:
+            return self.active_role
+        return role
+
     def _get_role_codes(self):
         cached = getattr(self, "_role_codes_cache", None)
         if cached is not None:
@@ -369,8 +391,9 @@ class User(AbstractUser):
     def get_active_role_type(self):
         if self.is_superuser:
             return 'admin'
-        if self.active_role:
-            return self.active_role.role_type
+        active_role = self._get_active_role()
+        if active_role:
+            return active_role.role_type
         role_codes = self._get_role_codes()
         if role_codes:
             role_obj = Role.get_role_by_code(role_codes[0])
@@ -414,14 +437,16 @@ class User(AbstractUser):
     
     def has_role(self, role_code):
         """Berilgan rol mavjudligini tekshirish"""
-        if self.active_role and self.active_role.code == role_code:
+        active_role = self._get_active_role()
+        if active_role and active_role.code == role_code:
             return True
         role_codes = self._get_role_codes()
         return role_code in role_codes
     
     def has_role_type(self, role_type):
         """Berilgan rol tipi mavjudligini tekshirish"""
-        if self.active_role and self.active_role.role_type == role_type:
+        active_role = self._get_active_role()
+        if active_role and active_role.role_type == role_type:
             return True
         role_codes = self._get_role_codes()
         for code in role_codes:
@@ -436,23 +461,19 @@ class User(AbstractUser):
     
     def get_role_objects(self):
         """Role obyektlarini olish"""
-        cached = getattr(self, "_role_objects_cache", None)
-        if cached is not None:
-            return cached
-        role_codes = self._get_role_codes()
-        if not role_codes:
-            self._role_objects_cache = []
-            return self._role_objects_cache
-        roles = Role.objects.filter(code__in=role_codes, is_active=True)
-        role_map = {role.code: role for role in roles}
-        self._role_objects_cache = [role_map[code] for code in role_codes if code in role_map]
-        return self._role_objects_cache
+        role_objects = []
+        for code in self._get_role_codes():
+            role_obj = RoleRegistry.get_by_code(code)
+            if role_obj:
+                role_objects.append(role_obj)
+        return role_objects
     
     def get_role_types(self):
         """Rol tiplarini olish"""
         types = set()
-        if self.active_role and self.active_role.role_type:
-            types.add(self.active_role.role_type)
+        active_role = self._get_active_role()
+        if active_role and active_role.role_type:
+            types.add(active_role.role_type)
         for role_obj in self.get_role_objects():
             if role_obj.role_type:
                 types.add(role_obj.role_type)
@@ -461,8 +482,9 @@ class User(AbstractUser):
     def get_role_names(self):
         """Rol nomlarini olish"""
         names = []
-        if self.active_role and self.active_role.name:
-            names.append(self.active_role.name)
+        active_role = self._get_active_role()
+        if active_role and active_role.name:
+            names.append(active_role.name)
         for role_obj in self.get_role_objects():
             if role_obj.name and role_obj.name not in names:
                 names.append(role_obj.name)
@@ -625,8 +647,9 @@ class User(AbstractUser):
     
     def get_active_role_display(self):
         """Faol rol nomini ko'rsatish"""
-        if self.active_role:
-            return self.active_role.name
+        active_role = self._get_active_role()
+        if active_role:
+            return active_role.name
         role_objs = self.get_role_objects()
         if role_objs:
             return role_objs[0].name
@@ -654,7 +677,6 @@ class User(AbstractUser):
         if not self.active_role and role_codes:
             self.active_role = Role.get_role_by_code(role_codes[0])
         self._role_codes_cache = None
-        self._role_objects_cache = None
         super().save(*args, **kwargs)
     
     # ==================== BULK ROLE MANAGEMENT ====================
@@ -943,6 +965,18 @@ class TeachingAllocation(models.Model):
         # Bir xil yil, semestr, guruh va fan uchun bitta o'qituvchi bo'lishi kerak
         unique_together = [['subject', 'group', 'academic_year', 'semester']]
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        loaded = dict(zip(field_names, values))
+        if all(field in loaded for field in ('subject_id', 'group_id', 'academic_year_id')):
+            instance._loaded_allocation_key = instance.get_allocation_key()
+        return instance
+
+    def get_allocation_key(self):
+        """ApproverDirectory uchun (fan, guruh, o'quv yili)"""
+        return (self.subject_id, self.group_id, self.academic_year_id)
+
     def __str__(self):
         return f"{self.teacher.get_full_name()} - {self.subject.name} ({self.group.name})"
 
@@ -1014,6 +1048,13 @@ class Hujjat(models.Model):
         ('approved', 'Approved'),
         ('rejected', 'Rejected'),
     ]
+    FINAL_PDF_STATUS_CHOICES = [
+        ('none', 'Not requested'),
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('ready', 'Ready'),
+        ('failed', 'Failed'),
+    ]
     
     document_type = models.ForeignKey(DocumentType, on_delete=models.PROTECT, related_name='documents')
     uploaded_by = models.ForeignKey(User, on_delete=models.PROTECT, related_name='uploaded_documents')
@@ -1031,9 +1072,15 @@ class Hujjat(models.Model):
     current_step = models.IntegerField(default=0)
     
     uuid = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
-    verification_code = models.CharField(max_length=4, unique=True, editable=False)
+    verification_code = models.CharField(max_length=16, unique=True, editable=False)
     qr_code_image = models.ImageField(upload_to='qr_codes/', null=True, blank=True)
     final_pdf = models.FileField(upload_to='approved_documents/', null=True, blank=True)
+    # QR kodli yakuniy PDF holati: tasdiqlangach fon vazifasida shakllantiriladi
+    final_pdf_status = models.CharField(max_length=20, choices=FINAL_PDF_STATUS_CHOICES, default='none')
+    # So'nggi navbatga qo'yish/olish vaqti (ijara): muddati o'tgan pending/processing qayta olinadi
+    final_pdf_started_at = models.DateTimeField(null=True, blank=True)
+    # Ketma-ket urinishlar soni: avtomatik qayta urinishlar FINAL_PDF_MAX_ATTEMPTS bilan cheklanadi
+    final_pdf_attempts = models.PositiveSmallIntegerField(default=0)
     
     title = models.CharField(max_length=500, blank=True)
     description = models.TextField(blank=True)
@@ -1051,6 +1098,9 @@ class Hujjat(models.Model):
             models.Index(fields=['document_type', 'status']),
             models.Index(fields=['verification_code']),
             models.Index(fields=['uuid']),
+            # document_list keyset sahifalash uchun
+            models.Index(fields=['uploaded_at', 'id']),
+            models.Index(fields=['uploaded_by', 'uploaded_at']),
         ]
         ordering = ['-uploaded_at']
     
@@ -1061,98 +1111,103 @@ class Hujjat(models.Model):
         if not self.verification_code:
             self.verification_code = self._generate_verification_code()
         
+        if self.file and not self.file._committed:
+            # Yangi fayl mazmun bo'yicha saqlanadi: bir xil fayl diskka qayta yozilmaydi
+            from .blobs import BlobStore
+            with transaction.atomic():
+                previous_name = None
+                if self.pk:
+                    previous_name = Hujjat.objects.filter(pk=self.pk).values_list('file', flat=True).first()
+                BlobStore.store(self.file, previous_name=previous_name)
+                return self.save(*args, **kwargs)
+        
         if not self.pk and self.status == 'uploaded':
-            super().save(*args, **kwargs)
-            has_pending = self._create_approval_steps()
-            if not has_pending:
-                self.status = 'approved'
-                self.completed_at = timezone.now()
-                self.save(update_fields=['status', 'completed_at'])
-            else:
-                self.status = 'pending_approval'
-                self.save(update_fields=['status'])
+            # Bosqichlar xotirada rejalashtiriladi: hujjat bitta INSERT, bosqichlar bitta bulk INSERT
+            with transaction.atomic():
+                steps = self._plan_approval_steps()
+                next_step = next((step for step in steps if step.status == 'pending'), None)
+                if next_step is None:
+                    self.status = 'approved'
+                    self.completed_at = timezone.now()
+                else:
+                    self.status = 'pending_approval'
+                    self.current_step = next_step.step_order
+                    next_step.is_current = True
+                super().save(*args, **kwargs)
+                for step in steps:
+                    step.document = self
+                ApprovalStep.objects.bulk_create(steps)
+                from .deadlines import DeadlineScheduler
+                DeadlineScheduler.schedule([next_step])
+                if self.status == 'approved':
+                    from .qr_service import QRCodeService
+                    QRCodeService.request_final_pdf(self)
+                from .dashboard import DashboardStatsService
+                DashboardStatsService.invalidate(self.uploaded_by_id, *(step.approver_id for step in steps))
             return
         
         super().save(*args, **kwargs)
     
     def _generate_verification_code(self):
-        while True:
-            code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=4))
-            if not Hujjat.objects.filter(verification_code=code).exists():
-                return code
+        return VerificationCodeAllocator.allocate()
     
-    def _create_approval_steps(self):
+    @property
+    def final_pdf_in_progress(self):
+        """Yakuniy PDF navbatda yoki ishlanmoqda va ijara muddati hali o'tmagan"""
+        if self.final_pdf_status not in ('pending', 'processing') or self.final_pdf_started_at is None:
+            return False
+        from .qr_service import QRCodeService
+        return self.final_pdf_started_at >= QRCodeService.lease_cutoff()
+    
+    def _plan_approval_steps(self):
+        """Workflow bo'yicha saqlanmagan ApprovalStep obyektlarini tayyorlash"""
         workflow = self.document_type.approval_workflow or []
         if not workflow:
-            return False
+            return []
+        approver_ids = self._resolve_approver_ids(workflow)
+        now = timezone.now()
+        deadline = now + timedelta(hours=self.document_type.deadline_hours)
+        steps = []
         for step_order, role in enumerate(workflow):
-            approver = self._find_approver_for_role(role)
-            status = 'pending'
-            approved_at = None
-            comment = ''
-            if not approver:
-                status = 'skipped'
-                approved_at = timezone.now()
-                comment = "Auto-skipped: approver not found"
-            ApprovalStep.objects.create(
-                document=self,
+            approver_id = approver_ids.get(role)
+            step = ApprovalStep(
                 step_order=step_order,
-                approver=approver,
+                approver_id=approver_id,
                 role_required=role,
-                deadline=timezone.now() + timedelta(hours=self.document_type.deadline_hours),
-                status=status,
-                approved_at=approved_at,
-                comment=comment,
+                deadline=deadline,
             )
-        has_pending = self._advance_to_next_pending_step()
-        return has_pending
-
-    def _advance_to_next_pending_step(self):
-        steps = self.approval_steps.all().order_by('step_order')
-        for step in steps:
-            if step.status == 'pending':
-                Hujjat.objects.filter(pk=self.pk).update(current_step=step.step_order)
-                return True
-        return False
+            if approver_id is None:
+                step.status = 'skipped'
+                step.approved_at = now
+                step.comment = "Auto-skipped: approver not found"
+            steps.append(step)
+        return steps
+    
+    def _resolve_approver_ids(self, roles):
+        """Workflow rollari uchun tasdiqlovchilar: {rol: user_id} (ApproverDirectory keshidan)"""
+        from .approvers import ApproverDirectory
+        return ApproverDirectory.resolve_for_document(self, roles)
     
     def _find_approver_for_role(self, role):
-        uploader = self.uploaded_by
-        
-        if role == 'department_head':
-            if uploader.department and hasattr(uploader.department, 'head'):
-                return uploader.department.head
-        
-        elif role == 'faculty_dean':
-            if uploader.faculty and hasattr(uploader.faculty, 'dean'):
-                return uploader.faculty.dean
-        
-        elif role == 'dean_deputy':
-            return User.objects.filter(active_role__role_type='dean_deputy', faculty=uploader.faculty).first()
-        
-        elif role == 'director':
-            return User.objects.filter(active_role__role_type='director').first()
-        
-        elif role == 'director_deputy':
-            return User.objects.filter(active_role__role_type='director_deputy').first()
-        
-        elif role in ['academic_office', 'registration_office']:
-            return User.objects.filter(active_role__role_type=role).first()
-        
-        elif role == 'teacher':
-            # Agar hujjat aniq bir fan va guruhga bog'langan bo'lsa, o'sha fandan dars beruvchini topamiz
-            if self.subject and self.related_group and self.academic_year:
-                allocation = TeachingAllocation.objects.filter(
-                    subject=self.subject,
-                    group=self.related_group,
-                    academic_year=self.academic_year
-                ).first()
-                if allocation:
-                    return allocation.teacher
-            
-            # Aks holda kafedradagi istalgan o'qituvchi (yoki bo'sh qoladi)
-            return User.objects.filter(active_role__role_type='teacher', department=uploader.department).first()
-        
-        return None
+        approver_id = self._resolve_approver_ids([role]).get(role)
+        if approver_id is None:
+            return None
+        return User.objects.filter(pk=approver_id).first()
+    
+    def sync_current_step_flag(self):
+        """
+        approval_steps.is_current ni status va current_step bilan moslashtirish.
+        Workflow hujjatni keyingi bosqichga o'tkazganda yoki yakunlaganda chaqiriladi (bitta UPDATE).
+        """
+        if self.status != 'pending_approval':
+            self.approval_steps.filter(is_current=True).update(is_current=False)
+            return
+        self.approval_steps.filter(models.Q(is_current=True) | models.Q(step_order=self.current_step)).update(
+            is_current=models.Case(
+                models.When(step_order=self.current_step, status='pending', then=models.Value(True)),
+                default=models.Value(False),
+            )
+        )
     
     def get_current_approver(self):
         try:
@@ -1227,17 +1282,73 @@ class ApprovalStep(models.Model):
     approved_at = models.DateTimeField(null=True, blank=True)
     comment = models.TextField(blank=True)
     
+    # Hujjatning hozirgi, kutilayotgan bosqichi (status='pending', step_order=current_step,
+    # hujjat pending_approval). Hujjat.sync_current_step_flag() orqali yangilanadi.
+    is_current = models.BooleanField(default=False)
+    
     class Meta:
         db_table = 'approval_steps'
         verbose_name_plural = 'Tasdiqlash bosqichlari'
         unique_together = [['document', 'step_order']]
         ordering = ['step_order']
+        indexes = [
+            # Tasdiqlash kutilayotganlar ro'yxati: approver=?, deadline bo'yicha tartib
+            models.Index(
+                fields=['approver', 'deadline'],
+                condition=models.Q(is_current=True),
+                name='approval_step_current_appr_idx',
+            ),
+            # Deadline skanerlari (avto-tasdiqlash, eslatmalar)
+            models.Index(
+                fields=['deadline'],
+                condition=models.Q(is_current=True),
+                name='approval_step_current_dl_idx',
+            ),
+        ]
     
     def __str__(self):
         return f"Step {self.step_order + 1} - {self.get_status_display()}"
     
     def is_overdue(self):
         return timezone.now() > self.deadline and self.status == 'pending'
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        loaded = dict(zip(field_names, values))
+        if 'deadline' in loaded:
+            # Deadline o'zgarganini aniqlash uchun (DeadlineScheduler)
+            instance._loaded_deadline = loaded['deadline']
+        return instance
+
+
+class DeadlineEvent(models.Model):
+    """
+    Vaqt g'ildiragi: bosqich deadline'i bilan bog'liq kelgusi ishlar
+    (24 va 2 soat oldingi eslatma, muddat o'tishi). Har daqiqada faqat
+    vaqti kelgan qatorlar olinadi va o'chiriladi.
+    """
+    KIND_CHOICES = [
+        ('reminder_24h', 'Reminder 24h'),
+        ('reminder_2h', 'Reminder 2h'),
+        ('overdue', 'Overdue'),
+    ]
+
+    step = models.ForeignKey(ApprovalStep, on_delete=models.CASCADE, related_name='deadline_events')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    due_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'deadline_events'
+        indexes = [
+            models.Index(fields=['due_at']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['step', 'kind'], name='deadline_event_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} @ {self.due_at} (step {self.step_id})"
 
 
 class ApprovalLog(models.Model):
@@ -1288,6 +1399,8 @@ class Notification(models.Model):
     message = models.TextField()
     
     document = models.ForeignKey(Hujjat, on_delete=models.CASCADE, null=True, blank=True)
+    # Xabar qaysi rol sifatida yuborilgan; bo'sh bo'lsa barcha rollarda ko'rinadi
+    role_type = models.CharField(max_length=30, blank=True, default='')
     
     is_read = models.BooleanField(default=False)
     is_urgent = models.BooleanField(default=False)
@@ -1302,12 +1415,197 @@ class Notification(models.Model):
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['recipient', 'is_read', 'created_at']),
+            models.Index(fields=['recipient', 'role_type', 'is_read', 'created_at']),
         ]
     
     def __str__(self):
         return f"{self.title} - {self.recipient.username}"
 
 
+class NotificationCounter(models.Model):
+    """
+    (qabul qiluvchi, rol tipi) bo'yicha o'qilmagan xabarlar soni.
+    NotificationService tomonidan atomar yangilanadi; farq paydo bo'lsa
+    `reconcile_notification_counters` buyrug'i yoki kunlik vazifasi bilan qayta hisoblanadi.
+    """
+    recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notification_counters')
+    role_type = models.CharField(max_length=30, blank=True, default='')
+    unread = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'notification_counters'
+        constraints = [
+            models.UniqueConstraint(fields=['recipient', 'role_type'], name='notification_counter_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.recipient_id}:{self.role_type or '*'} = {self.unread}"
+
+    @classmethod
+    def adjust(cls, recipient_id, role_type, delta):
+        """Hisoblagichni atomar o'zgartirish (UPDATE ... SET unread = unread + delta)"""
+        role_type = role_type or ''
+        updated = cls.objects.filter(recipient_id=recipient_id, role_type=role_type).update(
+            unread=models.F('unread') + delta
+        )
+        if updated or delta <= 0:
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(recipient_id=recipient_id, role_type=role_type, unread=delta)
+        except IntegrityError:
+            # Parallel so'rov qatorni yaratib ulgurdi
+            cls.objects.filter(recipient_id=recipient_id, role_type=role_type).update(
+                unread=models.F('unread') + delta
+            )
+
+    @classmethod
+    def reconcile(cls, recipient_ids=None):
+        """Hisoblagichlarni notifications jadvalidan qayta hisoblash"""
+        unread = Notification.objects.filter(is_read=False)
+        counters = cls.objects.all()
+        if recipient_ids is not None:
+            unread = unread.filter(recipient_id__in=recipient_ids)
+            counters = counters.filter(recipient_id__in=recipient_ids)
+
+        rows = unread.values('recipient_id', 'role_type').annotate(total=models.Count('id')).order_by()
+        with transaction.atomic():
+            counters.update(unread=0)
+            cls.objects.bulk_create(
+                [cls(recipient_id=row['recipient_id'], role_type=row['role_type'], unread=row['total']) for row in rows],
+                update_conflicts=True,
+                unique_fields=['recipient', 'role_type'],
+                update_fields=['unread'],
+                batch_size=1000,
+            )
+        return len(rows)
+
+
+class EmailOutbox(models.Model):
+    """
+    Yuborilishi kerak bo'lgan xatlar navbati. Xabar bilan bir tranzaksiyada
+    yoziladi va commit'dan keyin mailer.EmailOutboxService tomonidan yuboriladi.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+
+    to_email = models.EmailField()
+    subject = models.CharField(max_length=255)
+    message = models.TextField()
+    html_message = models.TextField(blank=True)
+    notification_type = models.CharField(max_length=50, blank=True)
+    document = models.ForeignKey(
+        Hujjat, on_delete=models.SET_NULL, null=True, blank=True, related_name='outgoing_emails'
+    )
+    # Bir qabul qiluvchiga bir xil xat navbatda ikki marta turmasligi uchun
+    dedup_key = models.CharField(max_length=64)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'email_outbox'
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dedup_key'],
+                condition=models.Q(status='pending'),
+                name='email_outbox_pending_dedup',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.to_email} - {self.subject} ({self.status})"
+
+
+class UploadSession(models.Model):
+    """
+    Katta fayllarni bo'laklab (chunked) yuklash seansi. Har bir bo'lak storage'da
+    alohida obyekt sifatida saqlanadi, shuning uchun uzilgan yuklash qolgan
+    bo'laklardan davom etadi. Hujjat faqat finalize'da yaratiladi.
+    """
+    STATUS_CHOICES = [
+        ('active', 'Active'),
+        ('completed', 'Completed'),
+        ('aborted', 'Aborted'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    document_type = models.ForeignKey(DocumentType, on_delete=models.CASCADE, related_name='upload_sessions')
+    file_name = models.CharField(max_length=255)
+    total_size = models.BigIntegerField()
+    chunk_size = models.PositiveIntegerField()
+    received_chunks = models.JSONField(default=list, blank=True)
+    received_bytes = models.BigIntegerField(default=0)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='active')
+    document = models.ForeignKey(
+        Hujjat, on_delete=models.SET_NULL, null=True, blank=True, related_name='upload_sessions'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'upload_sessions'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'updated_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.file_name} ({self.received_bytes}/{self.total_size})"
+
+    @property
+    def chunk_count(self):
+        return max((self.total_size + self.chunk_size - 1) // self.chunk_size, 1)
+
+    def chunk_length(self, index):
+        """index-bo'lakning aniq hajmi (oxirgisidan boshqa hammasi chunk_size)"""
+        return min(self.chunk_size, self.total_size - index * self.chunk_size)
+
+    def chunk_name(self, index):
+        return f"uploads/{self.pk}/{index:05d}.part"
+
+    @property
+    def missing_chunks(self):
+        received = set(self.received_chunks)
+        return [index for index in range(self.chunk_count) if index not in received]
+
+
+class StoredBlob(models.Model):
+    """
+    Mazmun bo'yicha manzillangan fayl (blobs.BlobStore). Bir xil baytlar storage'da
+    bir marta saqlanadi; ref_count - unga havola qilgan Hujjat.file/final_pdf soni.
+    ref_count 0 bo'lgan blob'lar kechikish bilan collect_unreferenced_blobs'da o'chiriladi.
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255, unique=True)
+    size = models.BigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    # Hosila fayllar (masalan, QR muhrli PDF) uchun: kirish ma'lumotlari kaliti
+    derivation_key = models.CharField(max_length=64, unique=True, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'stored_blobs'
+        indexes = [
+            models.Index(fields=['ref_count', 'updated_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count})"
+
+
 class AuditLog(models.Model):
     ACTION_CHOICES = [
         ('role_switched', 'Role Switched'),
@@ -1410,6 +1708,8 @@ class JobRun(models.Model):
     last_success_at = models.DateTimeField(null=True, blank=True)
     last_error = models.TextField(blank=True)
     last_duration_ms = models.IntegerField(null=True, blank=True)
+    # Oxirgi ishga tushirish ko'rsatkichlari (yuborilgan/xato soni, tezlik va h.k.)
+    metrics = models.JSONField(default=dict, blank=True)
 
     class Meta:
         db_table = 'job_runs'
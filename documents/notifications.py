@@ -1,14 +1,39 @@
 
-from django.core.mail import send_mail
-from django.conf import settings
-from django.template.loader import render_to_string
-from .models import Notification
+from django.db import transaction
+from django.db.models import Sum
+from .models import Notification, NotificationCounter
+from .dashboard import DashboardStatsService
+from .events import notification_bus
+from .mailer import EmailOutboxService
 
 
 class NotificationService:
     
+    @staticmethod
+    def _create_notification(recipient, role_type='', **fields):
+        """
+        Barcha xabarlar shu yerdan yaratiladi. role_type - qabul qiluvchi qaysi
+        rol sifatida xabar olayotgani; bo'sh bo'lsa xabar barcha rollarda ko'rinadi.
+        """
+        with transaction.atomic():
+            notification = Notification.objects.create(recipient=recipient, role_type=role_type or '', **fields)
+            if not notification.is_read:
+                NotificationCounter.adjust(notification.recipient_id, notification.role_type, 1)
+        NotificationService._publish_change(notification.recipient_id)
+        return notification
+    
+    @staticmethod
+    def _publish_change(user_id):
+        """SSE obunachilariga tranzaksiya yakunlangach xabar berish"""
+        transaction.on_commit(lambda: notification_bus.publish(user_id))
+    
+    @staticmethod
+    def _current_step_role(document):
+        step = document.get_current_approver()
+        return step.role_required if step else ''
+    
     @classmethod
-    def notify_approval_needed(cls, document, approver):
+    def notify_approval_needed(cls, document, approver, role_type=None):
         
         title = f"Tasdiqlash kerak: {document.file_name}"
         message = (
@@ -20,8 +45,11 @@ class NotificationService:
             f"Iltimos, hujjatni ko'rib chiqing va tasdiqlang yoki rad eting."
         )
         
-        notification = Notification.objects.create(
+        if role_type is None:
+            role_type = cls._current_step_role(document)
+        notification = cls._create_notification(
             recipient=approver,
+            role_type=role_type,
             notification_type='approval_needed',
             title=title,
             message=message,
@@ -60,7 +88,7 @@ class NotificationService:
             f"Endi QR kodli rasmiy nusxani yuklab olishingiz mumkin."
         )
         
-        notification = Notification.objects.create(
+        notification = cls._create_notification(
             recipient=uploader,
             notification_type='document_approved',
             title=title,
@@ -100,7 +128,7 @@ class NotificationService:
             f"Iltimos, izohlarni inobatga olib qayta yuboring."
         )
         
-        notification = Notification.objects.create(
+        notification = cls._create_notification(
             recipient=uploader,
             notification_type='document_rejected',
             title=title,
@@ -125,7 +153,7 @@ class NotificationService:
             notification.save()
     
     @classmethod
-    def notify_auto_approved(cls, document, missed_approver):
+    def notify_auto_approved(cls, document, missed_approver, role_type=None):
       
         title = f"Hujjat avtomatik tasdiqlandi: {document.file_name}"
         message = (
@@ -136,8 +164,11 @@ class NotificationService:
             f"Iltimos, kelgusida belgilangan muddatlarda javob berishga e'tibor bering."
         )
         
-        notification = Notification.objects.create(
+        if role_type is None:
+            role_type = cls._current_step_role(document)
+        notification = cls._create_notification(
             recipient=missed_approver,
+            role_type=role_type,
             notification_type='auto_approved',
             title=title,
             message=message,
@@ -157,28 +188,22 @@ class NotificationService:
     
     @staticmethod
     def _send_email(to_email, subject, message, notification_type, document=None):
-        
+        """
+        Xatni EmailOutbox navbatiga yozish. SMTP bilan ishlash commit'dan keyin
+        alohida bajariladi, shuning uchun bu chaqiruv hujjat qulfini ushlab turmaydi.
+        """
         try:
-            # You can use HTML templates for better formatting
-            html_message = render_to_string('emails/notification.html', {
-                'subject': subject,
-                'message': message,
-                'notification_type': notification_type,
-                'document': document,
-                'site_url': getattr(settings, 'SITE_URL', 'http://localhost:8000'),
-            }) if document else None
-            
-            send_mail(
+            return EmailOutboxService.enqueue(
+                to_email=to_email,
                 subject=subject,
                 message=message,
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=[to_email],
-                html_message=html_message,
-                fail_silently=False,
+                notification_type=notification_type,
+                document=document,
             )
         except Exception as e:
             # Log error but don't fail the entire operation
-            print(f"Email sending failed: {str(e)}")
+            print(f"Email enqueue failed: {str(e)}")
+            return False
     
     @staticmethod
     def _send_push_notification(user, title, message):
@@ -207,10 +232,22 @@ class NotificationService:
         except Exception as e:
             print(f"Push notification failed: {str(e)}")
     
+    @classmethod
+    def get_queryset_for_user(cls, user):
+        """
+        Faol rolga tegishli xabarlar: rolsiz (umumiy) xabarlar va faol rol
+        sifatida yuborilganlar. (recipient, role_type, is_read, created_at) indeksidan foydalanadi.
+        """
+        queryset = Notification.objects.filter(recipient=user)
+        active_role_type = cls._active_role_type(user)
+        if not active_role_type:
+            return queryset
+        return queryset.filter(role_type__in=['', active_role_type])
+    
     @classmethod
     def get_unread_count(cls, user):
         """
-        Get count of unread notifications for a user
+        Faol rol bo'yicha o'qilmagan xabarlar soni (NotificationCounter'dan)
         
         Args:
             user: User object
@@ -218,33 +255,66 @@ class NotificationService:
         Returns:
             int: Count of unread notifications
         """
-        return Notification.objects.filter(recipient=user, is_read=False).count()
+        total = cls._counters_for_user(user).aggregate(total=Sum('unread'))['total']
+        return max(total or 0, 0)
+    
+    @classmethod
+    async def aget_unread_count(cls, user):
+        """get_unread_count'ning async varianti (SSE oqimi uchun)"""
+        total = (await cls._counters_for_user(user).aaggregate(total=Sum('unread')))['total']
+        return max(total or 0, 0)
+    
+    @classmethod
+    def _counters_for_user(cls, user):
+        counters = NotificationCounter.objects.filter(recipient=user)
+        active_role_type = cls._active_role_type(user)
+        if active_role_type:
+            counters = counters.filter(role_type__in=['', active_role_type])
+        return counters
+    
+    @staticmethod
+    def _active_role_type(user):
+        return user.active_role.role_type if user.active_role else None
     
     @classmethod
     def mark_as_read(cls, notification_id, user):
        
         try:
             notification = Notification.objects.get(id=notification_id, recipient=user)
-            notification.is_read = True
-            notification.save()
-            return True
         except Notification.DoesNotExist:
             return False
+        
+        with transaction.atomic():
+            # Faqat haqiqatan o'qilmagan bo'lsa hisoblagich kamayadi (ikki marta bosilganda ham)
+            updated = Notification.objects.filter(pk=notification.pk, is_read=False).update(is_read=True)
+            if updated:
+                NotificationCounter.adjust(user.pk, notification.role_type, -1)
+                DashboardStatsService.invalidate(user.pk)
+                cls._publish_change(user.pk)
+        return True
     
     @classmethod
     def mark_all_as_read(cls, user):
         
-        Notification.objects.filter(recipient=user, is_read=False).update(is_read=True)
+        with transaction.atomic():
+            # Hisoblagich qatorlarini bloklab, parallel yaratilgan xabarlar yo'qolmasligini ta'minlash
+            list(NotificationCounter.objects.select_for_update().filter(recipient=user))
+            Notification.objects.filter(recipient=user, is_read=False).update(is_read=True)
+            NotificationCounter.objects.filter(recipient=user).update(unread=0)
+        DashboardStatsService.invalidate(user.pk)
+        cls._publish_change(user.pk)
 
     
-    @staticmethod
+    @classmethod
     def notify_deadline_approaching(
+        cls,
         document,
         approver,
         remaining_hours,
         remaining_minutes=0,
         is_urgent=False,
         notification_type=None,
+        role_type=None,
     ):
         """
         Deadline yaqinlashganligi haqida xabar.
@@ -256,8 +326,8 @@ class NotificationService:
             remaining_minutes: Qolgan daqiqalar
             is_urgent: Urgent xabarmi?
             notification_type: Xabar turi
+            role_type: Tasdiqlovchi qaysi rol sifatida (berilmasa joriy bosqichdan olinadi)
         """
-        from .models import Notification
         
         if is_urgent:
             title = f"⏰ URGENT: Hujjat tasdiqlash muddati tez orada tugaydi!"
@@ -276,8 +346,11 @@ class NotificationService:
             notification_type = notification_type or 'deadline_reminder'
         
         # Notification yaratish
-        Notification.objects.create(
+        if role_type is None:
+            role_type = cls._current_step_role(document)
+        cls._create_notification(
             recipient=approver,
+            role_type=role_type,
             document=document,
             title=title,
             message=message,
@@ -287,17 +360,13 @@ class NotificationService:
         
         # Email yuborish (agar sozlamalarda yoqilgan bo'lsa)
         if approver.email:
-            try:
-                from django.core.mail import send_mail
-                send_mail(
-                    subject=title,
-                    message=message,
-                    from_email='noreply@unidocs.uz',
-                    recipient_list=[approver.email],
-                    fail_silently=True
-                )
-            except Exception as e:
-                print(f"Email notification error: {e}")
+            cls._send_email(
+                to_email=approver.email,
+                subject=title,
+                message=message,
+                notification_type=notification_type,
+                document=document,
+            )
         
         print(f"DEADLINE NOTIFICATION: Sent to {approver.get_full_name()}")
 
@@ -335,7 +404,7 @@ class NotificationService:
 
         notification_type = notification_type or ('deadline_urgent' if is_urgent else 'deadline_reminder')
 
-        Notification.objects.create(
+        cls._create_notification(
             recipient=approver,
             title=title,
             message=message,
@@ -344,17 +413,12 @@ class NotificationService:
         )
 
         if approver.email:
-            try:
-                from django.core.mail import send_mail
-                send_mail(
-                    subject=title,
-                    message=message,
-                    from_email='noreply@unidocs.uz',
-                    recipient_list=[approver.email],
-                    fail_silently=True
-                )
-            except Exception as e:
-                print(f"Email notification error: {e}")
+            cls._send_email(
+                to_email=approver.email,
+                subject=title,
+                message=message,
+                notification_type=notification_type,
+            )
 
     @classmethod
     def notify_author_about_urgent_deadline(cls, document, remaining_hours, remaining_minutes=0):
@@ -366,7 +430,7 @@ class NotificationService:
             "Iltimos, jarayonni kuzatib boring."
         )
 
-        notification = Notification.objects.create(
+        notification = cls._create_notification(
             recipient=uploader,
             notification_type='deadline_urgent',
             title=title,
@@ -0,0 +1,116 @@
+"""
+Keyset (cursor) pagination for large, time-ordered querysets.
+
+Pages are addressed by the (timestamp, id) of their boundary row instead of
+an OFFSET, so the cost of any page is one index range scan of `per_page`
+rows no matter how deep the user has scrolled.
+"""
+
+import base64
+import hashlib
+from datetime import datetime
+
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.db.models import Q
+
+
+class KeysetPage:
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    """
+    Sahifalash (field, id) bo'yicha kamayish tartibida:
+    `after` - keyingi (eskiroq) sahifa, `before` - oldingi (yangiroq) sahifa.
+    """
+
+    def __init__(self, queryset, per_page=25, field='uploaded_at'):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.field = field
+
+    def page(self, after=None, before=None):
+        after_key = self.decode_cursor(after)
+        before_key = self.decode_cursor(before)
+
+        if before_key:
+            value, pk = before_key
+            rows = list(
+                self.queryset
+                .filter(Q(**{f'{self.field}__gt': value}) | Q(**{self.field: value, 'pk__gt': pk}))
+                .order_by(self.field, 'pk')[:self.per_page + 1]
+            )
+            has_more = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+            rows.reverse()
+            return KeysetPage(
+                rows,
+                next_cursor=self.encode_cursor(rows[-1]) if rows else None,
+                previous_cursor=self.encode_cursor(rows[0]) if rows and has_more else None,
+            )
+
+        queryset = self.queryset
+        if after_key:
+            value, pk = after_key
+            queryset = queryset.filter(Q(**{f'{self.field}__lt': value}) | Q(**{self.field: value, 'pk__lt': pk}))
+        rows = list(queryset.order_by(f'-{self.field}', '-pk')[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        return KeysetPage(
+            rows,
+            next_cursor=self.encode_cursor(rows[-1]) if rows and has_more else None,
+            previous_cursor=self.encode_cursor(rows[0]) if rows and after_key else None,
+        )
+
+    def encode_cursor(self, obj):
+        raw = f"{getattr(obj, self.field).isoformat()}|{obj.pk}"
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor):
+        """Noto'g'ri kursor birinchi sahifa sifatida qabul qilinadi"""
+        if not cursor:
+            return None
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            value, pk = base64.urlsafe_b64decode(padded.encode()).decode().split('|', 1)
+            return datetime.fromisoformat(value), int(pk)
+        except (ValueError, TypeError):
+            return None
+
+
+def cached_count(queryset, timeout=60):
+    """
+    Filtrlar kombinatsiyasi bo'yicha taxminiy (keshlangan) jami soni.
+    Kalit SQL matnidan olinadi, shuning uchun har bir foydalanuvchi doirasi va filtri alohida keshlanadi.
+    """
+    try:
+        sql, params = queryset.order_by().query.sql_with_params()
+    except EmptyResultSet:
+        return 0
+    digest = hashlib.md5(f"{sql}|{params}".encode()).hexdigest()
+    key = f"count:{queryset.model._meta.db_table}:{digest}"
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, timeout)
+    return count
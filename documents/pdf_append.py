@@ -0,0 +1,394 @@
+"""
+Low-level PDF assembly for final-document stamping.
+
+IncrementalPdfAppender appends a page to a PDF as an incremental update.
+The original file is copied byte for byte (streamed, never parsed page by
+page), then the new page's objects, a new version of the page tree root,
+an xref section and a trailer with /Prev are appended after it.  Only the
+cross-reference data and the page tree root are read from the original,
+so the cost does not grow with page count or image data, and the original
+bytes (and any signatures over them) stay intact.
+
+The appended section has the same form as the last one in the original: a
+classic ``xref`` table after a classic table, a cross-reference stream
+after a cross-reference stream.  A classic table whose /Prev points at an
+xref stream is not a form PDF 1.5 defines (hybrid files use /XRefStm), and
+some readers do not follow it, so the two are never mixed across /Prev.
+
+PdfPageOverlay puts a small per-document page on top of a prebuilt
+template page at object level: the template is parsed and serialized once
+per process, the overlay becomes a Form XObject, so neither content stream
+is parsed and resource names cannot clash.
+"""
+
+import re
+import shutil
+from io import BytesIO
+
+from PyPDF2 import PdfReader
+from PyPDF2.errors import PyPdfError
+from PyPDF2.generic import (
+    ArrayObject,
+    DecodedStreamObject,
+    DictionaryObject,
+    IndirectObject,
+    NameObject,
+    NumberObject,
+    StreamObject,
+    read_object,
+)
+
+
+class PdfAppendError(ValueError):
+    """Manba PDF'ga qo'shimcha yangilanish yozib bo'lmaydi (shifrlangan yoki tuzilishi buzilgan)"""
+
+
+class PdfObjectCopier:
+    """
+    Boshqa PDF'lardagi obyektlarni (va ular bog'langan obyektlarni) yangi
+    raqamlar bilan ko'chirish. Har bir manba obyekti bir marta ko'chiriladi.
+    """
+
+    def __init__(self, first_number):
+        self.next_number = first_number
+        self.numbers = {}
+        self.queue = []
+        self.objects = []
+
+    def allocate(self):
+        number = self.next_number
+        self.next_number += 1
+        return number
+
+    def add(self, number, obj, generation=0):
+        self.objects.append((number, generation, obj))
+
+    def ref(self, indirect):
+        key = (id(indirect.pdf), indirect.idnum, indirect.generation)
+        if key not in self.numbers:
+            self.numbers[key] = self.allocate()
+            self.queue.append(indirect)
+        return IndirectObject(self.numbers[key], 0, None)
+
+    def clone(self, obj):
+        if isinstance(obj, IndirectObject):
+            return self.ref(obj)
+        if isinstance(obj, StreamObject):
+            copied = obj.__class__()
+            copied._data = obj._data
+            for key, value in dict.items(obj):
+                # /Length yozishda qayta hisoblanadi
+                if key != '/Length':
+                    copied[NameObject(key)] = self.clone(value)
+            return copied
+        if isinstance(obj, DictionaryObject):
+            copied = DictionaryObject()
+            for key, value in dict.items(obj):
+                copied[NameObject(key)] = self.clone(value)
+            return copied
+        if isinstance(obj, ArrayObject):
+            return ArrayObject(self.clone(value) for value in obj)
+        return obj
+
+    def flush(self):
+        """Navbatdagi bog'langan obyektlarni ko'chirib, barcha [(raqam, avlod, obyekt)] ni qaytarish"""
+        while self.queue:
+            indirect = self.queue.pop(0)
+            number = self.numbers[(id(indirect.pdf), indirect.idnum, indirect.generation)]
+            self.add(number, self.clone(indirect.get_object()))
+        return self.objects
+
+    @staticmethod
+    def write_objects(output, objects):
+        """Obyektlarni yozish. {raqam: (offset, avlod)} qaytaradi"""
+        offsets = {}
+        for number, generation, obj in objects:
+            offsets[number] = (output.tell(), generation)
+            output.write(f"{number} {generation} obj\n".encode())
+            obj.write_to_stream(output, None)
+            output.write(b"\nendobj\n")
+        return offsets
+
+    @staticmethod
+    def _subsections(numbers):
+        """Tartiblangan obyekt raqamlarini ketma-ket bo'laklarga ajratish: [[raqamlar], ...]"""
+        sections = []
+        for number in numbers:
+            if sections and number == sections[-1][-1] + 1:
+                sections[-1].append(number)
+            else:
+                sections.append([number])
+        return sections
+
+    @classmethod
+    def write_xref(cls, output, offsets, trailer):
+        xref_offset = output.tell()
+        # 0-obyekt (bo'sh ro'yxat boshi) - o'quvchilar bo'lim 0 dan boshlanishini kutadi
+        output.write(b"xref\n0 1\n0000000000 65535 f\r\n")
+
+        for section in cls._subsections(sorted(offsets)):
+            output.write(f"{section[0]} {len(section)}\n".encode())
+            for number in section:
+                offset, generation = offsets[number]
+                output.write(f"{offset:010d} {generation:05d} n\r\n".encode())
+
+        output.write(b"trailer\n")
+        trailer.write_to_stream(output, None)
+        output.write(f"\nstartxref\n{xref_offset}\n%%EOF\n".encode())
+
+    @classmethod
+    def write_xref_stream(cls, output, offsets, trailer, number):
+        """
+        Xref bo'limini cross-reference stream sifatida yozish (number - oqim
+        obyektining raqami). trailer kalitlari oqim lug'atiga ko'chiriladi.
+        """
+        xref_offset = output.tell()
+        offsets = dict(offsets)
+        offsets[number] = (xref_offset, 0)
+        offset_width = max((xref_offset.bit_length() + 7) // 8, 4)
+
+        index = ArrayObject()
+        rows = []
+        for section in cls._subsections(sorted(offsets)):
+            index.extend([NumberObject(section[0]), NumberObject(len(section))])
+            for item in section:
+                offset, generation = offsets[item]
+                rows.append(b"\x01" + offset.to_bytes(offset_width, 'big') + generation.to_bytes(2, 'big'))
+
+        stream = DecodedStreamObject()
+        stream.set_data(b"".join(rows))
+        stream = stream.flate_encode()
+        for key, value in dict.items(trailer):
+            stream[NameObject(key)] = value
+        stream[NameObject('/Type')] = NameObject('/XRef')
+        stream[NameObject('/Size')] = NumberObject(max(int(trailer.get('/Size', 0)), number + 1))
+        stream[NameObject('/Index')] = index
+        stream[NameObject('/W')] = ArrayObject([NumberObject(1), NumberObject(offset_width), NumberObject(2)])
+
+        output.write(f"{number} 0 obj\n".encode())
+        stream.write_to_stream(output, None)
+        output.write(f"\nendobj\nstartxref\n{xref_offset}\n%%EOF\n".encode())
+
+
+class IncrementalPdfAppender:
+    COPY_CHUNK_SIZE = 1024 * 1024
+    TAIL_SIZE = 2048
+
+    @classmethod
+    def append_page(cls, source_path, page_pdf, output_path):
+        """
+        source_path oxiriga page_pdf (bir sahifali PDF oqimi) ning birinchi
+        sahifasini qo'shib, natijani output_path ga yozish. Manbani o'qib
+        bo'lmasa PdfAppendError (chaqiruvchi to'liq qayta yozishga o'tishi mumkin).
+        """
+        with open(source_path, 'rb') as source:
+            try:
+                # Fayl obyekti berilganda PdfReader faylni xotiraga to'liq o'qimaydi
+                reader = PdfReader(source)
+                if reader.is_encrypted:
+                    raise PdfAppendError("Shifrlangan PDF'ga qo'shimcha yangilanish yozilmaydi")
+
+                prev_xref = cls._find_startxref(source)
+                last_section = cls._read_last_xref_section(reader, source, prev_xref)
+                trailer = reader.trailer
+                pages_ref = trailer['/Root'].raw_get('/Pages')
+                pages = pages_ref.get_object()
+                original_size = int(last_section['/Size'])
+
+                copier = PdfObjectCopier(original_size)
+                page_number = cls._clone_page(copier, page_pdf, pages_ref)
+                for number, generation, obj in cls._updated_page_tree(pages_ref, pages, page_number):
+                    copier.add(number, obj, generation)
+                objects = copier.flush()
+            except PdfAppendError:
+                raise
+            except (PyPdfError, KeyError, TypeError, ValueError) as e:
+                raise PdfAppendError(f"PDF tuzilishini o'qib bo'lmadi: {e}") from e
+
+            xref_stream_number = copier.allocate() if last_section.get('/Type') == '/XRef' else None
+
+            source.seek(0)
+            with open(output_path, 'wb') as output:
+                shutil.copyfileobj(source, output, cls.COPY_CHUNK_SIZE)
+                output.write(b"\n")
+
+                offsets = PdfObjectCopier.write_objects(output, objects)
+
+                new_trailer = DictionaryObject()
+                new_trailer[NameObject('/Size')] = NumberObject(max(original_size, max(offsets) + 1))
+                new_trailer[NameObject('/Root')] = trailer.raw_get('/Root')
+                new_trailer[NameObject('/Prev')] = NumberObject(prev_xref)
+                for key in ('/Info', '/ID'):
+                    if key in trailer:
+                        new_trailer[NameObject(key)] = trailer.raw_get(key)
+                if xref_stream_number is None:
+                    PdfObjectCopier.write_xref(output, offsets, new_trailer)
+                else:
+                    PdfObjectCopier.write_xref_stream(output, offsets, new_trailer, xref_stream_number)
+
+    @staticmethod
+    def _read_last_xref_section(reader, source, offset):
+        """
+        startxref ko'rsatgan bo'lim lug'ati: klassik jadvalda trailer, aks holda
+        xref stream obyekti. PyPDF2 xref stream'dan /Size ni trailer'ga ko'chirmaydi.
+        """
+        source.seek(offset)
+        if source.read(1) in b"\r\n":
+            offset = source.tell()
+        source.seek(offset)
+        if source.read(1) == b"x":
+            return reader.trailer
+        source.seek(offset)
+        reader.read_object_header(source)
+        section = read_object(source, reader)
+        if section.get('/Type') != '/XRef':
+            raise PdfAppendError("startxref xref bo'limiga ko'rsatmaydi")
+        return section
+
+    @classmethod
+    def _find_startxref(cls, source):
+        source.seek(0, 2)
+        size = source.tell()
+        source.seek(max(size - cls.TAIL_SIZE, 0))
+        matches = re.findall(rb"startxref\s+(\d+)", source.read())
+        if not matches:
+            raise PdfAppendError("startxref topilmadi")
+        return int(matches[-1])
+
+    @staticmethod
+    def _clone_page(copier, page_pdf, pages_ref):
+        """Sahifani va u bog'langan obyektlarni (shriftlar, rasmlar, kontent) ko'chirish"""
+        page = PdfReader(page_pdf).pages[0]
+        page_number = copier.allocate()
+        new_page = DictionaryObject()
+        for key, value in dict.items(page):
+            if key != '/Parent':
+                new_page[NameObject(key)] = copier.clone(value)
+        new_page[NameObject('/Parent')] = IndirectObject(pages_ref.idnum, pages_ref.generation, None)
+        copier.add(page_number, new_page)
+        return page_number
+
+    @staticmethod
+    def _updated_page_tree(pages_ref, pages, page_number):
+        """Sahifalar daraxti ildizining yangi versiyasi (/Kids ga sahifa, /Count + 1)"""
+        new_ref = IndirectObject(page_number, 0, None)
+        updated = DictionaryObject()
+        for key, value in dict.items(pages):
+            updated[NameObject(key)] = value
+        updated[NameObject('/Count')] = NumberObject(int(pages['/Count']) + 1)
+
+        kids = pages.raw_get('/Kids')
+        if isinstance(kids, IndirectObject):
+            # /Kids alohida obyekt bo'lsa, o'sha massivning yangi versiyasi yoziladi
+            kids_array = ArrayObject(list(kids.get_object()) + [new_ref])
+            return [
+                (kids.idnum, kids.generation, kids_array),
+                (pages_ref.idnum, pages_ref.generation, updated),
+            ]
+        updated[NameObject('/Kids')] = ArrayObject(list(kids) + [new_ref])
+        return [(pages_ref.idnum, pages_ref.generation, updated)]
+
+
+class PdfPageOverlay:
+    OVERLAY_NAME = '/UniDocOverlay'
+    CATALOG_NUMBER = 1
+    FORM_NUMBER = 2
+
+    @classmethod
+    def compile(cls, template_pdf):
+        """
+        Shablon sahifasini bir marta ko'chirib yozish. Natija (baytlar, offsetlar)
+        jarayon xotirasida saqlanadi; har bir hujjat uchun faqat overlay qo'shiladi.
+        """
+        template = PdfReader(template_pdf).pages[0]
+
+        copier = PdfObjectCopier(cls.FORM_NUMBER + 1)
+        pages_number, page_number, open_number, close_number = (copier.allocate() for _ in range(4))
+
+        page = DictionaryObject()
+        for key, value in dict.items(template):
+            if key not in ('/Parent', '/Resources', '/Contents'):
+                page[NameObject(key)] = copier.clone(value)
+        page[NameObject('/Parent')] = IndirectObject(pages_number, 0, None)
+
+        template_resources = template['/Resources']
+        resources = DictionaryObject()
+        for key, value in dict.items(template_resources):
+            resources[NameObject(key)] = copier.clone(value)
+        xobjects = DictionaryObject()
+        if '/XObject' in template_resources:
+            for key, value in dict.items(template_resources['/XObject']):
+                xobjects[NameObject(key)] = copier.clone(value)
+        xobjects[NameObject(cls.OVERLAY_NAME)] = IndirectObject(cls.FORM_NUMBER, 0, None)
+        resources[NameObject('/XObject')] = xobjects
+        page[NameObject('/Resources')] = resources
+
+        # Shablon grafik holati overlay'ga o'tmasligi uchun q ... Q ichiga olinadi
+        contents = template.raw_get('/Contents')
+        if isinstance(contents, IndirectObject) and isinstance(contents.get_object(), ArrayObject):
+            contents = contents.get_object()
+        if not isinstance(contents, ArrayObject):
+            contents = [contents]
+        page[NameObject('/Contents')] = ArrayObject(
+            [IndirectObject(open_number, 0, None)]
+            + [copier.clone(item) for item in contents]
+            + [IndirectObject(close_number, 0, None)]
+        )
+
+        copier.add(cls.CATALOG_NUMBER, DictionaryObject({
+            NameObject('/Type'): NameObject('/Catalog'),
+            NameObject('/Pages'): IndirectObject(pages_number, 0, None),
+        }))
+        copier.add(pages_number, DictionaryObject({
+            NameObject('/Type'): NameObject('/Pages'),
+            NameObject('/Kids'): ArrayObject([IndirectObject(page_number, 0, None)]),
+            NameObject('/Count'): NumberObject(1),
+        }))
+        copier.add(page_number, page)
+        copier.add(open_number, cls._content_stream(b"q\n"))
+        copier.add(close_number, cls._content_stream(f"\nQ\nq {cls.OVERLAY_NAME} Do Q\n".encode()))
+
+        output = BytesIO()
+        output.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        offsets = PdfObjectCopier.write_objects(output, copier.flush())
+        return {'prefix': output.getvalue(), 'offsets': offsets, 'next_number': copier.next_number}
+
+    @classmethod
+    def compose(cls, compiled, overlay_pdf):
+        """
+        compile() natijasi ustiga overlay_pdf (PDF oqimi) sahifasini qo'yib,
+        bir sahifali yangi PDF (BytesIO) qaytarish.
+        """
+        overlay = PdfReader(overlay_pdf).pages[0]
+        copier = PdfObjectCopier(compiled['next_number'])
+        copier.add(cls.FORM_NUMBER, cls._overlay_form(copier, overlay))
+
+        output = BytesIO()
+        output.write(compiled['prefix'])
+        offsets = dict(compiled['offsets'])
+        offsets.update(PdfObjectCopier.write_objects(output, copier.flush()))
+        trailer = DictionaryObject({
+            NameObject('/Size'): NumberObject(max(offsets) + 1),
+            NameObject('/Root'): IndirectObject(cls.CATALOG_NUMBER, 0, None),
+        })
+        PdfObjectCopier.write_xref(output, offsets, trailer)
+        output.seek(0)
+        return output
+
+    @classmethod
+    def _overlay_form(cls, copier, overlay):
+        """Overlay sahifasini Form XObject'ga aylantirish (o'z resurslari bilan)"""
+        contents = overlay.get_contents()
+        form = cls._content_stream(contents.get_data() if contents is not None else b"")
+        form[NameObject('/Type')] = NameObject('/XObject')
+        form[NameObject('/Subtype')] = NameObject('/Form')
+        form[NameObject('/BBox')] = copier.clone(overlay.raw_get('/MediaBox'))
+        if '/Resources' in overlay:
+            form[NameObject('/Resources')] = copier.clone(overlay.raw_get('/Resources'))
+        return form
+
+    @staticmethod
+    def _content_stream(data):
+        stream = DecodedStreamObject()
+        stream.set_data(data)
+        return stream.flate_encode()
@@ -2,25 +2,41 @@
 QR Code Generation and PDF Integration Service
 """
 
+import hashlib
 import qrcode
 import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from datetime import timedelta
 from io import BytesIO
 from PIL import Image
+from django.core.files import File
 from django.core.files.base import ContentFile
 from django.conf import settings
+from django.db.models import F, Q
 from django.utils import timezone
 from PyPDF2 import PdfReader, PdfWriter
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import mm
 from reportlab.lib.colors import black
+from .pdf_append import IncrementalPdfAppender, PdfAppendError, PdfPageOverlay
+from .verification import VerificationCodeAllocator
+from .verification_cache import VerificationLookupCache
 
 class QRCodeService:
     
     QR_SIZE_MM = 40  
-    
+
+    # Tasdiqlash varaqasining o'zgarmas qismi (sarlavha, chiziq, qonuniy matn) sayt va
+    # til bo'yicha bir marta chiziladi; hujjatga faqat QR va maydonlar ustidan qo'yiladi.
+    # Joylashuv o'zgarsa versiyani oshiring - eski shablon fayllari ishlatilmay qoladi.
+    VERIFICATION_TEMPLATE_VERSION = 1
+    _verification_templates = {}
+
     @classmethod
-    def generate_qr_code_image(cls, document):
+    def _build_qr(cls, document):
         verification_url = cls._get_verification_url(document)
         
         qr = qrcode.QRCode(
@@ -31,8 +47,56 @@ class QRCodeService:
         )
         qr.add_data(verification_url)
         qr.make(fit=True)
-        
-        return qr.make_image(fill_color="black", back_color="white")
+        return qr
+
+    @classmethod
+    def generate_qr_code_image(cls, document):
+        return cls._build_qr(document).make_image(fill_color="black", back_color="white")
+
+    @staticmethod
+    def _qr_runs(matrix):
+        """Har qatordagi ketma-ket qora modullar: (satr, boshlanish, uzunlik)"""
+        for row_index, row in enumerate(matrix):
+            start = None
+            for col_index, dark in enumerate(row + [False]):
+                if dark and start is None:
+                    start = col_index
+                elif not dark and start is not None:
+                    yield row_index, start, col_index - start
+                    start = None
+
+    @classmethod
+    def draw_qr(cls, c, document, x, y, size):
+        """
+        QR kodni ReportLab canvas'ga vektor to'rtburchaklar sifatida chizish:
+        PNG, fayl tizimi yoki storage kerak emas, har qanday o'lchamda aniq.
+        """
+        matrix = cls._build_qr(document).get_matrix()
+        module = size / len(matrix)
+        path = c.beginPath()
+        for row, start, length in cls._qr_runs(matrix):
+            # PDF koordinatalari pastdan yuqoriga
+            path.rect(x + start * module, y + size - (row + 1) * module, length * module, module)
+        c.saveState()
+        c.setFillColor(black)
+        c.drawPath(path, stroke=0, fill=1)
+        c.restoreState()
+
+    @classmethod
+    def generate_qr_svg(cls, document):
+        """Veb uchun QR kod (SVG, bitta path)"""
+        matrix = cls._build_qr(document).get_matrix()
+        size = len(matrix)
+        path = ''.join(
+            f"M{start} {row}h{length}v1h-{length}z"
+            for row, start, length in cls._qr_runs(matrix)
+        )
+        return (
+            f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {size} {size}" '
+            f'shape-rendering="crispEdges">'
+            f'<rect width="{size}" height="{size}" fill="#fff"/>'
+            f'<path d="{path}" fill="#000"/></svg>'
+        )
     
     @classmethod
     def save_qr_image(cls, document):
@@ -46,46 +110,201 @@ class QRCodeService:
         document.qr_code_image.save(filename, ContentFile(buffer.read()), save=True)
         return document.qr_code_image
 
+    @staticmethod
+    def lease_cutoff():
+        """Bundan oldin navbatga qo'yilgan/olingan pending/processing - ishchi yiqilgan deb hisoblanadi"""
+        return timezone.now() - timedelta(minutes=getattr(settings, 'FINAL_PDF_LEASE_MINUTES', 15))
+
+    @classmethod
+    def restamp_filter(cls):
+        """
+        Soatlik vazifa qayta ishlaydigan hujjatlar: so'ralmagan, navbatda qolib
+        ketgan, ijarasi o'tgan processing va urinishlari tugamagan failed.
+        """
+        stale = Q(final_pdf_started_at__isnull=True) | Q(final_pdf_started_at__lt=cls.lease_cutoff())
+        return (
+            Q(final_pdf_status='none')
+            | (Q(final_pdf_status__in=['pending', 'processing']) & stale)
+            | Q(final_pdf_status='failed', final_pdf_attempts__lt=getattr(settings, 'FINAL_PDF_MAX_ATTEMPTS', 5))
+        )
+
+    @staticmethod
+    def attempts_exhausted(document):
+        """Xato bilan tugagan va qayta urinishlar tugagan - faqat administrator qayta so'rashi mumkin"""
+        return (
+            document.final_pdf_status == 'failed'
+            and document.final_pdf_attempts >= getattr(settings, 'FINAL_PDF_MAX_ATTEMPTS', 5)
+        )
+
+    @classmethod
+    def request_final_pdf(cls, document):
+        """
+        Yakuniy PDF'ni fon vazifasiga navbatga qo'yish. Hujjat to'liq
+        tasdiqlanganda chaqiriladi; vazifa commit'dan keyin ishga tushadi
+        (broker bo'lmasa ham so'rov oqimida emas, fon oqimida).
+        """
+        from .models import Hujjat
+        from .tasks import dispatch_after_commit, stamp_final_pdf
+        
+        now = timezone.now()
+        # Yangi so'rov - yangi urinishlar seriyasi; xato bilan tugaganniki saqlanadi (FINAL_PDF_MAX_ATTEMPTS)
+        attempts = document.final_pdf_attempts if document.final_pdf_status == 'failed' else 0
+        Hujjat.objects.filter(pk=document.pk).update(
+            final_pdf_status='pending', final_pdf_started_at=now, final_pdf_attempts=attempts
+        )
+        document.final_pdf_status = 'pending'
+        document.final_pdf_started_at = now
+        document.final_pdf_attempts = attempts
+        # Tasdiqlash UPDATE/bulk_update bilan bo'lgan bo'lishi mumkin - "topilmadi" yozuvini ham tozalash
+        VerificationLookupCache.invalidate(document)
+        dispatch_after_commit(stamp_final_pdf, document.pk, background=True)
+    
+    @classmethod
+    def stamp_final_pdf(cls, document_id):
+        """
+        Navbatdagi hujjat uchun yakuniy PDF yaratish (ishchi jarayonda).
+        Holat pending (yoki ijarasi o'tgan processing) -> processing shartli UPDATE
+        bilan olinadi, shuning uchun bir hujjat ikki marta parallel ishlanmaydi,
+        yiqilgan ishchi qoldirgan hujjat esa abadiy processing'da qolmaydi.
+        Bajarilgan bo'lsa True.
+        """
+        from .models import Hujjat
+        
+        claimed = Hujjat.objects.filter(
+            Q(final_pdf_status='pending')
+            | Q(final_pdf_status='processing', final_pdf_started_at__lt=cls.lease_cutoff())
+            | Q(final_pdf_status='processing', final_pdf_started_at__isnull=True),
+            pk=document_id, status='approved',
+        ).update(
+            final_pdf_status='processing',
+            final_pdf_started_at=timezone.now(),
+            final_pdf_attempts=F('final_pdf_attempts') + 1,
+        )
+        if not claimed:
+            return False
+        
+        document = Hujjat.objects.select_related('document_type').get(pk=document_id)
+        try:
+            cls.generate_final_pdf(document)
+        except Exception:
+            Hujjat.objects.filter(pk=document_id).update(final_pdf_status='failed')
+            raise
+        return True
+    
     @classmethod
     def generate_final_pdf(cls, document):
         """Asl PDF oxiriga yangi tasdiqlash sahifasini qo'shish"""
+        from .blobs import BlobStore
        
         if document.status != 'approved':
             raise ValueError("Hujjat tasdiqlanmagan")
         
-        if not document.qr_code_image:
-            cls.save_qr_image(document)
-        
-        original_pdf_path = document.file.path
-        
-        if not os.path.exists(original_pdf_path):
-            raise FileNotFoundError(f"Fayl topilmadi: {original_pdf_path}")
+        if not document.file.name or not document.file.storage.exists(document.file.name):
+            raise FileNotFoundError(f"Fayl topilmadi: {document.file.name}")
         
-        # Chiqish fayli yo'li
-        output_filename = f"approved_{document.uuid}.pdf"
-        output_path = os.path.join(settings.MEDIA_ROOT, 'approved_documents', output_filename)
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        
-        # PDF o'quvchi va yozuvchi
+        # Xuddi shu kirish (asl fayl mazmuni + varaqa maydonlari) uchun tayyor natija qayta ishlatiladi
+        stamp_key = cls._stamp_key(document)
+        blob = BlobStore.find_derived(stamp_key)
+        if blob is not None:
+            BlobStore.acquire(blob)
+        else:
+            with cls._local_copy(document.file) as original_pdf_path:
+                blob = cls._stamp_to_blob(document, original_pdf_path, stamp_key)
+
+        previous_name = document.final_pdf.name
+        document.final_pdf.name = blob.name
+        document.final_pdf_status = 'ready'
+        document.final_pdf_attempts = 0
+        document.save(update_fields=['final_pdf', 'final_pdf_status', 'final_pdf_attempts'])
+        BlobStore.release(previous_name)
+        VerificationLookupCache.populate(document)
+
+    @staticmethod
+    @contextmanager
+    def _local_copy(field_file):
+        """
+        Asl faylning lokal yo'li (PdfReader'ga tasodifiy kirish kerak).
+        FileSystemStorage'da faylning o'zi, boshqa storage'da (S3) vaqtinchalik nusxa.
+        """
+        try:
+            path = field_file.path
+        except NotImplementedError:
+            path = None
+        if path is not None:
+            yield path
+            return
+
+        temp_fd, temp_path = tempfile.mkstemp(suffix='.pdf')
+        try:
+            with os.fdopen(temp_fd, 'wb') as temp_file, field_file.storage.open(field_file.name, 'rb') as source:
+                shutil.copyfileobj(source, temp_file, 1024 * 1024)
+            yield temp_path
+        finally:
+            os.remove(temp_path)
+
+    @classmethod
+    def _stamp_to_blob(cls, document, original_pdf_path, stamp_key):
+        from .blobs import BlobStore
+
+        verification_page_buffer = cls._create_verification_page(document)
+
+        # Natija avval vaqtinchalik faylga yoziladi, keyin mazmun bo'yicha storage'ga
+        temp_fd, temp_path = tempfile.mkstemp(suffix='.pdf')
+        os.close(temp_fd)
+        try:
+            if getattr(settings, 'FINAL_PDF_INCREMENTAL', True):
+                try:
+                    # Asl baytlar o'zgarmaydi, faqat oxiriga yangi sahifa yoziladi
+                    IncrementalPdfAppender.append_page(original_pdf_path, verification_page_buffer, temp_path)
+                except PdfAppendError as e:
+                    # Shifrlangan yoki buzilgan PDF - to'liq qayta yozishga o'tamiz
+                    print(f"Incremental PDF update failed, rewriting: {str(e)}")
+                    verification_page_buffer.seek(0)
+                    cls._rewrite_with_page(original_pdf_path, verification_page_buffer, temp_path)
+            else:
+                cls._rewrite_with_page(original_pdf_path, verification_page_buffer, temp_path)
+            with open(temp_path, 'rb') as stamped_file:
+                return BlobStore.put(File(stamped_file), '.pdf', derivation_key=stamp_key)
+        finally:
+            os.remove(temp_path)
+
+    @classmethod
+    def _stamp_key(cls, document):
+        """
+        Muhrlash natijasini aniqlovchi kalit. Asl fayl blob bo'lmasa yoki sana
+        hali belgilanmagan bo'lsa (varaqaga joriy vaqt yoziladi) - None.
+        """
+        from .models import StoredBlob
+
+        source_sha256 = StoredBlob.objects.filter(name=document.file.name).values_list('sha256', flat=True).first()
+        if source_sha256 is None or document.completed_at is None:
+            return None
+        parts = [
+            source_sha256,
+            cls.VERIFICATION_TEMPLATE_VERSION,
+            cls._get_site_domain(),
+            settings.LANGUAGE_CODE,
+            cls._get_verification_url(document),
+            document.verification_code,
+            document.completed_at.strftime("%Y-%m-%d %H:%M:%S"),
+            document.document_type.name,
+            getattr(settings, 'FINAL_PDF_INCREMENTAL', True),
+        ]
+        return hashlib.sha256("|".join(str(part) for part in parts).encode()).hexdigest()
+
+    @staticmethod
+    def _rewrite_with_page(original_pdf_path, verification_page_buffer, output_path):
+        """Barcha sahifalarni yangi PDF'ga ko'chirib, oxiriga tasdiqlash sahifasini qo'shish"""
         reader = PdfReader(original_pdf_path)
         writer = PdfWriter()
-        
-        # 1. Asl hujjatning barcha sahifalarini qo'shamiz
+
         for page in reader.pages:
             writer.add_page(page)
-            
-        # 2. Yangi alohida sahifa yaratamiz (Verification Page)
-        verification_page_buffer = cls._create_verification_page(document)
-        verification_reader = PdfReader(verification_page_buffer)
-        
-        writer.add_page(verification_reader.pages[0])
-        
+        writer.add_page(PdfReader(verification_page_buffer).pages[0])
+
         with open(output_path, 'wb') as output_file:
             writer.write(output_file)
-        
-        document.final_pdf.name = f'approved_documents/{output_filename}'
-        document.save(update_fields=['final_pdf'])
-    
+
     @classmethod
     def _create_verification_page(cls, document):
         """
@@ -93,53 +312,94 @@ class QRCodeService:
         - O'ng burchak: QR kod
         - Chap burchak: Rasmiy matn
         """
-        buffer = BytesIO()
-        c = canvas.Canvas(buffer, pagesize=A4)
-        
+        overlay = cls._render_verification_overlay(document)
+        return PdfPageOverlay.compose(cls._get_verification_template(), overlay)
+
+    @classmethod
+    def _verification_layout(cls):
         width, height = A4
         margin = 20 * mm
         qr_size = cls.QR_SIZE_MM * mm
+        content_top_y = height - margin - 20*mm
+        qr_x = width - margin - qr_size
+        return {
+            'width': width,
+            'height': height,
+            'margin': margin,
+            'qr_size': qr_size,
+            'qr_x': qr_x,
+            'qr_y': content_top_y - qr_size,
+            'text_x': margin,
+            'text_y': content_top_y,
+            'max_text_width': qr_x - margin - 10*mm,
+        }
+
+    @classmethod
+    def _get_verification_template(cls):
+        """Tayyorlangan shablon: avval jarayon xotirasidan, keyin diskdan, bo'lmasa chiziladi"""
+        key = hashlib.sha256(
+            f"{cls.VERIFICATION_TEMPLATE_VERSION}|{cls._get_site_domain()}|{settings.LANGUAGE_CODE}".encode()
+        ).hexdigest()[:16]
+        compiled = cls._verification_templates.get(key)
+        if compiled is not None:
+            return compiled
+
+        template = None
+        template_dir = getattr(settings, 'VERIFICATION_TEMPLATE_DIR', '')
+        template_path = os.path.join(template_dir, f"verification_{key}.pdf") if template_dir else None
+        if template_path:
+            try:
+                with open(template_path, 'rb') as template_file:
+                    template = template_file.read()
+            except FileNotFoundError:
+                pass
+        if template is None:
+            template = cls._render_verification_template().getvalue()
+            if template_path:
+                cls._write_template_cache(template_dir, template_path, template)
+
+        compiled = PdfPageOverlay.compile(BytesIO(template))
+        cls._verification_templates[key] = compiled
+        return compiled
+
+    @staticmethod
+    def _write_template_cache(template_dir, template_path, template):
+        """Lokal disk keshi ixtiyoriy: yozib bo'lmasa shablon faqat xotirada qoladi"""
+        temp_path = f"{template_path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(template_dir, exist_ok=True)
+            # Parallel ishchilar bir xil faylni yozsa ham, yarim yozilgan shablon o'qilmaydi
+            with open(temp_path, 'wb') as template_file:
+                template_file.write(template)
+            os.replace(temp_path, template_path)
+        except OSError as e:
+            print(f"Verification template cache write failed ({template_dir}): {str(e)}")
+
+    @classmethod
+    def _render_verification_template(cls):
+        """Varaqaning hujjatga bog'liq bo'lmagan qismi"""
+        layout = cls._verification_layout()
+        buffer = BytesIO()
+        c = canvas.Canvas(buffer, pagesize=A4)
+
+        width, height, margin = layout['width'], layout['height'], layout['margin']
         
         c.setFont("Helvetica-Bold", 14)
         c.drawCentredString(width / 2, height - margin, "ELEKTRON HUJJAT TASDIQLASH VARAQASI")
         
         c.setLineWidth(1)
         c.line(margin, height - margin - 5*mm, width - margin, height - margin - 5*mm)
-        
-        content_top_y = height - margin - 20*mm
-        
-        qr_x = width - margin - qr_size
-        qr_y = content_top_y - qr_size
-        
-        if document.qr_code_image:
-            qr_path = document.qr_code_image.path
-            c.drawImage(qr_path, qr_x, qr_y, width=qr_size, height=qr_size)
             
         c.setFont("Helvetica", 8)
-        c.drawCentredString(qr_x + (qr_size/2), qr_y - 4*mm, "Skaner qiling")
-
-        text_x = margin
-        text_y = content_top_y
+        c.drawCentredString(layout['qr_x'] + (layout['qr_size']/2), layout['qr_y'] - 4*mm, "Skaner qiling")
 
-        max_text_width = qr_x - margin - 10*mm
+        max_text_width = layout['max_text_width']
         
         c.setFillColor(black)
-        
-        c.setFont("Helvetica-Bold", 10)
-        c.drawString(text_x, text_y, f"Hujjat ID: {document.verification_code}")
-        
-        if document.completed_at:
-            date_str = document.completed_at.strftime("%Y-%m-%d %H:%M:%S")
-        else:
-            date_str = timezone.now().strftime("%Y-%m-%d %H:%M:%S")
-        c.drawString(text_x, text_y - 15, f"Tasdiqlangan sana: {date_str}")
-        
-        c.drawString(text_x, text_y - 30, f"Hujjat turi: {document.document_type.name}")
-        #c.drawString(text_x, text_y - 45, f"Yuklovchi: {document.uploaded_by.get_full_name()}")
 
         # Qonuniy matn
         c.setFont("Helvetica", 9)
-        text_start_y = text_y - 70
+        text_start_y = layout['text_y'] - 70
         
         legal_text = (
             "Mazkur hujjat O'zbekiston Respublikasi Vazirlar Mahkamasining 2017-yil 15-sentabrdagi 728-son "
@@ -154,7 +414,7 @@ class QRCodeService:
         )
 
         # Matnni chizish funksiyasi (wrapped)
-        text_obj = c.beginText(text_x, text_start_y)
+        text_obj = c.beginText(layout['text_x'], text_start_y)
         text_obj.setFont("Helvetica", 9)
         text_obj.setLeading(12) # Qatorlar orasi
         
@@ -184,6 +444,38 @@ class QRCodeService:
         
         buffer.seek(0)
         return buffer
+
+    @classmethod
+    def _render_verification_overlay(cls, document):
+        """Hujjatga xos qism: QR kod, ID, sana va hujjat turi"""
+        layout = cls._verification_layout()
+        buffer = BytesIO()
+        c = canvas.Canvas(buffer, pagesize=A4)
+
+        cls.draw_qr(c, document, layout['qr_x'], layout['qr_y'], layout['qr_size'])
+
+        text_x = layout['text_x']
+        text_y = layout['text_y']
+        
+        c.setFillColor(black)
+        
+        c.setFont("Helvetica-Bold", 10)
+        c.drawString(text_x, text_y, f"Hujjat ID: {document.verification_code}")
+        
+        if document.completed_at:
+            date_str = document.completed_at.strftime("%Y-%m-%d %H:%M:%S")
+        else:
+            date_str = timezone.now().strftime("%Y-%m-%d %H:%M:%S")
+        c.drawString(text_x, text_y - 15, f"Tasdiqlangan sana: {date_str}")
+        
+        c.drawString(text_x, text_y - 30, f"Hujjat turi: {document.document_type.name}")
+        #c.drawString(text_x, text_y - 45, f"Yuklovchi: {document.uploaded_by.get_full_name()}")
+
+        c.showPage()
+        c.save()
+
+        buffer.seek(0)
+        return buffer
     
     @classmethod
     def verify_document(cls, verification_input, qr_data=None):
@@ -191,11 +483,12 @@ class QRCodeService:
         document = None
         
         if verification_input:
-            verification_input = verification_input.strip().upper()
-            try:
-                document = Hujjat.objects.get(verification_code=verification_input, status='approved')
-            except Hujjat.DoesNotExist:
-                pass
+            verification_input = VerificationCodeAllocator.normalize(verification_input)
+            if VerificationCodeAllocator.is_plausible(verification_input):
+                try:
+                    document = Hujjat.objects.get(verification_code=verification_input, status='approved')
+                except Hujjat.DoesNotExist:
+                    pass
         
         if not document and qr_data:
             uuid_str = cls._extract_uuid_from_url(qr_data)
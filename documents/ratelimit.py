@@ -0,0 +1,235 @@
+"""
+In-app rate limiting for public verification endpoints.
+
+SecurityPolicy (the same row generate_security_configs turns into
+fail2ban/nftables files) drives two checks that run in middleware, before
+sessions, views or the ORM:
+
+* token buckets - ``burst`` tokens, refilled at ``rate_limit_per_minute`` -
+  keyed by client IP and, for submitted verification codes, by the code
+  prefix, so a brute force spread over many IPs still drains one bucket;
+* fail2ban-style bans - ``maxretry`` verification misses within
+  ``findtime_seconds`` block the IP for ``bantime_seconds`` (or for
+  ``findtime_seconds`` when bantime is not positive: permanent bans are
+  left to fail2ban).
+
+Buckets live in process memory (a bounded LRU per worker), so the effective
+rate is per worker; miss counters and bans are kept in the cache backend
+and shared by all workers.  The policy is read through a process-wide
+snapshot that reloads only when SecurityPolicy changes, and per-process
+counters are exposed through stats() (jobs_health) for tuning.
+"""
+
+import ipaddress
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+
+class SecurityPolicySnapshot:
+    VERSION_KEY = "security:policy:version"
+
+    _lock = threading.Lock()
+    _snapshot = None
+    _version = None
+    _checked_at = 0.0
+
+    @classmethod
+    def get(cls):
+        snapshot = cls._snapshot
+        interval = getattr(settings, "RATE_LIMIT_POLICY_CHECK_SECONDS", 5)
+        if snapshot is None or time.monotonic() - cls._checked_at >= interval:
+            snapshot = cls.sync()
+        return snapshot
+
+    @classmethod
+    def sync(cls):
+        """Keshdagi versiyani tekshirish va kerak bo'lsa qayta yuklash"""
+        version = cls._read_version()
+        with cls._lock:
+            if cls._snapshot is None or version is None or version != cls._version:
+                cls._snapshot = cls._load()
+                cls._version = version
+            cls._checked_at = time.monotonic()
+            return cls._snapshot
+
+    @classmethod
+    def invalidate(cls):
+        """SecurityPolicy o'zgarganda barcha jarayonlarga xabar berish"""
+        with cls._lock:
+            cls._snapshot = None
+            cls._version = None
+        cls._bump_version()
+        transaction.on_commit(cls._bump_version)
+
+    @classmethod
+    def _read_version(cls):
+        try:
+            version = cache.get(cls.VERSION_KEY)
+            if version is None:
+                cache.add(cls.VERSION_KEY, uuid.uuid4().hex, None)
+                version = cache.get(cls.VERSION_KEY)
+            return version
+        except Exception:
+            return None
+
+    @classmethod
+    def _bump_version(cls):
+        try:
+            cache.set(cls.VERSION_KEY, uuid.uuid4().hex, None)
+        except Exception:
+            pass
+
+    @staticmethod
+    def _load():
+        from .models import SecurityPolicy
+
+        # Qator bo'lmasa model standart qiymatlari (middleware'dan qator yaratilmaydi)
+        policy = SecurityPolicy.objects.order_by("-updated_at").first() or SecurityPolicy()
+        whitelist = []
+        for item in policy.get_whitelist():
+            try:
+                whitelist.append(ipaddress.ip_network(item, strict=False))
+            except ValueError:
+                continue
+        return {
+            "rate_per_second": max(policy.rate_limit_per_minute, 0) / 60.0,
+            "burst": max(policy.burst, 1),
+            "findtime": max(policy.findtime_seconds, 1),
+            "maxretry": policy.maxretry,
+            "bantime": policy.bantime_seconds if policy.bantime_seconds > 0 else max(policy.findtime_seconds, 1),
+            "whitelist": whitelist,
+        }
+
+
+class TokenBucketLimiter:
+    BAN_KEY = "ratelimit:ban:{ip}"
+    MISS_KEY = "ratelimit:miss:{ip}"
+    COUNTERS = ("allowed", "whitelisted", "limited_ip", "limited_code", "banned", "misses", "bans_issued")
+
+    _lock = threading.Lock()
+    _buckets = OrderedDict()
+    _counters = dict.fromkeys(COUNTERS, 0)
+
+    # ==================== CHECK ====================
+
+    @classmethod
+    def check(cls, ip, code=None):
+        """
+        So'rovni o'tkazish mumkinmi: (True, 0) yoki (False, retry_after_seconds).
+        Cheklov o'chirilgan (rate_limit_per_minute <= 0) bo'lsa doim ruxsat.
+        """
+        policy = SecurityPolicySnapshot.get()
+        if cls._is_whitelisted(ip, policy):
+            cls._count("whitelisted")
+            return True, 0
+
+        banned_for = cls._ban_remaining(ip)
+        if banned_for:
+            cls._count("banned")
+            return False, banned_for
+
+        if policy["rate_per_second"] <= 0:
+            cls._count("allowed")
+            return True, 0
+
+        keys = [("ip", f"ip:{ip}")]
+        if code:
+            prefix_length = getattr(settings, "RATE_LIMIT_CODE_PREFIX_LENGTH", 2)
+            keys.append(("code", f"code:{code[:prefix_length]}"))
+
+        now = time.monotonic()
+        with cls._lock:
+            # Ikkala chelakda ham token bo'lsagina ikkalasidan olinadi
+            buckets = [(kind, cls._refill(key, now, policy)) for kind, key in keys]
+            for kind, bucket in buckets:
+                if bucket[0] < 1:
+                    cls._counters[f"limited_{kind}"] += 1
+                    return False, int((1 - bucket[0]) / policy["rate_per_second"]) + 1
+            for _, bucket in buckets:
+                bucket[0] -= 1
+            cls._counters["allowed"] += 1
+        return True, 0
+
+    @classmethod
+    def _refill(cls, key, now, policy):
+        bucket = cls._buckets.get(key)
+        if bucket is None:
+            bucket = [float(policy["burst"]), now]
+            cls._buckets[key] = bucket
+            max_keys = getattr(settings, "RATE_LIMIT_MAX_KEYS", 10000)
+            while len(cls._buckets) > max_keys:
+                cls._buckets.popitem(last=False)
+        else:
+            bucket[0] = min(policy["burst"], bucket[0] + (now - bucket[1]) * policy["rate_per_second"])
+            bucket[1] = now
+            cls._buckets.move_to_end(key)
+        return bucket
+
+    @staticmethod
+    def _is_whitelisted(ip, policy):
+        if not policy["whitelist"] or not ip:
+            return False
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return False
+        return any(address in network for network in policy["whitelist"])
+
+    # ==================== MISSES / BANS ====================
+
+    @classmethod
+    def _ban_remaining(cls, ip):
+        try:
+            banned_until = cache.get(cls.BAN_KEY.format(ip=ip))
+        except Exception:
+            return 0
+        if not banned_until:
+            return 0
+        return max(int(banned_until - time.time()), 1)
+
+    @classmethod
+    def record_miss(cls, ip):
+        """Topilmagan kod/UUID: findtime ichida maxretry marta bo'lsa IP bloklanadi"""
+        policy = SecurityPolicySnapshot.get()
+        if policy["maxretry"] <= 0 or cls._is_whitelisted(ip, policy):
+            return
+        cls._count("misses")
+        miss_key = cls.MISS_KEY.format(ip=ip)
+        try:
+            cache.add(miss_key, 0, policy["findtime"])
+            misses = cache.incr(miss_key)
+        except ValueError:
+            # Kalit add va incr orasida muddati tugadi
+            cache.set(miss_key, 1, policy["findtime"])
+            misses = 1
+        except Exception:
+            return
+        if misses >= policy["maxretry"]:
+            cache.set(cls.BAN_KEY.format(ip=ip), time.time() + policy["bantime"], policy["bantime"])
+            cache.delete(miss_key)
+            cls._count("bans_issued")
+
+    # ==================== STATS ====================
+
+    @classmethod
+    def _count(cls, name):
+        with cls._lock:
+            cls._counters[name] += 1
+
+    @classmethod
+    def stats(cls):
+        """Jarayon hisoblagichlari (sozlash uchun)"""
+        policy = SecurityPolicySnapshot.get()
+        with cls._lock:
+            return {
+                **cls._counters,
+                "buckets": len(cls._buckets),
+                "rate_limit_per_minute": round(policy["rate_per_second"] * 60),
+                "burst": policy["burst"],
+            }
@@ -0,0 +1,135 @@
+"""
+Process-wide registry of Role rows.
+
+All roles are loaded once per process and kept in plain dicts, so role
+checks on every request (ActiveRoleMiddleware, User.has_role_type, ...) do
+not touch the database.  A version stamp in the cache backend tells other
+processes to reload after a Role is saved or deleted.
+"""
+
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+
+class RoleRegistry:
+    VERSION_KEY = "roles:registry:version"
+
+    _lock = threading.Lock()
+    _snapshot = None
+    _version = None
+    _checked_at = 0.0
+
+    # ==================== LOOKUPS ====================
+
+    @classmethod
+    def get_by_id(cls, role_id):
+        """ID bo'yicha rol (faol bo'lmasa ham)"""
+        if role_id is None:
+            return None
+        return cls._get_snapshot()["by_id"].get(role_id)
+
+    @classmethod
+    def get_by_code(cls, code):
+        """Kod bo'yicha faol rol"""
+        if not code:
+            return None
+        return cls._get_snapshot()["by_code"].get(code)
+
+    @classmethod
+    def get_by_name(cls, name):
+        """Nom bo'yicha faol rol (katta-kichik harf farqsiz)"""
+        if not name:
+            return None
+        return cls._get_snapshot()["by_name"].get(name.lower())
+
+    @classmethod
+    def get_default_for_type(cls, role_type):
+        """Rol tipi uchun standart rol, bo'lmasa birinchi faol rol"""
+        return cls._get_snapshot()["default_by_type"].get(role_type)
+
+    # ==================== VERSIONING ====================
+
+    @classmethod
+    def invalidate(cls):
+        """
+        Jarayondagi nusxani tashlab yuborish va boshqa jarayonlarga xabar berish.
+        Versiya tranzaksiya yakunlangandan keyin yana bir bor yangilanadi,
+        aks holda boshqa jarayon commit'dan oldingi ma'lumotni yuklab olishi mumkin.
+        """
+        with cls._lock:
+            cls._snapshot = None
+            cls._version = None
+        cls._bump_version()
+        transaction.on_commit(cls._bump_version)
+
+    @classmethod
+    def sync(cls):
+        """Keshdagi versiyani tekshirish va kerak bo'lsa qayta yuklash"""
+        version = cls._read_version()
+        with cls._lock:
+            if cls._snapshot is None or version is None or version != cls._version:
+                cls._snapshot = cls._load()
+                cls._version = version
+            cls._checked_at = time.monotonic()
+            return cls._snapshot
+
+    @classmethod
+    def _get_snapshot(cls):
+        snapshot = cls._snapshot
+        interval = getattr(settings, "ROLE_REGISTRY_CHECK_SECONDS", 2)
+        if snapshot is None or time.monotonic() - cls._checked_at >= interval:
+            snapshot = cls.sync()
+        return snapshot
+
+    @classmethod
+    def _read_version(cls):
+        try:
+            version = cache.get(cls.VERSION_KEY)
+            if version is None:
+                cache.add(cls.VERSION_KEY, uuid.uuid4().hex, None)
+                version = cache.get(cls.VERSION_KEY)
+            return version
+        except Exception:
+            return None
+
+    @classmethod
+    def _bump_version(cls):
+        try:
+            cache.set(cls.VERSION_KEY, uuid.uuid4().hex, None)
+        except Exception:
+            pass
+
+    @staticmethod
+    def _load():
+        from .models import Role
+
+        by_id = {}
+        by_code = {}
+        by_name = {}
+        default_by_type = {}
+        first_by_type = {}
+
+        for role in Role.objects.all():
+            by_id[role.pk] = role
+            if not role.is_active:
+                continue
+            by_code[role.code] = role
+            by_name.setdefault(role.name.lower(), role)
+            first_by_type.setdefault(role.role_type, role)
+            if role.is_default:
+                default_by_type.setdefault(role.role_type, role)
+
+        for role_type, role in first_by_type.items():
+            default_by_type.setdefault(role_type, role)
+
+        return {
+            "by_id": by_id,
+            "by_code": by_code,
+            "by_name": by_name,
+            "default_by_type": default_by_type,
+        }
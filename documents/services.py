@@ -4,6 +4,8 @@ from django.core.exceptions import ValidationError, PermissionDenied
 from django.db.models import Q, F  # F obyekti qo'shildi (muhim!)
 from . import models
 from .notifications import NotificationService
+from .dashboard import DashboardStatsService
+from .deadlines import DeadlineScheduler
 
 class ApprovalWorkflowService:
     """Service to manage document approval workflows"""
@@ -35,6 +37,7 @@ class ApprovalWorkflowService:
             current_step.approved_at = timezone.now()
             current_step.comment = comment
             current_step.save()
+            DashboardStatsService.invalidate_for_document(document)
             
             # 2. Log yozish
             models.ApprovalLog.objects.create(
@@ -65,14 +68,17 @@ class ApprovalWorkflowService:
             if next_step_index < total_steps:
                 document.current_step = next_step_index
                 document.save()
+                document.sync_current_step_flag()
                 
                 # Keyingi odamga xabar berish
                 try:
                     next_approver_step = document.approval_steps.get(step_order=next_step_index)
+                    DeadlineScheduler.schedule([next_approver_step])
                     if next_approver_step.approver:
                         NotificationService.notify_approval_needed(
                             document=document,
-                            approver=next_approver_step.approver
+                            approver=next_approver_step.approver,
+                            role_type=next_approver_step.role_required
                         )
                         next_approver_name = next_approver_step.approver.get_full_name()
                     else:
@@ -89,20 +95,18 @@ class ApprovalWorkflowService:
                 document.status = 'approved'
                 document.completed_at = timezone.now()
                 document.save()
+                document.sync_current_step_flag()
                 
-                # QR Kod yaratish
-                try:
-                    from .qr_service import QRCodeService
-                    QRCodeService.save_qr_image(document)
-                except Exception as e:
-                    print(f"QR kod yaratishda xatolik: {e}")
+                # QR kod va yakuniy PDF fon vazifasida (commit'dan keyin)
+                from .qr_service import QRCodeService
+                QRCodeService.request_final_pdf(document)
                 
                 # Muallifga xabar
                 NotificationService.notify_document_approved(document)
                 
                 return {
                     'status': 'fully_approved',
-                    'message': "Hujjat to'liq tasdiqlandi! QR kod generatsiya qilindi.",
+                    'message': "Hujjat to'liq tasdiqlandi! QR kodli PDF tayyorlanmoqda.",
                 }
     
     @staticmethod
@@ -135,6 +139,7 @@ class ApprovalWorkflowService:
             current_step.approved_at = timezone.now()
             current_step.comment = reason
             current_step.save()
+            DashboardStatsService.invalidate_for_document(document)
             
             # 2. Log
             models.ApprovalLog.objects.create(
@@ -163,6 +168,7 @@ class ApprovalWorkflowService:
             document.status = 'rejected'
             document.completed_at = timezone.now()
             document.save()
+            document.sync_current_step_flag()
             
             # Xabar
             NotificationService.notify_document_rejected(document, user, reason)
@@ -181,10 +187,9 @@ class ApprovalWorkflowService:
         """
         queryset = models.ApprovalStep.objects.filter(
             approver=user,
+            # MUHIM: faqat hujjatning HOZIRGI kutilayotgan bosqichi (qisman indeks: approver, deadline)
+            is_current=True,
             status='pending',
-            document__status='pending_approval',
-            # MUHIM TUZATISH: Step order hujjatning current_stepiga teng bo'lishi shart
-            step_order=F('document__current_step')
         )
         active_role_type = user.active_role.role_type if user.active_role else None
         if active_role_type:
@@ -274,9 +279,16 @@ class ApprovalWorkflowService:
             document.status = 'approved'
             document.completed_at = now
             document.save(update_fields=['status', 'completed_at'])
+            from .qr_service import QRCodeService
+            QRCodeService.request_final_pdf(document)
             updated = True
             break
 
+        if updated:
+            document.sync_current_step_flag()
+            if document.status == 'pending_approval':
+                DeadlineScheduler.schedule([document.get_current_approver()])
+            DashboardStatsService.invalidate_for_document(document)
         return updated
     
     # Sozlamalar
@@ -288,112 +300,164 @@ class ApprovalWorkflowService:
     EARLY_NOTIFY_HOUR = 21               # Kechasi bo'lsa, 21:00 da eslatish
     
     @staticmethod
-    def auto_approve_overdue_documents():
+    def auto_approve_overdue_documents(batch_size=None, document_ids=None):
         """
         Muddati o'tgan hujjatlarni avtomatik tasdiqlash.
         Har soat yarim soatda bir chaqiriladi.
+        
+        Hujjatlar `batch_size` tadan alohida tranzaksiyalarda qayta ishlanadi.
+        Qatorlar SKIP LOCKED bilan bloklanadi: hozir qo'lda tasdiqlanayotgan
+        hujjatlar o'tkazib yuboriladi va keyingi ishga tushirishda olinadi.
+        Bosqichlar, hujjatlar va loglar bulk so'rovlar bilan yoziladi; QR kod va
+        xabarlar commit'dan keyin finalize_auto_approved_documents vazifasida.
+        `document_ids` berilsa faqat shu hujjatlar (DeadlineScheduler hodisalari).
         """
-        from datetime import timedelta
-        from django.utils import timezone
-        from .models import Hujjat, ApprovalStep, ApprovalLog
+        from django.conf import settings
+        from .tasks import dispatch_after_commit, finalize_auto_approved_documents
         
         now = timezone.now()
+        batch_size = batch_size or getattr(settings, 'AUTO_APPROVE_BATCH_SIZE', 500)
+        totals = {'approved_steps': 0, 'skipped_steps': 0, 'completed_documents': 0, 'batches': 0}
+        last_pk = 0
+        candidates = models.Hujjat.objects.all()
+        if document_ids is not None:
+            candidates = candidates.filter(pk__in=document_ids)
         
-        with transaction.atomic():
-            # Muddati o'tgan bosqichlarni topish
-            overdue_steps = ApprovalStep.objects.filter(
-                status='pending',
-                deadline__lt=now,  # Deadline o'tgan
-                document__status='pending_approval',
-                step_order=F('document__current_step')
-            ).select_for_update().select_related('document', 'approver')
+        while True:
+            with transaction.atomic():
+                documents = list(
+                    candidates.select_for_update(skip_locked=True, of=('self',))
+                    .filter(
+                        pk__gt=last_pk,
+                        status='pending_approval',
+                        pk__in=models.ApprovalStep.objects.filter(
+                            is_current=True,
+                            status='pending',
+                            deadline__lt=now,
+                        ).values('document_id'),
+                    )
+                    .order_by('pk')[:batch_size]
+                )
+                if not documents:
+                    break
+                last_pk = documents[-1].pk
+                
+                result = ApprovalWorkflowService._auto_approve_batch(documents, now)
+                for key in ('approved_steps', 'skipped_steps', 'completed_documents'):
+                    totals[key] += result[key]
+                totals['batches'] += 1
+                
+                if result['notify_step_ids'] or result['approved_document_ids']:
+                    dispatch_after_commit(
+                        finalize_auto_approved_documents,
+                        result['notify_step_ids'],
+                        result['approved_document_ids'],
+                    )
             
-            approved_count = 0
-            skipped_count = 0
+            print(f"AUTO-APPROVED: batch {totals['batches']}: {result['approved_steps']} step(s), "
+                  f"{result['completed_documents']} document(s) completed")
+            if len(documents) < batch_size:
+                break
+        
+        return {
+            'status': 'completed',
+            **totals,
+            'timestamp': now
+        }
+    
+    @staticmethod
+    def _auto_approve_batch(documents, now):
+        """
+        Bloklangan hujjatlar paketi uchun joriy bosqichni tasdiqlash va keyingi
+        bosqichga o'tkazish. Hammasi xotirada hisoblanadi va 4 ta bulk so'rov bilan yoziladi.
+        """
+        from datetime import timedelta
+        
+        steps_by_document = {}
+        for step in models.ApprovalStep.objects.filter(document__in=documents).order_by('document_id', 'step_order'):
+            steps_by_document.setdefault(step.document_id, []).append(step)
+        
+        next_deadline = now + timedelta(hours=ApprovalWorkflowService.DEFAULT_APPROVAL_DEADLINE_HOURS)
+        changed_steps, changed_documents, logs, next_steps = [], [], [], []
+        notify_step_ids, approved_document_ids, affected_user_ids = [], [], set()
+        result = {'approved_steps': 0, 'skipped_steps': 0, 'completed_documents': 0}
+        
+        for document in documents:
+            steps = steps_by_document.get(document.pk, [])
+            by_order = {step.step_order: step for step in steps}
+            step = by_order.get(document.current_step)
+            # Qulf olinguncha holat o'zgargan bo'lishi mumkin
+            if step is None or step.status != 'pending' or step.deadline >= now:
+                continue
             
-            for step in overdue_steps:
-                try:
-                    document = step.document
-                    
-                    # Deadline necha soat o'tganligini hisoblash
-                    hours_overdue = (now - step.deadline).total_seconds() / 3600
-                    
-                    # 1. Bosqichni avtomatik tasdiqlash
-                    step.status = 'approved'
-                    step.approved_at = now
-                    step.comment = f"Avtomatik tasdiqlandi (deadline {hours_overdue:.1f} soat o'tgach)"
-                    step.save()
-                    
-                    # 2. Log yozish
-                    ApprovalLog.objects.create(
-                        document=document,
-                        approval_step=step,
-                        approver=step.approver if step.approver else None,
-                        action='auto_approved',
-                        comment=f"Hujjat deadline tugagandan keyin avtomatik tasdiqlandi. Kechikish: {hours_overdue:.1f} soat",
-                        ip_address=None,
-                        user_agent='Auto-approval System'
-                    )
-                    
-                    # 3. Keyingi bosqichga o'tish yoki yakunlash
-                    next_step_index = document.current_step + 1
-                    total_steps = document.approval_steps.count()
-                    
-                    if next_step_index < total_steps:
-                        # Keyingi bosqichga o'tish
-                        document.current_step = next_step_index
-                        document.save()
-                        
-                        # Keyingi tasdiqlovchiga xabar
-                        try:
-                            next_step = document.approval_steps.get(step_order=next_step_index)
-                            if next_step.approver:
-                                # Yangi deadline o'rnatish (2 kun)
-                                next_step.deadline = now + timedelta(
-                                    hours=ApprovalWorkflowService.DEFAULT_APPROVAL_DEADLINE_HOURS
-                                )
-                                next_step.save()
-                                
-                                NotificationService.notify_approval_needed(
-                                    document=document,
-                                    approver=next_step.approver
-                                )
-                        except ApprovalStep.DoesNotExist:
-                            pass
-                        
-                    else:
-                        # To'liq yakunlash
-                        document.status = 'approved'
-                        document.completed_at = now
-                        document.save()
-                        
-                        # QR Kod yaratish
-                        try:
-                            from .qr_service import QRCodeService
-                            QRCodeService.save_qr_image(document)
-                        except Exception as e:
-                            print(f"QR kod yaratishda xatolik: {e}")
-                        
-                        # Muallifga xabar
-                        NotificationService.notify_document_approved(document)
-                    
-                    approved_count += 1
-                    
-                    # System log
-                    print(f"AUTO-APPROVED: Hujjat {document.id} step {step.step_order + 1} "
-                          f"approved after {hours_overdue:.1f} hours overdue")
-                    
-                except Exception as e:
-                    skipped_count += 1
-                    print(f"AUTO-APPROVE ERROR: {e}")
-                    continue
+            affected_user_ids.add(document.uploaded_by_id)
+            affected_user_ids.update(s.approver_id for s in steps if s.approver_id)
+            hours_overdue = (now - step.deadline).total_seconds() / 3600
             
-            return {
-                'status': 'completed',
-                'approved_steps': approved_count,
-                'skipped_steps': skipped_count,
-                'timestamp': now
-            }
+            # 1. Bosqichni avtomatik tasdiqlash (tasdiqlovchisi yo'q bo'lsa - o'tkazib yuborish)
+            step.approved_at = now
+            step.is_current = False
+            if step.approver_id:
+                step.status = 'approved'
+                step.comment = f"Avtomatik tasdiqlandi (deadline {hours_overdue:.1f} soat o'tgach)"
+                logs.append(models.ApprovalLog(
+                    document=document,
+                    approval_step=step,
+                    approver_id=step.approver_id,
+                    action='auto_approved',
+                    comment=f"Hujjat deadline tugagandan keyin avtomatik tasdiqlandi. Kechikish: {hours_overdue:.1f} soat",
+                    ip_address=None,
+                    user_agent='Auto-approval System'
+                ))
+                result['approved_steps'] += 1
+            else:
+                step.status = 'skipped'
+                step.comment = "Auto-skipped: approver not found"
+                result['skipped_steps'] += 1
+            changed_steps.append(step)
+            
+            # 2. Keyingi bosqichga o'tish (tasdiqlovchisiz bosqichlar ham o'tkazib yuboriladi)
+            next_index = document.current_step + 1
+            while next_index in by_order:
+                next_step = by_order[next_index]
+                if next_step.status == 'pending' and next_step.approver_id:
+                    break
+                if next_step.status == 'pending':
+                    next_step.status = 'skipped'
+                    next_step.approved_at = now
+                    next_step.comment = "Auto-skipped: approver not found"
+                    changed_steps.append(next_step)
+                    result['skipped_steps'] += 1
+                next_index += 1
+            
+            if next_index in by_order:
+                # Yangi deadline o'rnatish (2 kun)
+                next_step = by_order[next_index]
+                next_step.deadline = next_deadline
+                next_step.is_current = True
+                changed_steps.append(next_step)
+                document.current_step = next_index
+                notify_step_ids.append(next_step.pk)
+                next_steps.append(next_step)
+            else:
+                # 3. To'liq yakunlash
+                document.status = 'approved'
+                document.completed_at = now
+                approved_document_ids.append(document.pk)
+                result['completed_documents'] += 1
+            changed_documents.append(document)
+        
+        models.ApprovalStep.objects.bulk_update(
+            changed_steps, ['status', 'approved_at', 'comment', 'deadline', 'is_current']
+        )
+        models.Hujjat.objects.bulk_update(changed_documents, ['current_step', 'status', 'completed_at'])
+        models.ApprovalLog.objects.bulk_create(logs)
+        DeadlineScheduler.schedule(next_steps)
+        DashboardStatsService.invalidate(*affected_user_ids)
+        
+        result['notify_step_ids'] = notify_step_ids
+        result['approved_document_ids'] = approved_document_ids
+        return result
     
     @staticmethod
     def check_and_notify_upcoming_deadlines():
@@ -411,27 +475,37 @@ class ApprovalWorkflowService:
         deadline_24h = now + timedelta(hours=24)
         
         # 24 soat ichida tugaydigan bosqichlar
-        steps_24h = ApprovalStep.objects.filter(
+        steps_24h = models.ApprovalStep.objects.filter(
             status='pending',
             deadline__gt=now,  # Hali tugamagan
             deadline__lte=deadline_24h,  # 24 soatdan kam qolgan
-            document__status='pending_approval',
-            step_order=F('document__current_step'),
+            is_current=True,
             approver__isnull=False
         ).select_related('document', 'approver')
         
         # 2. 2 soatdan kam qolgan deadline'lar
         deadline_2h = now + timedelta(hours=2)
         
-        steps_2h = ApprovalStep.objects.filter(
+        steps_2h = models.ApprovalStep.objects.filter(
             status='pending',
             deadline__gt=now,  # Hali tugamagan
             deadline__lte=deadline_2h,  # 2 soatdan kam qolgan
-            document__status='pending_approval',
-            step_order=F('document__current_step'),
+            is_current=True,
             approver__isnull=False
         ).select_related('document', 'approver')
         
+        return {
+            'status': 'notified',
+            **ApprovalWorkflowService._notify_deadline_steps(steps_24h, steps_2h, now),
+            'timestamp': now
+        }
+    
+    @staticmethod
+    def _notify_deadline_steps(steps_24h, steps_2h, now):
+        """
+        24 va 2 soatlik eslatmalarni tasdiqlovchi bo'yicha guruhlab yuborish.
+        check_and_notify_upcoming_deadlines va DeadlineScheduler ishlatadi.
+        """
         notified_24h = 0
         notified_2h = 0
         
@@ -519,10 +593,8 @@ class ApprovalWorkflowService:
                 print(f"2H NOTIFICATION ERROR: {e}")
         
         return {
-            'status': 'notified',
             'notified_24h': notified_24h,
             'notified_2h': notified_2h,
-            'timestamp': now
         }
     
     @staticmethod
@@ -579,45 +651,29 @@ class ApprovalWorkflowService:
             if i == 0 and approver:
                 NotificationService.notify_approval_needed(
                     document=document,
-                    approver=approver
+                    approver=approver,
+                    role_type=role
                 )
         
         # Hujjatning current_step ni 0 ga o'rnatish
         document.current_step = 0
         document.save()
+        document.sync_current_step_flag()
         
         return steps
     
     @staticmethod
     def _find_approver_for_role(document, role):
         """
-        Berilgan rol uchun tasdiqlovchini topish.
+        Berilgan rol uchun tasdiqlovchini topish (ApproverDirectory orqali).
         """
+        from .approvers import ApproverDirectory
         from .models import User
         
-        if role == 'department_head':
-            # Kafedra mudirini topish
-            if document.uploaded_by.department:
-                return User.objects.filter(
-                    active_role__role_type='department_head',
-                    managed_department=document.uploaded_by.department
-                ).first()
-        
-        elif role == 'faculty_dean':
-            # Fakultet dekanini topish
-            if document.uploaded_by.faculty:
-                return User.objects.filter(
-                    active_role__role_type='faculty_dean',
-                    managed_faculty=document.uploaded_by.faculty
-                ).first()
-        
-        elif role == 'director':
-            # Rektor/direktorni topish
-            return User.objects.filter(
-                active_role__role_type='director'
-            ).first()
-        
-        return None
+        approver_id = ApproverDirectory.resolve_for_document(document, [role]).get(role)
+        if approver_id is None:
+            return None
+        return User.objects.filter(pk=approver_id).first()
 
 
 
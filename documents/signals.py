@@ -0,0 +1,115 @@
+from django.db.models import Count
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .approvers import ApproverDirectory
+from .dashboard import DashboardStatsService
+from .deadlines import DeadlineScheduler
+from .blobs import BlobStore
+from .models import (
+    ApprovalStep, Hujjat, Notification, NotificationCounter, Role, SecurityPolicy, TeachingAllocation, User,
+)
+from .ratelimit import SecurityPolicySnapshot
+from .roles import RoleRegistry
+from .verification_cache import VerificationLookupCache
+
+
+@receiver(post_save, sender=Role, dispatch_uid="documents.role_registry_save")
+@receiver(post_delete, sender=Role, dispatch_uid="documents.role_registry_delete")
+def invalidate_role_registry(sender, **kwargs):
+    """Rol o'zgarganda barcha jarayonlardagi registry'ni yangilash"""
+    RoleRegistry.invalidate()
+    # Rol tipi o'zgargan bo'lishi mumkin - tasdiqlovchilar katalogini to'liq yangilash
+    ApproverDirectory.flush()
+
+
+@receiver(post_save, sender=User, dispatch_uid="documents.approver_directory_user_save")
+def refresh_user_approver_scope(sender, instance, created, update_fields=None, **kwargs):
+    """Foydalanuvchi roli yoki fakultet/kafedrasi o'zgarsa, tegishli kalitlarni yangilash"""
+    if update_fields is not None and not any(
+        field.removesuffix('_id') in update_fields or field in update_fields
+        for field in User.APPROVER_SCOPE_FIELDS
+    ):
+        return
+    old_scope = getattr(instance, '_loaded_approver_scope', None)
+    new_scope = instance.get_approver_scope()
+    if not created and old_scope == new_scope:
+        return
+    keys = ApproverDirectory.keys_for_user_scope(old_scope) | ApproverDirectory.keys_for_user_scope(new_scope)
+    ApproverDirectory.refresh_on_commit(keys)
+    instance._loaded_approver_scope = new_scope
+
+
+@receiver(post_delete, sender=User, dispatch_uid="documents.approver_directory_user_delete")
+def refresh_deleted_user_approver_scope(sender, instance, **kwargs):
+    scope = getattr(instance, '_loaded_approver_scope', None) or instance.get_approver_scope()
+    ApproverDirectory.refresh_on_commit(ApproverDirectory.keys_for_user_scope(scope))
+
+
+@receiver(post_save, sender=TeachingAllocation, dispatch_uid="documents.approver_directory_allocation_save")
+@receiver(post_delete, sender=TeachingAllocation, dispatch_uid="documents.approver_directory_allocation_delete")
+def refresh_allocation_approver(sender, instance, **kwargs):
+    """Fan taqsimoti o'zgarsa, eski va yangi (fan, guruh, yil) kalitlarini yangilash"""
+    keys = {('allocation', instance.get_allocation_key())}
+    old_key = getattr(instance, '_loaded_allocation_key', None)
+    if old_key:
+        keys.add(('allocation', old_key))
+    ApproverDirectory.refresh_on_commit(keys)
+    instance._loaded_allocation_key = instance.get_allocation_key()
+
+
+# post_delete ulanmaydi: u cleanup_old_notifications'dagi tezkor (bitta DELETE) o'chirishni o'chirib qo'yadi
+@receiver(post_save, sender=Notification, dispatch_uid="documents.dashboard_stats_notification_save")
+def invalidate_recipient_dashboard_stats(sender, instance, **kwargs):
+    """O'qilmagan xabarlar soni dashboard statistikasiga kiradi"""
+    DashboardStatsService.invalidate(instance.recipient_id)
+
+
+@receiver(post_save, sender=ApprovalStep, dispatch_uid="documents.deadline_scheduler_step_save")
+def reschedule_step_deadline(sender, instance, created, **kwargs):
+    """Deadline qo'lda o'zgartirilsa (admin va h.k.) hodisalarni qayta rejalashtirish"""
+    old_deadline = getattr(instance, '_loaded_deadline', None)
+    if created or old_deadline is None or old_deadline == instance.deadline:
+        return
+    if instance.is_current:
+        DeadlineScheduler.schedule([instance])
+    instance._loaded_deadline = instance.deadline
+
+
+@receiver(post_delete, sender=Hujjat, dispatch_uid="documents.blob_store_document_delete")
+def release_document_blobs(sender, instance, **kwargs):
+    """O'chirilgan hujjat fayllarining havolalarini bo'shatish (fayl GC'da o'chadi)"""
+    BlobStore.release(instance.file.name)
+    BlobStore.release(instance.final_pdf.name)
+
+
+@receiver(pre_delete, sender=Hujjat, dispatch_uid="documents.notification_counter_document_pre_delete")
+def remember_unread_document_notifications(sender, instance, **kwargs):
+    """Hujjat bilan kaskad o'chadigan o'qilmagan xabarlarni (qabul qiluvchi, rol) bo'yicha sanab qo'yish"""
+    instance._unread_notification_counts = list(
+        Notification.objects.filter(document=instance, is_read=False)
+        .values('recipient_id', 'role_type')
+        .annotate(total=Count('id'))
+        .order_by()
+    )
+
+
+@receiver(post_delete, sender=Hujjat, dispatch_uid="documents.notification_counter_document_delete")
+def adjust_counters_for_deleted_document(sender, instance, **kwargs):
+    """Kaskad o'chish NotificationService'ni chetlab o'tadi - hisoblagichlarni shu yerda kamaytirish"""
+    for row in getattr(instance, '_unread_notification_counts', ()):
+        NotificationCounter.adjust(row['recipient_id'], row['role_type'], -row['total'])
+
+
+@receiver(post_save, sender=Hujjat, dispatch_uid="documents.verification_cache_document_save")
+@receiver(post_delete, sender=Hujjat, dispatch_uid="documents.verification_cache_document_delete")
+def invalidate_verification_lookup(sender, instance, **kwargs):
+    """Holat, nom yoki fayl o'zgarsa ommaviy tekshiruv keshidan olib tashlash"""
+    VerificationLookupCache.invalidate(instance)
+
+
+@receiver(post_save, sender=SecurityPolicy, dispatch_uid="documents.security_policy_snapshot_save")
+@receiver(post_delete, sender=SecurityPolicy, dispatch_uid="documents.security_policy_snapshot_delete")
+def invalidate_security_policy_snapshot(sender, **kwargs):
+    """Cheklov parametrlari o'zgarsa barcha jarayonlardagi nusxani yangilash"""
+    SecurityPolicySnapshot.invalidate()
@@ -4,7 +4,10 @@ Celery Tasks for Background Processing
 
 from celery import shared_task
 import time
-from datetime import timedelta
+import uuid
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
 from .services import ApprovalWorkflowService
 from django.db.models import Q
@@ -22,17 +25,17 @@ def _mark_job_start(task_name):
     )
 
 
-def _mark_job_success(task_name, started_at):
+def _mark_job_success(task_name, started_at, metrics=None):
     duration_ms = int((time.monotonic() - started_at) * 1000)
-    JobRun.objects.update_or_create(
-        task_name=task_name,
-        defaults={
-            'last_status': 'success',
-            'last_success_at': timezone.now(),
-            'last_duration_ms': duration_ms,
-            'last_error': '',
-        },
-    )
+    defaults = {
+        'last_status': 'success',
+        'last_success_at': timezone.now(),
+        'last_duration_ms': duration_ms,
+        'last_error': '',
+    }
+    if metrics is not None:
+        defaults['metrics'] = metrics
+    JobRun.objects.update_or_create(task_name=task_name, defaults=defaults)
 
 
 def _mark_job_failure(task_name, started_at, error_message):
@@ -47,6 +50,35 @@ def _mark_job_failure(task_name, started_at, error_message):
     )
 
 
+def dispatch_after_commit(task, *args, background=False):
+    """
+    Vazifani tranzaksiya yakunlangach ishga tushirish: broker sozlangan bo'lsa
+    Celery navbatiga, aks holda (yoki navbatga qo'yib bo'lmasa) shu jarayonda.
+    background=True - broker bo'lmasa og'ir vazifa so'rov oqimida emas,
+    BackgroundRunner'ning bitta oqimli navbatida bajariladi.
+    """
+    def execute():
+        try:
+            task(*args)
+        except Exception as e:
+            print(f"{task.name} failed: {str(e)}")
+
+    def run():
+        if getattr(settings, 'CELERY_BROKER_URL', ''):
+            try:
+                task.delay(*args)
+                return
+            except Exception as e:
+                print(f"Failed to enqueue {task.name}: {str(e)}")
+        if background:
+            from .background import BackgroundRunner
+            BackgroundRunner.submit('tasks', execute)
+        else:
+            execute()
+
+    transaction.on_commit(run)
+
+
 @shared_task
 def auto_approve_overdue_documents():
     """
@@ -69,10 +101,83 @@ def auto_approve_overdue_documents():
         'timestamp': timezone.now().isoformat(),
         'auto_approved_count': auto_approved.get('approved_steps', 0),
         'skipped_steps': auto_approved.get('skipped_steps', 0),
+        'completed_documents': auto_approved.get('completed_documents', 0),
         'status': auto_approved.get('status'),
     }
 
 
+@shared_task
+def process_deadline_events():
+    """
+    Task to run due DeadlineEvent rows (24h/2h reminders and auto-approval)
+    Run this task every minute via Celery Beat
+    """
+    task_name = 'documents.tasks.process_deadline_events'
+    started_at = time.monotonic()
+    _mark_job_start(task_name)
+
+    try:
+        from .deadlines import DeadlineScheduler
+
+        result = DeadlineScheduler.process_due()
+        _mark_job_success(task_name, started_at, result)
+    except Exception as exc:
+        _mark_job_failure(task_name, started_at, str(exc))
+        raise
+
+    return {
+        'task': 'process_deadline_events',
+        'timestamp': timezone.now().isoformat(),
+        **result,
+    }
+
+
+@shared_task
+def finalize_auto_approved_documents(notify_step_ids, approved_document_ids):
+    """
+    Avtomatik tasdiqlash paketidan keyingi ishlar (commit'dan keyin):
+    keyingi tasdiqlovchilarga xabar, yakunlangan hujjatlar uchun yakuniy PDF navbati va muallifga xabar
+    """
+    from .notifications import NotificationService
+    from .qr_service import QRCodeService
+
+    next_steps = ApprovalStep.objects.filter(
+        pk__in=notify_step_ids,
+        status='pending',
+        approver__isnull=False,
+    ).select_related(
+        'approver',
+        'document__uploaded_by__department',
+        'document__document_type',
+    )
+    for step in next_steps:
+        try:
+            NotificationService.notify_approval_needed(
+                document=step.document,
+                approver=step.approver,
+                role_type=step.role_required
+            )
+        except Exception as e:
+            print(f"Failed to notify approver for document {step.document_id}: {str(e)}")
+
+    approved_documents = Hujjat.objects.filter(
+        pk__in=approved_document_ids,
+        status='approved',
+    ).select_related('uploaded_by', 'document_type')
+    for document in approved_documents:
+        QRCodeService.request_final_pdf(document)
+        try:
+            NotificationService.notify_document_approved(document)
+        except Exception as e:
+            print(f"Failed to notify author of document {document.id}: {str(e)}")
+
+    return {
+        'task': 'finalize_auto_approved_documents',
+        'notified_steps': len(notify_step_ids),
+        'approved_documents': len(approved_document_ids),
+    }
+
+
 @shared_task
 def send_deadline_reminders():
     """
@@ -99,84 +204,222 @@ def send_deadline_reminders():
     }
 
 
+QR_BATCH_TASK = 'documents.tasks.generate_qr_codes_batch'
+PDF_BATCH_TASK = 'documents.tasks.generate_final_pdfs_batch'
+# JobRun.metrics da saqlanadigan oxirgi xatolar soni
+FAN_OUT_MAX_ERRORS = 20
+
+
+def _iter_id_chunks(queryset, chunk_size):
+    """pk'larni server tomonidagi kursor bilan oqimda o'qib, bo'laklarga ajratish"""
+    chunk = []
+    for pk in queryset.order_by('pk').values_list('pk', flat=True).iterator(chunk_size=chunk_size):
+        chunk.append(pk)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _fan_out(task_name, queryset, chunk_task):
+    """
+    Koordinator: id'larni bo'laklab chunk_task'ga tarqatish. Broker sozlangan
+    bo'lsa har bir bo'lak alohida Celery vazifasi (ishchilar soniga qarab
+    parallel), aks holda shu jarayonda ketma-ket. Bo'laklar soni qaytariladi.
+    """
+    chunk_size = getattr(settings, 'MEDIA_BATCH_CHUNK_SIZE', 200)
+    run_id = uuid.uuid4().hex
+    JobRun.objects.filter(task_name=task_name).update(metrics={
+        'run_id': run_id,
+        'started_at': timezone.now().isoformat(),
+        'chunk_size': chunk_size,
+        'chunks_total': None,
+        'chunks_done': 0,
+        'processed': 0,
+        'succeeded': 0,
+        'failed': 0,
+        'errors': [],
+    })
+
+    use_broker = bool(getattr(settings, 'CELERY_BROKER_URL', ''))
+    chunks = 0
+    for document_ids in _iter_id_chunks(queryset, chunk_size):
+        chunks += 1
+        if use_broker:
+            try:
+                chunk_task.delay(document_ids, run_id)
+                continue
+            except Exception as e:
+                print(f"Failed to enqueue {chunk_task.name}: {str(e)}")
+        chunk_task(document_ids, run_id)
+
+    _update_fan_out_metrics(task_name, run_id, chunks_total=chunks)
+    return chunks
+
+
+def _update_fan_out_metrics(task_name, run_id, chunks_total=None, processed=0, succeeded=0, errors=()):
+    """
+    Bo'lak natijasini JobRun.metrics ga qo'shish (qator qulfi ostida, parallel
+    bo'laklar bir-birining hisobini yo'qotmaydi). Eski ishga tushirishdagi
+    kechikkan bo'laklar hisobga olinmaydi.
+    """
+    with transaction.atomic():
+        job = JobRun.objects.select_for_update().filter(task_name=task_name).first()
+        if job is None or job.metrics.get('run_id') != run_id:
+            return
+        metrics = job.metrics
+        if chunks_total is not None:
+            metrics['chunks_total'] = chunks_total
+        else:
+            metrics['chunks_done'] += 1
+            metrics['processed'] += processed
+            metrics['succeeded'] += succeeded
+            metrics['failed'] += len(errors)
+            metrics['errors'] = (metrics['errors'] + [
+                {'document_id': document_id, 'error': error[:200]} for document_id, error in errors
+            ])[-FAN_OUT_MAX_ERRORS:]
+
+        elapsed = (timezone.now() - datetime.fromisoformat(metrics['started_at'])).total_seconds()
+        metrics['elapsed_seconds'] = round(elapsed, 1)
+        metrics['per_minute'] = round(metrics['processed'] * 60 / elapsed, 1) if elapsed > 0 else None
+        job.save(update_fields=['metrics'])
+
+
 @shared_task
 def generate_qr_codes_batch():
     """
     Task to generate QR codes for approved documents that don't have them yet
-    This can be run as a one-time task or scheduled
+    Coordinator only: document ids are streamed and handed out in chunks to
+    generate_qr_codes_chunk, progress is collected in JobRun.metrics
     """
-    task_name = 'documents.tasks.generate_qr_codes_batch'
+    task_name = QR_BATCH_TASK
     started_at = time.monotonic()
     _mark_job_start(task_name)
 
     try:
-        from .qr_service import QRCodeService
-
         # Find approved documents without QR codes
         documents_without_qr = Hujjat.objects.filter(status='approved').filter(
             Q(qr_code_image__isnull=True) | Q(qr_code_image='')
         )
 
-        generated_count = 0
-
-        for document in documents_without_qr:
-            try:
-                QRCodeService.save_qr_image(document)
-                generated_count += 1
-            except Exception as e:
-                print(f"Failed to generate QR for document {document.id}: {str(e)}")
+        chunks = _fan_out(task_name, documents_without_qr, generate_qr_codes_chunk)
 
         _mark_job_success(task_name, started_at)
         return {
             'task': 'generate_qr_codes_batch',
             'timestamp': timezone.now().isoformat(),
-            'generated_count': generated_count,
+            'chunks': chunks,
         }
     except Exception as exc:
         _mark_job_failure(task_name, started_at, str(exc))
         raise
 
 
+@shared_task
+def generate_qr_codes_chunk(document_ids, run_id=None):
+    """
+    Task to generate QR codes for one chunk of generate_qr_codes_batch
+    """
+    from .qr_service import QRCodeService
+
+    succeeded = 0
+    errors = []
+    documents = Hujjat.objects.filter(pk__in=document_ids, status='approved').filter(
+        Q(qr_code_image__isnull=True) | Q(qr_code_image='')
+    )
+    for document in documents:
+        try:
+            QRCodeService.save_qr_image(document)
+            succeeded += 1
+        except Exception as e:
+            errors.append((document.pk, str(e)))
+
+    _update_fan_out_metrics(QR_BATCH_TASK, run_id, processed=len(document_ids), succeeded=succeeded, errors=errors)
+    return {
+        'task': 'generate_qr_codes_chunk',
+        'processed': len(document_ids),
+        'generated_count': succeeded,
+        'failed_count': len(errors),
+    }
+
+
+@shared_task
+def stamp_final_pdf(document_id):
+    """
+    Task to build the final (QR-stamped) PDF of one approved document
+    Enqueued after commit by QRCodeService.request_final_pdf
+    """
+    from .qr_service import QRCodeService
+
+    stamped = QRCodeService.stamp_final_pdf(document_id)
+    return {
+        'task': 'stamp_final_pdf',
+        'document_id': document_id,
+        'stamped': stamped,
+    }
+
+
 @shared_task
 def generate_final_pdfs_batch():
     """
-    Task to generate final PDFs with QR codes for approved documents
+    Task to stamp final PDFs that were never requested or failed
+    Run this task hourly via Celery Beat as a safety net for stamp_final_pdf
+    Coordinator only: chunks are stamped by stamp_final_pdfs_chunk
     """
-    task_name = 'documents.tasks.generate_final_pdfs_batch'
+    task_name = PDF_BATCH_TASK
     started_at = time.monotonic()
     _mark_job_start(task_name)
 
     try:
         from .qr_service import QRCodeService
 
-        # Find approved documents without final PDFs
-        documents_without_pdf = Hujjat.objects.filter(status='approved').filter(
-            Q(final_pdf__isnull=True) | Q(final_pdf='')
-        )
-
-        generated_count = 0
-        failed_count = 0
+        # Tasdiqlangan, lekin yakuniy PDF'i yo'q, navbatda qolib ketgan yoki xato bilan tugagan hujjatlar
+        documents = Hujjat.objects.filter(QRCodeService.restamp_filter(), status='approved')
 
-        for document in documents_without_pdf:
-            try:
-                QRCodeService.generate_final_pdf(document)
-                generated_count += 1
-            except Exception as e:
-                print(f"Failed to generate PDF for document {document.id}: {str(e)}")
-                failed_count += 1
+        chunks = _fan_out(task_name, documents, stamp_final_pdfs_chunk)
 
         _mark_job_success(task_name, started_at)
         return {
             'task': 'generate_final_pdfs_batch',
             'timestamp': timezone.now().isoformat(),
-            'generated_count': generated_count,
-            'failed_count': failed_count,
+            'chunks': chunks,
         }
     except Exception as exc:
         _mark_job_failure(task_name, started_at, str(exc))
         raise
 
 
+@shared_task
+def stamp_final_pdfs_chunk(document_ids, run_id=None):
+    """
+    Task to stamp final PDFs for one chunk of generate_final_pdfs_batch
+    """
+    from .qr_service import QRCodeService
+
+    # Ijarasi o'tgan processing'ni stamp_final_pdf o'zi qayta oladi
+    Hujjat.objects.filter(
+        QRCodeService.restamp_filter(), pk__in=document_ids, final_pdf_status__in=['none', 'failed']
+    ).update(final_pdf_status='pending', final_pdf_started_at=timezone.now())
+
+    succeeded = 0
+    errors = []
+    for document_id in document_ids:
+        try:
+            if QRCodeService.stamp_final_pdf(document_id):
+                succeeded += 1
+        except Exception as e:
+            errors.append((document_id, str(e)))
+
+    _update_fan_out_metrics(PDF_BATCH_TASK, run_id, processed=len(document_ids), succeeded=succeeded, errors=errors)
+    return {
+        'task': 'stamp_final_pdfs_chunk',
+        'processed': len(document_ids),
+        'generated_count': succeeded,
+        'failed_count': len(errors),
+    }
+
+
 @shared_task
 def cleanup_old_notifications(days=90):
     """
@@ -212,6 +455,84 @@ def cleanup_old_notifications(days=90):
         raise
 
 
+@shared_task
+def reconcile_notification_counters():
+    """
+    Task to recompute unread notification counters from the notifications table
+    Run this task daily via Celery Beat
+    """
+    task_name = 'documents.tasks.reconcile_notification_counters'
+    started_at = time.monotonic()
+    _mark_job_start(task_name)
+
+    try:
+        from .models import NotificationCounter
+
+        rows = NotificationCounter.reconcile()
+
+        _mark_job_success(task_name, started_at, metrics={'rows': rows})
+        return {
+            'task': 'reconcile_notification_counters',
+            'timestamp': timezone.now().isoformat(),
+            'rows': rows,
+        }
+    except Exception as exc:
+        _mark_job_failure(task_name, started_at, str(exc))
+        raise
+
+
+@shared_task
+def cleanup_upload_sessions():
+    """
+    Task to remove chunks of abandoned resumable uploads
+    Run this task daily via Celery Beat
+    """
+    task_name = 'documents.tasks.cleanup_upload_sessions'
+    started_at = time.monotonic()
+    _mark_job_start(task_name)
+
+    try:
+        from .uploads import ChunkedUploadService
+
+        result = ChunkedUploadService.cleanup_expired()
+
+        _mark_job_success(task_name, started_at, metrics=result)
+        return {
+            'task': 'cleanup_upload_sessions',
+            'timestamp': timezone.now().isoformat(),
+            **result,
+        }
+    except Exception as exc:
+        _mark_job_failure(task_name, started_at, str(exc))
+        raise
+
+
+@shared_task
+def collect_unreferenced_blobs():
+    """
+    Task to delete stored blobs no document references any more
+    Run this task daily via Celery Beat (without a broker BlobStore.schedule_gc runs it in-process)
+    """
+    task_name = 'documents.tasks.collect_unreferenced_blobs'
+    started_at = time.monotonic()
+    _mark_job_start(task_name)
+
+    try:
+        from .blobs import BlobStore
+
+        result = BlobStore.collect_garbage()
+
+        _mark_job_success(task_name, started_at, metrics=result)
+        return {
+            'task': 'collect_unreferenced_blobs',
+            'timestamp': timezone.now().isoformat(),
+            **result,
+        }
+    except Exception as exc:
+        _mark_job_failure(task_name, started_at, str(exc))
+        raise
+
+
 @shared_task
 def send_daily_summary_emails():
     """
@@ -223,30 +544,35 @@ def send_daily_summary_emails():
     _mark_job_start(task_name)
 
     try:
-        from django.core.mail import send_mail
+        from django.core.mail import EmailMessage
         from django.conf import settings
-        from .models import User
-
-        sent_count = 0
-
-        # Find users with pending approvals
-        users_with_pending = User.objects.filter(
-            approval_tasks__status='pending'
-        ).distinct()
-
-        for user in users_with_pending:
-            if not user.email_notifications:
-                continue
-
-            pending_count = ApprovalStep.objects.filter(
-                approver=user,
-                status='pending'
-            ).count()
+        from django.db.models import Count
+        from .mailer import BulkMailDispatcher
+
+        # Barcha foydalanuvchilar uchun kutilayotgan bosqichlar soni - bitta guruhlangan so'rov
+        rows = (
+            ApprovalStep.objects.filter(
+                status='pending',
+                approver__email_notifications=True,
+            )
+            .exclude(approver__email='')
+            .values(
+                'approver_id', 'approver__email', 'approver__username',
+                'approver__last_name', 'approver__first_name', 'approver__middle_name',
+            )
+            .annotate(pending_count=Count('id'))
+            .order_by()
+        )
 
-            if pending_count > 0:
-                subject = f"Daily Summary: {pending_count} document(s) pending your approval"
-                message = f"""
-Hello {user.get_full_name()},
+        messages = []
+        for row in rows:
+            # User.get_full_name() bilan bir xil: familiya ism sharif, bo'lmasa username
+            parts = [row['approver__last_name'], row['approver__first_name'], row['approver__middle_name']]
+            full_name = " ".join(part for part in parts if part).strip() or row['approver__username']
+            pending_count = row['pending_count']
+            subject = f"Daily Summary: {pending_count} document(s) pending your approval"
+            message = f"""
+Hello {full_name},
 
 You have {pending_count} document(s) waiting for your approval.
 
@@ -255,31 +581,62 @@ Please log in to the system to review and approve these documents:
 
 Best regards,
 Hujjat Workflow System
-                """.strip()
-
-                try:
-                    send_mail(
-                        subject=subject,
-                        message=message,
-                        from_email=settings.DEFAULT_FROM_EMAIL,
-                        recipient_list=[user.email],
-                        fail_silently=False,
-                    )
-                    sent_count += 1
-                except Exception as e:
-                    print(f"Failed to send email to {user.email}: {str(e)}")
-
-        _mark_job_success(task_name, started_at)
+            """.strip()
+            messages.append(EmailMessage(
+                subject=subject,
+                body=message,
+                from_email=settings.DEFAULT_FROM_EMAIL,
+                to=[row['approver__email']],
+            ))
+
+        render_seconds = time.monotonic() - started_at
+        dispatcher = BulkMailDispatcher()
+        sent_count = dispatcher.send(messages)
+
+        elapsed = time.monotonic() - started_at
+        metrics = {
+            **dispatcher.metrics,
+            'render_ms': int(render_seconds * 1000),
+            'emails_per_second': round(sent_count / elapsed, 2) if elapsed > 0 else None,
+        }
+        _mark_job_success(task_name, started_at, metrics)
         return {
             'task': 'send_daily_summary_emails',
             'timestamp': timezone.now().isoformat(),
             'sent_count': sent_count,
+            'failed_count': dispatcher.metrics['failed'],
         }
     except Exception as exc:
         _mark_job_failure(task_name, started_at, str(exc))
         raise
 
 
+@shared_task
+def drain_email_outbox():
+    """
+    Task to send queued emails from the EmailOutbox table
+    Enqueued after commit by EmailOutboxService and run every minute via Celery Beat
+    """
+    task_name = 'documents.tasks.drain_email_outbox'
+    started_at = time.monotonic()
+    _mark_job_start(task_name)
+
+    try:
+        from .mailer import EmailOutboxService
+
+        result = EmailOutboxService.drain()
+        _mark_job_success(task_name, started_at, result)
+    except Exception as exc:
+        _mark_job_failure(task_name, started_at, str(exc))
+        raise
+
+    return {
+        'task': 'drain_email_outbox',
+        'timestamp': timezone.now().isoformat(),
+        **result,
+    }
+
+
 # Celery Beat Schedule Configuration
 # Add this to your celery.py file:
 
@@ -1,3 +1,666 @@
-from django.test import TestCase
+import io
+import os
+import shutil
+import tempfile
+import time
+import zlib
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from PyPDF2 import PdfReader, PdfWriter
+from reportlab.pdfgen import canvas
+
+from .approvers import ApproverDirectory
+from .blobs import BlobStore
+from .deadlines import DeadlineScheduler
+from .models import (
+    ApprovalStep, DeadlineEvent, DocumentType, Hujjat, Role, SecurityPolicy, StoredBlob,
+    UploadSession, User,
+)
+from .pagination import KeysetPaginator, cached_count
+from .pdf_append import IncrementalPdfAppender, PdfAppendError
+from .qr_service import QRCodeService
+from .ratelimit import SecurityPolicySnapshot, TokenBucketLimiter
+from .services import ApprovalWorkflowService
+from .uploads import ChunkedUploadService
+from .verification import VerificationCodeAllocator
+
+
+# ==================== PDF YORDAMCHILARI ====================
+
+def single_page_pdf(text):
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer)
+    pdf.drawString(100, 700, text)
+    pdf.showPage()
+    pdf.save()
+    buffer.seek(0)
+    return buffer
+
+
+PAGE_RESOURCES = b"<< /Font << /F1 << /Type /Font /Subtype /Type1 /BaseFont /Helvetica >> >> >>"
+
+
+def content_stream(text):
+    content = b"BT /F1 24 Tf 72 700 Td (" + text + b") Tj ET"
+    return b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream"
+
+
+def classic_pdf(objects):
+    """Klassik xref jadvalli PDF: objects - {raqam: tana}, 1-obyekt katalog"""
+    output = io.BytesIO()
+    output.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = {}
+    for number in sorted(objects):
+        offsets[number] = output.tell()
+        output.write(b"%d 0 obj\n" % number + objects[number] + b"\nendobj\n")
+    xref_offset = output.tell()
+    size = max(objects) + 1
+    output.write(b"xref\n0 %d\n0000000000 65535 f \n" % size)
+    for number in range(1, size):
+        output.write(b"%010d 00000 n \n" % offsets[number])
+    output.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (size, xref_offset))
+    return output.getvalue()
+
+
+def xref_stream_pdf():
+    """Sahifa va sahifalar daraxti obyekt oqimida (ObjStm), xref esa oqim (/XRef)"""
+    output = io.BytesIO()
+    output.write(b"%PDF-1.5\n%\xe2\xe3\xcf\xd3\n")
+    offsets = {}
+
+    def write_object(number, body):
+        offsets[number] = output.tell()
+        output.write(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+
+    write_object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+    write_object(4, content_stream(b"Original"))
+    pages = b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>"
+    page = (b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R /Resources "
+            + PAGE_RESOURCES + b" >>")
+    header = b"2 0 3 %d " % (len(pages) + 1)
+    data = header + pages + b" " + page
+    write_object(5, b"<< /Type /ObjStm /N 2 /First %d /Length %d >>\nstream\n" % (len(header), len(data))
+                 + data + b"\nendstream")
+
+    xref_offset = output.tell()
+    rows = [
+        b"\x00" + (0).to_bytes(4, 'big') + (65535).to_bytes(2, 'big'),
+        b"\x01" + offsets[1].to_bytes(4, 'big') + b"\x00\x00",
+        b"\x02" + (5).to_bytes(4, 'big') + b"\x00\x00",
+        b"\x02" + (5).to_bytes(4, 'big') + b"\x00\x01",
+        b"\x01" + offsets[4].to_bytes(4, 'big') + b"\x00\x00",
+        b"\x01" + offsets[5].to_bytes(4, 'big') + b"\x00\x00",
+        b"\x01" + xref_offset.to_bytes(4, 'big') + b"\x00\x00",
+    ]
+    compressed = zlib.compress(b"".join(rows))
+    output.write(b"6 0 obj\n<< /Type /XRef /Size 7 /W [1 4 2] /Root 1 0 R /Filter /FlateDecode /Length %d >>\n"
+                 b"stream\n" % len(compressed) + compressed + b"\nendstream\nendobj\n")
+    output.write(b"startxref\n%d\n%%%%EOF\n" % xref_offset)
+    return output.getvalue()
+
+
+def page_texts(path):
+    reader = PdfReader(path, strict=True)
+    return [page.extract_text().strip() for page in reader.pages]
+
+
+# ==================== PDF APPEND ====================
+
+class IncrementalPdfAppenderTests(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def write_source(self, data):
+        with open(self.path('source.pdf'), 'wb') as source:
+            source.write(data)
+        return self.path('source.pdf')
+
+    def append(self, source_path, text, output_name):
+        output_path = self.path(output_name)
+        IncrementalPdfAppender.append_page(source_path, single_page_pdf(text), output_path)
+        return output_path
+
+    def assert_prefix(self, source_bytes, output_path):
+        """Asl baytlar o'zgarmagan - faqat oxiriga yozilgan"""
+        with open(output_path, 'rb') as output:
+            data = output.read()
+        self.assertEqual(data[:len(source_bytes)], source_bytes)
+        return data[len(source_bytes):]
+
+    def test_classic_xref_source(self):
+        source_bytes = single_page_pdf('Original').getvalue()
+        output_path = self.append(self.write_source(source_bytes), 'Stamp', 'out.pdf')
+
+        tail = self.assert_prefix(source_bytes, output_path)
+        self.assertIn(b"xref\n", tail)
+        self.assertEqual(page_texts(output_path), ['Original', 'Stamp'])
+
+    def test_xref_stream_source_with_object_stream(self):
+        source_bytes = xref_stream_pdf()
+        output_path = self.append(self.write_source(source_bytes), 'Stamp', 'out.pdf')
+
+        tail = self.assert_prefix(source_bytes, output_path)
+        # Yangi bo'lim ham xref oqimi bo'lishi kerak (aralash fayl emas)
+        self.assertIn(b"/Type /XRef", tail)
+        self.assertNotIn(b"\nxref\n", tail)
+        self.assertEqual(page_texts(output_path), ['Original', 'Stamp'])
+
+    def test_two_appends_in_a_row(self):
+        for label, source_bytes in (('classic', single_page_pdf('Original').getvalue()),
+                                    ('xref-stream', xref_stream_pdf())):
+            with self.subTest(label):
+                first = self.append(self.write_source(source_bytes), 'Stamp1', 'first.pdf')
+                with open(first, 'rb') as first_file:
+                    first_bytes = first_file.read()
+                second = self.append(first, 'Stamp2', 'second.pdf')
+
+                self.assert_prefix(first_bytes, second)
+                self.assertEqual(page_texts(second), ['Original', 'Stamp1', 'Stamp2'])
+
+    def test_indirect_kids_array(self):
+        source_bytes = classic_pdf({
+            1: b"<< /Type /Catalog /Pages 2 0 R >>",
+            2: b"<< /Type /Pages /Kids 5 0 R /Count 1 >>",
+            3: (b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R /Resources "
+                + PAGE_RESOURCES + b" >>"),
+            4: content_stream(b"Original"),
+            5: b"[3 0 R]",
+        })
+        output_path = self.append(self.write_source(source_bytes), 'Stamp', 'out.pdf')
+
+        tail = self.assert_prefix(source_bytes, output_path)
+        # Massiv obyektining yangi versiyasi yoziladi, /Kids bilvosita qoladi
+        self.assertIn(b"5 0 obj", tail)
+        reader = PdfReader(output_path, strict=True)
+        self.assertEqual(reader.trailer['/Root']['/Pages'].raw_get('/Kids').idnum, 5)
+        self.assertEqual(page_texts(output_path), ['Original', 'Stamp'])
+
+    def test_encrypted_source_is_refused(self):
+        writer = PdfWriter()
+        writer.append_pages_from_reader(PdfReader(single_page_pdf('Secret')))
+        writer.encrypt('', 'owner')
+        buffer = io.BytesIO()
+        writer.write(buffer)
+
+        with self.assertRaises(PdfAppendError):
+            self.append(self.write_source(buffer.getvalue()), 'Stamp', 'out.pdf')
+
+    def test_missing_startxref_is_refused(self):
+        with self.assertRaises(PdfAppendError):
+            self.append(self.write_source(b"%PDF-1.4\nnot a pdf"), 'Stamp', 'out.pdf')
+
+
+@override_settings(FINAL_PDF_INCREMENTAL=True)
+class FinalPdfFallbackTests(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        schedule_gc = mock.patch.object(BlobStore, 'schedule_gc')
+        schedule_gc.start()
+        self.addCleanup(schedule_gc.stop)
+
+    def test_encrypted_source_falls_back_to_full_rewrite(self):
+        writer = PdfWriter()
+        writer.append_pages_from_reader(PdfReader(single_page_pdf('Secret')))
+        writer.encrypt('', 'owner')
+        source_path = os.path.join(tempfile.mkdtemp(), 'encrypted.pdf')
+        self.addCleanup(shutil.rmtree, os.path.dirname(source_path))
+        with open(source_path, 'wb') as source:
+            writer.write(source)
+
+        with mock.patch.object(QRCodeService, '_create_verification_page',
+                               return_value=single_page_pdf('Stamp')):
+            blob = QRCodeService._stamp_to_blob(None, source_path, None)
+
+        path = BlobStore.storage().path(blob.name)
+        self.assertFalse(PdfReader(path, strict=True).is_encrypted)
+        self.assertEqual(page_texts(path), ['Secret', 'Stamp'])
+
+
+# ==================== VERIFICATION CODES ====================
+
+@override_settings(VERIFICATION_CODE_LENGTH=6, VERIFICATION_CODE_KEY='test-key')
+class VerificationCodeAllocatorTests(SimpleTestCase):
+
+    @override_settings(VERIFICATION_CODE_LENGTH=2)
+    def test_encode_is_a_bijection(self):
+        domain = 36 ** 2
+        codes = {VerificationCodeAllocator.encode(value) for value in range(domain)}
+
+        self.assertEqual(len(codes), domain)
+        self.assertTrue(all(len(code) == 3 for code in codes))
+        self.assertTrue(all(VerificationCodeAllocator.check_char(code[:-1]) == code[-1] for code in codes))
+
+    def test_allocated_codes_are_plausible(self):
+        for value in (0, 1, 36 ** 6 - 1):
+            code = VerificationCodeAllocator.encode(value)
+            self.assertEqual(len(code), 7)
+            self.assertTrue(VerificationCodeAllocator.is_plausible(code))
+
+    def test_encode_outside_domain_raises(self):
+        with self.assertRaises(ValueError):
+            VerificationCodeAllocator.encode(36 ** 6)
+        with self.assertRaises(ValueError):
+            VerificationCodeAllocator.encode(-1)
+
+    def test_permutation_depends_on_key(self):
+        first = [VerificationCodeAllocator.encode(value) for value in range(20)]
+        with override_settings(VERIFICATION_CODE_KEY='other-key'):
+            second = [VerificationCodeAllocator.encode(value) for value in range(20)]
+
+        self.assertNotEqual(first, second)
+
+    def test_check_char_rejects_single_character_typos(self):
+        alphabet = VerificationCodeAllocator.ALPHABET
+        for value in (0, 1, 123456):
+            code = VerificationCodeAllocator.encode(value)
+            for position in range(len(code)):
+                for char in alphabet:
+                    if char == code[position]:
+                        continue
+                    typo = code[:position] + char + code[position + 1:]
+                    self.assertFalse(VerificationCodeAllocator.is_plausible(typo), typo)
+
+    def test_normalize_and_legacy_codes(self):
+        self.assertEqual(VerificationCodeAllocator.normalize(' ab-c 12 '), 'ABC12')
+        self.assertEqual(VerificationCodeAllocator.normalize(None), '')
+        self.assertTrue(VerificationCodeAllocator.is_plausible('AB12'))
+        self.assertFalse(VerificationCodeAllocator.is_plausible('AB1'))
+        self.assertFalse(VerificationCodeAllocator.is_plausible('ab12'))
+        self.assertFalse(VerificationCodeAllocator.is_plausible(''))
+
+    @override_settings(DEBUG=False, VERIFICATION_CODE_KEY='')
+    def test_key_required_without_debug(self):
+        with self.assertRaises(ImproperlyConfigured):
+            VerificationCodeAllocator.encode(1)
+
+
+# ==================== WORKFLOW TEST MA'LUMOTLARI ====================
+
+# Test runner DEBUG=False bilan ishlaydi: Hujjat.save() kod ajratishi uchun kalit kerak
+verification_key = override_settings(VERIFICATION_CODE_KEY='test-key')
+
+
+class WorkflowFixtureMixin:
+
+    def make_workflow(self, approval_workflow=('director', 'academic_office')):
+        self.role = Role.objects.create(role_type='director', name='Dir', code='D1')
+        self.director = User.objects.create(username='dir', email='d@x.uz', active_role=self.role)
+        ApproverDirectory.flush()
+        self.addCleanup(ApproverDirectory.flush)
+        self.document_type = DocumentType.objects.create(
+            name='Hisobot', approval_workflow=list(approval_workflow), deadline_hours=72, allowed_roles=[],
+        )
+        self.uploader = User.objects.create(username='up', email='u@x.uz')
+
+    def make_document(self, name='f.pdf'):
+        return Hujjat.objects.create(
+            uploaded_by=self.uploader, document_type=self.document_type, file_name=name, file_size=1,
+        )
+
+
+# ==================== KEYSET PAGINATION ====================
+
+@verification_key
+class KeysetPaginatorTests(WorkflowFixtureMixin, TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.make_workflow()
+        for index in range(7):
+            self.make_document(f'{index}.pdf')
+        # Bir xil vaqt: tartib faqat pk bo'yicha ajraladi
+        same_time = timezone.now()
+        Hujjat.objects.filter(pk__in=Hujjat.objects.order_by('pk').values('pk')[:4]).update(uploaded_at=same_time)
+        self.expected = list(Hujjat.objects.order_by('-uploaded_at', '-pk').values_list('pk', flat=True))
+
+    def test_walks_forward_and_back_without_gaps(self):
+        paginator = KeysetPaginator(Hujjat.objects.all(), per_page=3)
+        pages = [paginator.page()]
+        while pages[-1].has_next:
+            pages.append(paginator.page(after=pages[-1].next_cursor))
+
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual([document.pk for page in pages for document in page], self.expected)
+        self.assertFalse(pages[0].has_previous)
+
+        back = paginator.page(before=pages[-1].previous_cursor)
+        self.assertEqual([document.pk for document in back], self.expected[3:6])
+        first = paginator.page(before=back.previous_cursor)
+        self.assertEqual([document.pk for document in first], self.expected[:3])
+        self.assertFalse(first.has_previous)
+
+    def test_invalid_cursor_returns_first_page(self):
+        paginator = KeysetPaginator(Hujjat.objects.all(), per_page=3)
+
+        page = paginator.page(after='not-a-cursor')
+
+        self.assertEqual([document.pk for document in page], self.expected[:3])
+
+    def test_cached_count_is_keyed_by_query(self):
+        self.assertEqual(cached_count(Hujjat.objects.all()), 7)
+        self.make_document('late.pdf')
+
+        self.assertEqual(cached_count(Hujjat.objects.all()), 7)
+        self.assertEqual(cached_count(Hujjat.objects.filter(file_name='late.pdf')), 1)
+        self.assertEqual(cached_count(Hujjat.objects.none()), 0)
+
+
+# ==================== DEADLINE SCHEDULER ====================
+
+@verification_key
+class DeadlineSchedulerTests(WorkflowFixtureMixin, TestCase):
+
+    def setUp(self):
+        self.make_workflow()
+        self.document = self.make_document()
+        self.step = self.document.approval_steps.get(is_current=True)
+
+    def make_due(self):
+        past = timezone.now() - timedelta(seconds=1)
+        DeadlineEvent.objects.filter(step=self.step).update(due_at=past)
+        ApprovalStep.objects.filter(pk=self.step.pk).update(deadline=past)
+
+    def test_current_step_gets_events(self):
+        kinds = set(DeadlineEvent.objects.filter(step=self.step).values_list('kind', flat=True))
+
+        self.assertEqual(kinds, {'overdue', 'reminder_24h', 'reminder_2h'})
+
+    def test_nothing_due_is_a_noop(self):
+        count = DeadlineEvent.objects.count()
+
+        result = DeadlineScheduler.process_due()
+
+        self.assertEqual(result['events'], 0)
+        self.assertEqual(DeadlineEvent.objects.count(), count)
+
+    def test_overdue_event_auto_approves_and_is_deleted(self):
+        self.make_due()
+
+        result = DeadlineScheduler.process_due()
+
+        self.assertEqual(result['approved_steps'], 1)
+        self.step.refresh_from_db()
+        self.assertNotEqual(self.step.status, 'pending')
+        self.assertFalse(DeadlineEvent.objects.filter(step=self.step).exists())
+
+    def test_failed_handling_keeps_events(self):
+        self.make_due()
+        count = DeadlineEvent.objects.count()
+
+        with mock.patch.object(DeadlineScheduler, '_handle', side_effect=RuntimeError('boom')):
+            with self.assertRaises(RuntimeError):
+                DeadlineScheduler.process_due()
+
+        self.assertEqual(DeadlineEvent.objects.count(), count)
+
+    def test_locked_document_defers_overdue_event(self):
+        self.make_due()
+        skipped = {'approved_steps': 0, 'skipped_steps': 0}
+
+        # SKIP LOCKED o'tkazib yuborgan hujjat: bosqich hamon joriy va kutilmoqda
+        with mock.patch.object(ApprovalWorkflowService, 'auto_approve_overdue_documents', return_value=skipped):
+            result = DeadlineScheduler.process_due()
+
+        self.assertEqual(result['deferred_events'], 1)
+        overdue = DeadlineEvent.objects.get(step=self.step, kind='overdue')
+        self.assertGreater(overdue.due_at, timezone.now())
+
+    def test_stale_events_are_dropped(self):
+        self.make_due()
+        ApprovalStep.objects.filter(pk=self.step.pk).update(is_current=False)
+
+        result = DeadlineScheduler.process_due()
+
+        self.assertEqual(result['approved_steps'], 0)
+        self.assertFalse(DeadlineEvent.objects.filter(step=self.step).exists())
+
+
+# ==================== CHUNKED UPLOADS ====================
+
+@override_settings(UPLOAD_CHUNK_SIZE=8)
+class ChunkedUploadServiceTests(TestCase):
+    CONTENT = b"%PDF-1.4\n0123456789\n"
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.user = User.objects.create(username='chunk_uploader')
+        self.document_type = DocumentType.objects.create(
+            name='Sillabus', approval_workflow=[], allowed_roles=[],
+            allowed_extensions=['pdf'], max_file_size_mb=1,
+        )
+
+    def start(self, file_name='doc.pdf', total_size=None):
+        total_size = len(self.CONTENT) if total_size is None else total_size
+        return ChunkedUploadService.start(self.user, self.document_type, file_name, total_size)
+
+    def send(self, session, index, data=None):
+        if data is None:
+            start = index * session.chunk_size
+            data = self.CONTENT[start:start + session.chunk_size]
+        return ChunkedUploadService.store_chunk(session, index, io.BytesIO(data))
+
+    def test_start_validates_extension_size_and_role(self):
+        with self.assertRaises(ValidationError):
+            self.start('doc.exe')
+        with self.assertRaises(ValidationError):
+            self.start(total_size=0)
+        with self.assertRaises(ValidationError):
+            self.start(total_size=2 * 1024 * 1024)
+
+        self.document_type.allowed_roles = ['director']
+        with self.assertRaises(ValidationError):
+            self.start()
+
+    def test_chunk_size_index_and_magic_are_checked(self):
+        session = self.start()
+        self.assertEqual(session.chunk_count, 3)
+
+        with self.assertRaises(ValidationError):
+            self.send(session, 1, b"short")
+        with self.assertRaises(ValidationError):
+            self.send(session, 1, self.CONTENT[8:16] + b"x")
+        with self.assertRaises(ValidationError):
+            self.send(session, 3, b"1234")
+        with self.assertRaises(ValidationError):
+            self.send(session, 0, b"NOTAPDF!")
+        self.assertEqual(UploadSession.objects.get(pk=session.pk).received_bytes, 0)
+
+    def test_out_of_order_and_resent_chunks_assemble(self):
+        session = self.start()
+        for index in (2, 0, 0, 1):
+            session = self.send(session, index)
+
+        self.assertEqual(session.received_bytes, len(self.CONTENT))
+        self.assertEqual(session.missing_chunks, [])
+        assembled = ChunkedUploadService.assembled_file(session)
+        self.assertEqual(assembled.read(), self.CONTENT)
+
+    def test_complete_deletes_chunks_after_commit(self):
+        session = self.start()
+        for index in range(3):
+            session = self.send(session, index)
+        storage = ChunkedUploadService.storage()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ChunkedUploadService.complete(session, None)
+
+        self.assertEqual(UploadSession.objects.get(pk=session.pk).status, 'completed')
+        self.assertFalse(any(storage.exists(session.chunk_name(index)) for index in range(3)))
+        with self.assertRaises(ValidationError):
+            self.send(session, 0)
+
+
+# ==================== BLOB STORE ====================
+
+@verification_key
+class BlobStoreTests(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        schedule_gc = mock.patch.object(BlobStore, 'schedule_gc')
+        self.schedule_gc = schedule_gc.start()
+        self.addCleanup(schedule_gc.stop)
+        self.storage = BlobStore.storage()
+
+    def put(self, data):
+        return BlobStore.put(ContentFile(data, name='x.pdf'), '.pdf')
+
+    def backdate(self, name, hours=2):
+        past = time.time() - hours * 3600
+        os.utime(self.storage.path(name), (past, past))
+
+    def test_same_content_is_stored_once(self):
+        first = self.put(b"same bytes")
+        second = self.put(b"same bytes")
+
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(StoredBlob.objects.get(pk=first.pk).ref_count, 2)
+        _, files = self.storage.listdir(os.path.dirname(first.name))
+        self.assertEqual(files, [os.path.basename(first.name)])
+
+    def test_last_release_makes_blob_collectable(self):
+        blob = self.put(b"short lived")
+        self.put(b"short lived")
+
+        BlobStore.release(blob.name)
+        self.assertEqual(BlobStore.collect_garbage(grace_hours=0)['deleted'], 0)
+        BlobStore.release(blob.name)
+        BlobStore.release(blob.name)
+
+        self.assertEqual(StoredBlob.objects.get(pk=blob.pk).ref_count, 0)
+        result = BlobStore.collect_garbage(grace_hours=0)
+        self.assertEqual(result['deleted'], 1)
+        self.assertEqual(result['freed_bytes'], len(b"short lived"))
+        self.assertFalse(StoredBlob.objects.filter(pk=blob.pk).exists())
+        self.assertFalse(self.storage.exists(blob.name))
+
+    def test_grace_period_and_reference_recheck(self):
+        blob = self.put(b"still referenced")
+        BlobStore.release(blob.name)
+        self.assertEqual(BlobStore.collect_garbage()['deleted'], 0)
+
+        document = Hujjat.objects.create(
+            uploaded_by=User.objects.create(username='up'),
+            document_type=DocumentType.objects.create(name='x', approval_workflow=[], allowed_roles=[]),
+            file_name='f.pdf', file_size=1,
+        )
+        Hujjat.objects.filter(pk=document.pk).update(file=blob.name)
+
+        result = BlobStore.collect_garbage(grace_hours=0)
+
+        self.assertEqual(result['repaired'], 1)
+        self.assertEqual(StoredBlob.objects.get(pk=blob.pk).ref_count, 1)
+        self.assertTrue(self.storage.exists(blob.name))
+
+    def test_files_from_rolled_back_transactions_are_swept(self):
+        kept = self.put(b"committed")
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                leaked = self.put(b"rolled back")
+                raise RuntimeError('outer failure')
+
+        self.assertFalse(StoredBlob.objects.filter(name=leaked.name).exists())
+        self.assertTrue(self.storage.exists(leaked.name))
+        self.assertEqual(BlobStore.collect_garbage(grace_hours=1)['orphans'], 0)
+
+        self.backdate(leaked.name)
+        self.backdate(kept.name)
+        self.assertEqual(BlobStore.collect_garbage(grace_hours=1)['orphans'], 1)
+        self.assertFalse(self.storage.exists(leaked.name))
+        self.assertTrue(self.storage.exists(kept.name))
+
+    def test_new_blobs_and_releases_schedule_gc(self):
+        blob = self.put(b"scheduled")
+        self.assertEqual(self.schedule_gc.call_count, 1)
+
+        BlobStore.release(blob.name)
+        BlobStore.release(blob.name)
+
+        self.assertEqual(self.schedule_gc.call_count, 2)
+
+
+# ==================== RATE LIMITING ====================
+
+class TokenBucketLimiterTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        TokenBucketLimiter._buckets.clear()
+        self.policy = SecurityPolicy.objects.create(
+            rate_limit_per_minute=60, burst=2, findtime_seconds=60, maxretry=2,
+            bantime_seconds=300, whitelist='10.0.0.0/8',
+        )
+        self.reload_policy()
+
+    def reload_policy(self):
+        SecurityPolicySnapshot.invalidate()
+        SecurityPolicySnapshot.sync()
+
+    def test_ip_bucket_limits_and_refills(self):
+        self.assertEqual(TokenBucketLimiter.check('1.1.1.1'), (True, 0))
+        self.assertEqual(TokenBucketLimiter.check('1.1.1.1'), (True, 0))
+        allowed, retry_after = TokenBucketLimiter.check('1.1.1.1')
+        self.assertFalse(allowed)
+        self.assertGreaterEqual(retry_after, 1)
+        self.assertTrue(TokenBucketLimiter.check('2.2.2.2')[0])
+
+        # Bir soniyada bitta token (60/daqiqa)
+        TokenBucketLimiter._buckets['ip:1.1.1.1'][1] -= 1.5
+        self.assertTrue(TokenBucketLimiter.check('1.1.1.1')[0])
+        self.assertFalse(TokenBucketLimiter.check('1.1.1.1')[0])
+
+    def test_code_prefix_bucket_is_shared_across_ips(self):
+        self.assertTrue(TokenBucketLimiter.check('1.1.1.1', code='AB1234')[0])
+        self.assertTrue(TokenBucketLimiter.check('2.2.2.2', code='AB9999')[0])
+
+        self.assertFalse(TokenBucketLimiter.check('3.3.3.3', code='ABZZZZ')[0])
+        self.assertTrue(TokenBucketLimiter.check('3.3.3.3', code='CD0000')[0])
+
+    def test_misses_ban_the_ip(self):
+        TokenBucketLimiter.record_miss('1.1.1.1')
+        self.assertTrue(TokenBucketLimiter.check('1.1.1.1')[0])
+        TokenBucketLimiter.record_miss('1.1.1.1')
+
+        allowed, retry_after = TokenBucketLimiter.check('1.1.1.1')
+        self.assertFalse(allowed)
+        self.assertGreater(retry_after, 200)
+        self.assertTrue(TokenBucketLimiter.check('2.2.2.2')[0])
+
+    def test_whitelist_bypasses_buckets_and_bans(self):
+        for _ in range(3):
+            TokenBucketLimiter.record_miss('10.1.2.3')
+        for _ in range(5):
+            self.assertEqual(TokenBucketLimiter.check('10.1.2.3', code='AB1234'), (True, 0))
+
+    def test_zero_rate_disables_buckets(self):
+        self.policy.rate_limit_per_minute = 0
+        self.policy.save()
+        self.reload_policy()
+
+        for _ in range(5):
+            self.assertTrue(TokenBucketLimiter.check('1.1.1.1')[0])
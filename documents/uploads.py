@@ -0,0 +1,239 @@
+"""
+Chunked, resumable uploads.
+
+A client opens an UploadSession (file name, size and document type are
+validated up front), then sends the file in fixed-size chunks in any order.
+Each chunk is streamed from the request into its own object in the
+document storage backend, so nothing larger than one chunk is held in
+memory and a dropped connection only costs the chunk in flight.  Finalize
+runs the ordinary DocumentUploadForm with a reader that concatenates the
+chunk objects, so the Hujjat row, its workflow and all validation are the
+same as for a regular upload.
+"""
+
+import io
+from datetime import timedelta
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.core.files.uploadedfile import UploadedFile
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Hujjat, UploadSession
+
+
+class ChunkedUploadReader(io.RawIOBase):
+    """Storage'dagi bo'laklarni bitta ketma-ket fayl sifatida o'qish (xotiraga yig'ilmaydi)"""
+
+    def __init__(self, storage, names, size):
+        super().__init__()
+        self.storage = storage
+        self.names = names
+        self.size = size
+        self._current = None
+        self.seek(0)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        # Faqat boshiga qaytish mumkin - S3 yuklovchisi oqim sifatida o'qiydi
+        return False
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if offset != 0 or whence != io.SEEK_SET:
+            raise io.UnsupportedOperation("Faqat fayl boshiga qaytish mumkin")
+        self._close_current()
+        self._index = 0
+        self._position = 0
+        return 0
+
+    def tell(self):
+        return self._position
+
+    def read(self, size=-1):
+        parts = []
+        remaining = size
+        while size < 0 or remaining > 0:
+            if self._current is None:
+                if self._index >= len(self.names):
+                    break
+                self._current = self.storage.open(self.names[self._index], 'rb')
+                self._index += 1
+            data = self._current.read(remaining if size >= 0 else -1)
+            if not data:
+                self._close_current()
+                continue
+            parts.append(data)
+            if size >= 0:
+                remaining -= len(data)
+        data = b"".join(parts)
+        self._position += len(data)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self._close_current()
+        super().close()
+
+    def _close_current(self):
+        if self._current is not None:
+            self._current.close()
+            self._current = None
+
+
+class ChunkedUploadService:
+    READ_BLOCK_SIZE = 64 * 1024
+    # Kengaytma bo'yicha fayl boshidagi imzo: birinchi bo'lakdayoq tekshiriladi
+    MAGIC_BYTES = {
+        'pdf': b"%PDF-",
+    }
+
+    @staticmethod
+    def storage():
+        return Hujjat._meta.get_field('file').storage
+
+    # ==================== START ====================
+
+    @staticmethod
+    def start(user, document_type, file_name, total_size):
+        """Seans ochish. Kengaytma va hajm shu yerda tekshiriladi (ValidationError)"""
+        if not document_type.can_user_upload(user):
+            raise ValidationError(f"'{document_type.name}' turida hujjat yuklashga ruxsatingiz yo'q.")
+
+        file_extension = file_name.rsplit('.', 1)[-1].lower() if '.' in file_name else ''
+        allowed_extensions = document_type.allowed_extensions
+        if allowed_extensions and file_extension not in allowed_extensions:
+            raise ValidationError(
+                f"'.{file_extension}' fayl kengaytmasiga ruxsat yo'q. "
+                f"Ruxsat etilgan kengaytmalar: {', '.join(allowed_extensions)}"
+            )
+
+        max_size_bytes = float(document_type.max_file_size_mb) * 1024 * 1024
+        if total_size <= 0:
+            raise ValidationError("Fayl bo'sh")
+        if total_size > max_size_bytes:
+            raise ValidationError(
+                f"Faylingiz hajmi ({total_size / 1024 / 1024:.2f}MB) "
+                f"maksimal ruxsat etilgan hajmdan ({document_type.max_file_size_mb}MB) oshdi."
+            )
+
+        return UploadSession.objects.create(
+            user=user,
+            document_type=document_type,
+            file_name=file_name[:255],
+            total_size=total_size,
+            chunk_size=getattr(settings, 'UPLOAD_CHUNK_SIZE', 5 * 1024 * 1024),
+        )
+
+    # ==================== CHUNKS ====================
+
+    @classmethod
+    def store_chunk(cls, session, index, stream):
+        """
+        Bo'lakni so'rov oqimidan storage'ga yozish. Bo'lak hajmi aniq bo'lishi
+        kerak, shuning uchun e'lon qilinganidan ortiq bayt hech qachon saqlanmaydi.
+        """
+        if session.status != 'active':
+            raise ValidationError("Yuklash seansi yakunlangan")
+        if not 0 <= index < session.chunk_count:
+            raise ValidationError("Noto'g'ri bo'lak raqami")
+
+        expected = session.chunk_length(index)
+        buffer = SpooledTemporaryFile(max_size=1024 * 1024)
+        received = 0
+        while received <= expected:
+            data = stream.read(min(cls.READ_BLOCK_SIZE, expected + 1 - received))
+            if not data:
+                break
+            buffer.write(data)
+            received += len(data)
+        if received != expected:
+            buffer.close()
+            raise ValidationError(f"Bo'lak hajmi {expected} bayt bo'lishi kerak, {received} keldi")
+        if index == 0:
+            cls._check_magic(session, buffer)
+
+        storage = cls.storage()
+        name = session.chunk_name(index)
+        # Qayta yuborilgan bo'lak eskisini almashtiradi (storage nomga qo'shimcha qo'shmasin)
+        if storage.exists(name):
+            storage.delete(name)
+        buffer.seek(0)
+        storage.save(name, File(buffer, name=name))
+        buffer.close()
+
+        with transaction.atomic():
+            locked = UploadSession.objects.select_for_update().get(pk=session.pk)
+            if index not in locked.received_chunks:
+                locked.received_chunks.append(index)
+                locked.received_bytes += expected
+            locked.save(update_fields=['received_chunks', 'received_bytes', 'updated_at'])
+        return locked
+
+    @classmethod
+    def _check_magic(cls, session, buffer):
+        extension = session.file_name.rsplit('.', 1)[-1].lower()
+        magic = cls.MAGIC_BYTES.get(extension)
+        if magic is None:
+            return
+        position = buffer.tell()
+        buffer.seek(0)
+        head = buffer.read(len(magic))
+        buffer.seek(position)
+        if len(head) == len(magic) and head != magic:
+            raise ValidationError(f"Fayl mazmuni .{extension} formatiga mos emas")
+
+    # ==================== FINALIZE ====================
+
+    @classmethod
+    def assembled_file(cls, session):
+        """Barcha bo'laklarni bitta UploadedFile sifatida (forma va storage uchun)"""
+        names = [session.chunk_name(index) for index in range(session.chunk_count)]
+        reader = ChunkedUploadReader(cls.storage(), names, session.total_size)
+        return UploadedFile(file=reader, name=session.file_name, size=session.total_size)
+
+    @classmethod
+    def complete(cls, session, document):
+        session.status = 'completed'
+        session.document = document
+        session.save(update_fields=['status', 'document', 'updated_at'])
+        transaction.on_commit(lambda: cls.delete_chunks(session))
+
+    @classmethod
+    def abort(cls, session):
+        session.status = 'aborted'
+        session.save(update_fields=['status', 'updated_at'])
+        transaction.on_commit(lambda: cls.delete_chunks(session))
+
+    @classmethod
+    def delete_chunks(cls, session):
+        storage = cls.storage()
+        for index in session.received_chunks:
+            try:
+                storage.delete(session.chunk_name(index))
+            except Exception as e:
+                print(f"Upload chunk cleanup failed: {str(e)}")
+
+    # ==================== CLEANUP ====================
+
+    @classmethod
+    def cleanup_expired(cls):
+        """Uzoq vaqt davom ettirilmagan seanslarning bo'laklarini o'chirish"""
+        ttl = timedelta(hours=getattr(settings, 'UPLOAD_SESSION_TTL_HOURS', 24))
+        cutoff = timezone.now() - ttl
+        expired = list(UploadSession.objects.filter(status='active', updated_at__lt=cutoff))
+        for session in expired:
+            cls.delete_chunks(session)
+        UploadSession.objects.filter(pk__in=[session.pk for session in expired]).delete()
+        finished, _ = UploadSession.objects.filter(
+            status__in=['completed', 'aborted'], updated_at__lt=cutoff
+        ).delete()
+        return {'expired': len(expired), 'deleted': finished}
@@ -19,6 +19,7 @@ urlpatterns = [
     path('documents/upload/', views.upload_document, name='upload_document'),
     path('documents/<int:document_id>/download/', views.download_document, name='download_document'),
     path('documents/<int:document_id>/qr/', views.download_qr_code, name='download_qr_code'),
+    path('documents/<int:document_id>/qr.svg', views.qr_code_svg, name='qr_code_svg'),
     path('subject-distribution/', views.subject_distribution, name='subject_distribution'),
     path('api/document-type/<int:doc_type_id>/', views.get_document_type_info, name='get_document_type_info'),
     
@@ -37,6 +38,10 @@ urlpatterns = [
     path('notifications/read-all/', views.mark_all_notifications_read, name='mark_all_notifications_read'),
     
     # API endpoints
+    path('api/uploads/', views.api_upload_start, name='api_upload_start'),
+    path('api/uploads/<uuid:upload_id>/', views.api_upload_session, name='api_upload_session'),
+    path('api/uploads/<uuid:upload_id>/chunks/<int:index>/', views.api_upload_chunk, name='api_upload_chunk'),
+    path('api/uploads/<uuid:upload_id>/complete/', views.api_upload_complete, name='api_upload_complete'),
     path('api/documents/<int:document_id>/status/', views.api_document_status, name='api_document_status'),
     path('api/notifications/count/', views.api_notification_count, name='api_notification_count'),
     path('api/notifications/stream/', views.api_notification_stream, name='api_notification_stream'),
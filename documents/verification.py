@@ -0,0 +1,145 @@
+"""
+Verification code allocator for Hujjat.
+
+Codes are produced from a database sequence instead of random retries:
+
+    n (sequence) -> keyed Feistel permutation over [0, 36**L) -> base36 -> + check char
+
+The permutation is a bijection, so distinct sequence values never collide and
+allocation costs one nextval() no matter how many documents exist.  The check
+character (Luhn mod 36) lets views reject mistyped codes without a query.
+Legacy 4-character random codes stay valid: they have a different length, so
+they can never clash with allocated codes.
+"""
+
+import hashlib
+import hmac
+import random
+import string
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+
+
+class VerificationCodeAllocator:
+    ALPHABET = string.digits + string.ascii_uppercase
+    LEGACY_LENGTH = 4
+    SEQUENCE_NAME = "documents_verification_code_seq"
+    ROUNDS = 4
+
+    # ==================== ALLOCATION ====================
+
+    @classmethod
+    def allocate(cls):
+        """Yangi tasdiqlash kodini ajratish"""
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT nextval(%s)", [cls.SEQUENCE_NAME])
+                value = cursor.fetchone()[0]
+            return cls.encode(value)
+        return cls._allocate_random()
+
+    @classmethod
+    def encode(cls, value):
+        """Sequence qiymatini kodga aylantirish"""
+        length = cls.code_length()
+        domain = len(cls.ALPHABET) ** length
+        if value < 0 or value >= domain:
+            raise ValueError(
+                f"Tasdiqlash kodlari tugadi: VERIFICATION_CODE_LENGTH={length} yetarli emas"
+            )
+        body = cls._to_base36(cls._permute(value, domain), length)
+        return body + cls.check_char(body)
+
+    @classmethod
+    def _allocate_random(cls):
+        # Sequence bo'lmagan bazalar (SQLite - lokal ishlab chiqish) uchun
+        from .models import Hujjat
+
+        domain = len(cls.ALPHABET) ** cls.code_length()
+        while True:
+            code = cls.encode(random.randrange(domain))
+            if not Hujjat.objects.filter(verification_code=code).exists():
+                return code
+
+    # ==================== VALIDATION ====================
+
+    @classmethod
+    def normalize(cls, code):
+        """Foydalanuvchi kiritgan kodni tozalash"""
+        return (code or "").strip().upper().replace("-", "").replace(" ", "")
+
+    @classmethod
+    def is_plausible(cls, code):
+        """
+        Kod bazada bo'lishi mumkinligini so'rovsiz tekshirish:
+        eski 4 belgili kodlar yoki nazorat belgisi to'g'ri bo'lgan yangi kodlar.
+        """
+        if not code or any(char not in cls.ALPHABET for char in code):
+            return False
+        if len(code) == cls.LEGACY_LENGTH:
+            return True
+        if len(code) <= cls.LEGACY_LENGTH:
+            return False
+        return cls.check_char(code[:-1]) == code[-1]
+
+    @classmethod
+    def check_char(cls, body):
+        """Luhn mod 36 nazorat belgisi"""
+        base = len(cls.ALPHABET)
+        factor = 2
+        total = 0
+        for char in reversed(body):
+            addend = factor * cls.ALPHABET.index(char)
+            factor = 1 if factor == 2 else 2
+            total += addend // base + addend % base
+        return cls.ALPHABET[(base - total % base) % base]
+
+    # ==================== PERMUTATION ====================
+
+    @staticmethod
+    def code_length():
+        return getattr(settings, "VERIFICATION_CODE_LENGTH", 6)
+
+    @classmethod
+    def _permute(cls, value, domain):
+        # Feistel tarmog'i 2**(2*half) oralig'ida; natija domain'dan tashqariga
+        # chiqsa qayta shifrlanadi (cycle walking), shuning uchun bijeksiya saqlanadi
+        half_bits = ((domain - 1).bit_length() + 1) // 2
+        while True:
+            value = cls._feistel(value, half_bits)
+            if value < domain:
+                return value
+
+    @classmethod
+    def _feistel(cls, value, half_bits):
+        mask = (1 << half_bits) - 1
+        left, right = value >> half_bits, value & mask
+        key = cls._key()
+        for round_no in range(cls.ROUNDS):
+            digest = hmac.new(
+                key,
+                f"{round_no}:{right}".encode(),
+                hashlib.sha256,
+            ).digest()
+            left, right = right, left ^ (int.from_bytes(digest[:8], "big") & mask)
+        return (left << half_bits) | right
+
+    @staticmethod
+    def _key():
+        key = getattr(settings, "VERIFICATION_CODE_KEY", None)
+        if not key:
+            if not settings.DEBUG:
+                raise ImproperlyConfigured("VERIFICATION_CODE_KEY sozlanmagan")
+            # Faqat lokal ishlab chiqish uchun: SECRET_KEY almashsa kodlar to'qnashishi mumkin
+            key = settings.SECRET_KEY
+        return key.encode()
+
+    @classmethod
+    def _to_base36(cls, value, length):
+        chars = []
+        for _ in range(length):
+            value, remainder = divmod(value, len(cls.ALPHABET))
+            chars.append(cls.ALPHABET[remainder])
+        return "".join(reversed(chars))
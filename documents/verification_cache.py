@@ -0,0 +1,110 @@
+"""
+Read-through cache for public document verification.
+
+QR codes are scanned at admissions desks in bursts, and every scan used to
+query the documents table.  Approved documents are now looked up in the
+cache by verification code or UUID; the record holds only what the public
+pages need (title, file names), and file URLs are built from it at read
+time, so signed URLs never go stale in the cache.
+
+Unknown codes and UUIDs are cached as misses for a short time, so repeated
+scans of a bad or not-yet-approved code do not reach the database either.
+Hujjat saves and deletes drop both keys of the document after commit, and
+a stamped final PDF re-populates them, so approval, rejection and file
+changes are visible immediately; the TTLs only bound staleness for changes
+that bypass the model (raw SQL, bulk updates outside the workflow).
+Read-through fills use cache.add, so a lookup that read the row just before
+a final PDF was stamped cannot overwrite the record populate() wrote.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+
+class VerificationLookupCache:
+    CODE_KEY = "verify:code:{code}"
+    UUID_KEY = "verify:uuid:{uuid}"
+    # Topilmagan kod/UUID belgisi (None'dan farqli - None "keshda yo'q" degani)
+    MISSING = "__missing__"
+    RECORD_FIELDS = ('id', 'uuid', 'verification_code', 'title', 'file_name', 'file', 'final_pdf', 'completed_at')
+
+    # ==================== LOOKUP ====================
+
+    @classmethod
+    def get_by_code(cls, code):
+        return cls._lookup(cls.CODE_KEY.format(code=code), verification_code=code)
+
+    @classmethod
+    def get_by_uuid(cls, uuid):
+        return cls._lookup(cls.UUID_KEY.format(uuid=uuid), uuid=uuid)
+
+    @classmethod
+    def _lookup(cls, key, **lookup):
+        """
+        Tasdiqlangan hujjat (saqlanmagan Hujjat nusxasi, faqat o'qish uchun) yoki None.
+        Keshda bo'lmasa bazadan olinib, ikkala kalit bilan yoziladi.
+        """
+        record = cache.get(key)
+        if record is None:
+            from .models import Hujjat
+
+            record = Hujjat.objects.filter(status='approved', **lookup).values(*cls.RECORD_FIELDS).first()
+            # add: o'qish paytida parallel populate()/invalidate() yozgan yangi qiymat ustidan yozilmaydi
+            if record is None:
+                cache.add(key, cls.MISSING, getattr(settings, 'VERIFICATION_NEGATIVE_CACHE_TTL', 60))
+                return None
+            cls._set(record, fill=True)
+        elif record == cls.MISSING:
+            return None
+        return cls._to_document(record)
+
+    @staticmethod
+    def _to_document(record):
+        from .models import Hujjat
+
+        return Hujjat(status='approved', **record)
+
+    # ==================== WRITE / INVALIDATE ====================
+
+    @classmethod
+    def _set(cls, record, fill=False):
+        """fill=True - o'qishdan to'ldirish: faqat kalit bo'sh bo'lsa yoziladi (cache.add)"""
+        ttl = getattr(settings, 'VERIFICATION_CACHE_TTL', 24 * 60 * 60)
+        items = {
+            cls.CODE_KEY.format(code=record['verification_code']): record,
+            cls.UUID_KEY.format(uuid=record['uuid']): record,
+        }
+        if fill:
+            for key, value in items.items():
+                cache.add(key, value, ttl)
+        else:
+            cache.set_many(items, ttl)
+
+    @classmethod
+    def populate(cls, document):
+        """Commit'dan keyin tasdiqlangan hujjat yozuvini keshga qo'yish (yakuniy PDF tayyor bo'lganda)"""
+        if document.status != 'approved':
+            return
+        record = {
+            'id': document.pk,
+            'uuid': document.uuid,
+            'verification_code': document.verification_code,
+            'title': document.title,
+            'file_name': document.file_name,
+            'file': document.file.name,
+            'final_pdf': document.final_pdf.name or None,
+            'completed_at': document.completed_at,
+        }
+        transaction.on_commit(lambda: cls._set(record))
+
+    @classmethod
+    def invalidate(cls, *documents):
+        """Tranzaksiya yakunlangach hujjatlarning ikkala kalitini tashlab yuborish"""
+        keys = []
+        for document in documents:
+            if document.verification_code:
+                keys.append(cls.CODE_KEY.format(code=document.verification_code))
+            keys.append(cls.UUID_KEY.format(uuid=document.uuid))
+        if keys:
+            transaction.on_commit(lambda: cache.delete_many(keys))
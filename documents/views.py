@@ -5,13 +5,21 @@ from django.views.decorators.http import require_http_methods
 from django.core.exceptions import ValidationError, PermissionDenied
 from django.contrib import messages
 from django.contrib.auth import update_session_auth_hash
-from django.db.models import Q, F
+from django.db.models import Q, F, Prefetch
 from django.db import transaction
 from django.utils import timezone
+from django.urls import reverse
 
-from .models import Hujjat, DocumentType, User, Faculty, Department, Program, Notification, TeachingAllocation, Subject, Group, AcademicYear, University, AuditLog, JobRun
+from .models import Hujjat, DocumentType, User, Faculty, Department, Program, Notification, TeachingAllocation, Subject, Group, AcademicYear, University, AuditLog, JobRun, ApprovalStep, UploadSession
 from .services import ApprovalWorkflowService, NotificationService, DocumentFilterService
 from .qr_service import QRCodeService
+from .verification import VerificationCodeAllocator
+from .verification_cache import VerificationLookupCache
+from .pagination import KeysetPaginator, cached_count
+from .dashboard import DashboardStatsService
+from .events import notification_bus
+from .delivery import FileDelivery
+from .uploads import ChunkedUploadService
 from .forms import DocumentUploadForm, ProfileUpdateForm, PasswordChangeUzForm, SubjectImportForm, AllocationImportForm
 import os
 import re
@@ -19,7 +27,7 @@ from PyPDF2 import PdfReader
 from .qr_service import QRCodeService
 import json 
 from django.core.serializers.json import DjangoJSONEncoder
-import time
+from django.conf import settings
 import csv
 from openpyxl import load_workbook
 
@@ -31,18 +39,7 @@ import json
 
 
 def _notifications_queryset(user):
-    queryset = Notification.objects.filter(recipient=user)
-    active_role_type = user.active_role.role_type if user.active_role else None
-    if not active_role_type:
-        return queryset
-    return queryset.filter(
-        Q(document__isnull=True) |
-        Q(document__uploaded_by=user) |
-        Q(
-            document__approval_steps__step_order=F('document__current_step'),
-            document__approval_steps__role_required=active_role_type,
-        )
-    ).distinct()
+    return NotificationService.get_queryset_for_user(user)
 
 @require_POST
 @login_required
@@ -56,11 +53,12 @@ def switch_role(request):
         # Foydalanuvchining rollaridan berilgan rol nomini topish
         # Faol rolni yangilash
         from .models import Role
+        from .roles import RoleRegistry
         role_obj = None
         if role_code:
             role_obj = Role.get_role_by_code(role_code)
         if not role_obj and role_name:
-            role_obj = Role.objects.filter(name__iexact=role_name, is_active=True).first()
+            role_obj = RoleRegistry.get_by_name(role_name)
         if not role_obj:
             role_type_lookup = {
                 key: value for key, value in Role.ROLE_TYPE_CHOICES
@@ -120,29 +118,20 @@ def switch_role(request):
 @login_required
 def dashboard(request):
     user = request.user
+    if user.is_active_role('department_head') and user.managed_department:
+        return department_head_dashboard(request)
+
     pending_approvals = ApprovalWorkflowService.get_pending_approvals_for_user(user)
     my_documents = Hujjat.objects.filter(uploaded_by=user).order_by('-uploaded_at')[:10]
     notifications = _notifications_queryset(user).order_by('-created_at')[:10]
     
-    stats = {
-        'pending_approvals': pending_approvals.count(),
-        'my_documents_total': Hujjat.objects.filter(uploaded_by=user).count(),
-        'my_approved': Hujjat.objects.filter(uploaded_by=user, status='approved').count(),
-        'my_pending': Hujjat.objects.filter(uploaded_by=user, status='pending_approval').count(),
-        'my_rejected': Hujjat.objects.filter(uploaded_by=user, status='rejected').count(),
-        'unread_notifications': _notifications_queryset(user).filter(is_read=False).count(),
-    }
-    
     context = {
         'pending_approvals': pending_approvals,
         'my_documents': my_documents,
         'notifications': notifications,
-        'stats': stats,
+        'stats': DashboardStatsService.get_stats(user),
     }
-    if request.user.is_active_role('department_head') and request.user.managed_department:
-        return department_head_dashboard(request)
-    else:
-        return render(request, 'documents/dashboard.html', context)
+    return render(request, 'documents/dashboard.html', context)
 
 @login_required
 def pending_approvals(request):
@@ -211,6 +200,9 @@ def reject_document(request, document_id):
     return redirect(request.META.get('HTTP_REFERER', 'pending_approvals'))
 
 
+DOCUMENT_LIST_PAGE_SIZE = 25
+
+
 @login_required
 def document_list(request):
     user = request.user
@@ -294,7 +286,22 @@ def document_list(request):
         documents = documents.filter(uploaded_by__university_id=university)
         
 
-    context['documents'] = documents.order_by('-uploaded_at')
+    documents = documents.select_related(
+        'document_type', 'subject', 'related_group',
+        'uploaded_by', 'uploaded_by__department',
+    )
+    page = KeysetPaginator(documents, per_page=DOCUMENT_LIST_PAGE_SIZE).page(
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+    )
+    query_params = request.GET.copy()
+    query_params.pop('after', None)
+    query_params.pop('before', None)
+
+    context['documents'] = page.object_list
+    context['page'] = page
+    context['total_count'] = cached_count(documents)
+    context['page_query'] = query_params.urlencode()
 
     if request.headers.get('x-requested-with') == 'XMLHttpRequest':
         return render(request, 'documents/_document_table.html', context)
@@ -395,6 +402,23 @@ def document_detail(request, document_id):
 from django.core.serializers.json import DjangoJSONEncoder
 import json
 
+
+def _save_uploaded_document(form, user, uploaded_file):
+    """Tekshirilgan formadan hujjat yaratish (oddiy va bo'laklab yuklash uchun umumiy)"""
+    document = form.save(commit=False)
+    document.uploaded_by = user
+    document.file_name = uploaded_file.name
+    document.file_size = uploaded_file.size
+    
+    # Qo'shimcha maydonlarni saqlash
+    document.subject = form.cleaned_data.get('subject')
+    document.academic_year = form.cleaned_data.get('academic_year')
+    document.related_group = form.cleaned_data.get('related_group')
+    
+    document.save()
+    return document
+
+
 @login_required
 @require_http_methods(["GET", "POST"])
 def upload_document(request):
@@ -402,17 +426,7 @@ def upload_document(request):
         form = DocumentUploadForm(request.POST, request.FILES, user=request.user)
         
         if form.is_valid():
-            document = form.save(commit=False)
-            document.uploaded_by = request.user
-            document.file_name = request.FILES['file'].name
-            document.file_size = request.FILES['file'].size
-            
-            # Qo'shimcha maydonlarni saqlash
-            document.subject = form.cleaned_data.get('subject')
-            document.academic_year = form.cleaned_data.get('academic_year')
-            document.related_group = form.cleaned_data.get('related_group')
-            
-            document.save()
+            document = _save_uploaded_document(form, request.user, request.FILES['file'])
             
             messages.success(
                 request, 
@@ -464,6 +478,97 @@ def upload_document(request):
             
 
 
+# ==================== CHUNKED UPLOAD API ====================
+
+def _upload_session_payload(session):
+    return {
+        'upload_id': str(session.pk),
+        'status': session.status,
+        'chunk_size': session.chunk_size,
+        'chunk_count': session.chunk_count,
+        'received_bytes': session.received_bytes,
+        'total_size': session.total_size,
+        'missing_chunks': session.missing_chunks,
+    }
+
+
+@login_required
+@require_POST
+def api_upload_start(request):
+    """Bo'laklab yuklashni boshlash: document_type, file_name, total_size"""
+    try:
+        total_size = int(request.POST.get('total_size', ''))
+    except ValueError:
+        return JsonResponse({'error': "total_size noto'g'ri"}, status=400)
+    document_type = DocumentType.objects.filter(
+        pk=request.POST.get('document_type') or None, is_active=True
+    ).first()
+    if document_type is None:
+        return JsonResponse({'error': 'Hujjat turi topilmadi'}, status=404)
+
+    try:
+        session = ChunkedUploadService.start(
+            request.user, document_type, request.POST.get('file_name', '').strip(), total_size
+        )
+    except ValidationError as e:
+        return JsonResponse({'error': ' '.join(e.messages)}, status=400)
+    return JsonResponse(_upload_session_payload(session), status=201)
+
+
+@login_required
+@require_http_methods(["GET", "DELETE"])
+def api_upload_session(request, upload_id):
+    """Seans holati (qaysi bo'laklar yetishmaydi) yoki DELETE bilan bekor qilish"""
+    session = get_object_or_404(UploadSession, pk=upload_id, user=request.user)
+    if request.method == 'DELETE' and session.status == 'active':
+        ChunkedUploadService.abort(session)
+    return JsonResponse(_upload_session_payload(session))
+
+
+@login_required
+@require_http_methods(["PUT", "POST"])
+def api_upload_chunk(request, upload_id, index):
+    """Bitta bo'lak: so'rov tanasi xotiraga o'qilmasdan storage'ga oqadi"""
+    session = get_object_or_404(UploadSession, pk=upload_id, user=request.user)
+    try:
+        session = ChunkedUploadService.store_chunk(session, index, request)
+    except ValidationError as e:
+        return JsonResponse({'error': ' '.join(e.messages)}, status=400)
+    return JsonResponse(_upload_session_payload(session))
+
+
+@login_required
+@require_POST
+def api_upload_complete(request, upload_id):
+    """Barcha bo'laklar kelgach hujjatni yaratish (oddiy yuklash formasining maydonlari bilan)"""
+    with transaction.atomic():
+        session = get_object_or_404(
+            UploadSession.objects.select_for_update(), pk=upload_id, user=request.user
+        )
+        if session.status != 'active':
+            return JsonResponse({'error': 'Yuklash seansi yakunlangan'}, status=409)
+        if session.missing_chunks:
+            return JsonResponse(
+                {'error': "Barcha bo'laklar yuklanmagan", **_upload_session_payload(session)}, status=409
+            )
+
+        data = request.POST.copy()
+        data['document_type'] = str(session.document_type_id)
+        uploaded_file = ChunkedUploadService.assembled_file(session)
+        form = DocumentUploadForm(data, {'file': uploaded_file}, user=request.user)
+        if not form.is_valid():
+            return JsonResponse({'errors': form.errors}, status=400)
+
+        document = _save_uploaded_document(form, request.user, uploaded_file)
+        ChunkedUploadService.complete(session, document)
+
+    return JsonResponse({
+        'document_id': document.id,
+        'verification_code': document.verification_code,
+        'redirect_url': reverse('document_detail', args=[document.id]),
+    }, status=201)
+
+
 @login_required
 def get_document_type_info(request, doc_type_id):
     """AJAX: Hujjat turi haqida ma'lumot qaytarish"""
@@ -501,18 +606,7 @@ def download_document(request, document_id):
         target_file = document.file
         filename = document.file_name
     
-    try:
-        if hasattr(target_file, 'path'):
-            response = FileResponse(open(target_file.path, 'rb'))
-            response['Content-Disposition'] = f'attachment; filename="{filename}"'
-            return response
-    except FileNotFoundError:
-        pass
-
-    if target_file and getattr(target_file, 'url', None):
-        return redirect(target_file.url)
-
-    raise Http404("Fayl topilmadi")
+    return FileDelivery.serve(request, target_file, filename)
 
 import os
 from django.shortcuts import get_object_or_404, redirect
@@ -538,32 +632,43 @@ def download_qr_code(request, document_id):
         messages.warning(request, "Hujjat hali to'liq tasdiqlanmagan. QR kodli PDF faqat tasdiqlangandan so'ng shakllanadi.")
         return redirect('document_detail', document_id=document.id)
     
-    # 3. Agar final_pdf (QR kodli versiya) hali yaratilmagan bo'lsa yoki fayl o'chib ketgan bo'lsa
-    if not document.final_pdf or not os.path.exists(document.final_pdf.path):
-        try:
-            # Yangi PDF generatsiya qilamiz (Bu funksiya qr_service.py da yozilgan)
-            QRCodeService.generate_final_pdf(document)
-        except Exception as e:
-            messages.error(request, f"PDF generatsiya qilishda xatolik yuz berdi: {str(e)}")
+    # 3. QR kodli PDF fon vazifasida shakllantiriladi - so'rov ichida hech qachon generatsiya qilinmaydi
+    is_ready = (
+        document.final_pdf_status == 'ready'
+        and document.final_pdf
+        and document.final_pdf.storage.exists(document.final_pdf.name)
+    )
+    if not is_ready:
+        if QRCodeService.attempts_exhausted(document):
+            messages.error(request, "QR kodli PDF'ni tayyorlab bo'lmadi. Administratorga murojaat qiling.")
             return redirect('document_detail', document_id=document.id)
+        if not document.final_pdf_in_progress:
+            # So'ralmagan, xato bilan tugagan, ishchi yiqilib qolib ketgan yoki fayl o'chib ketgan - qayta navbatga
+            QRCodeService.request_final_pdf(document)
+        messages.info(request, "QR kodli PDF tayyorlanmoqda. Birozdan so'ng qayta urinib ko'ring.")
+        return redirect('document_detail', document_id=document.id)
     
-    # 4. Faylni foydalanuvchiga jo'natish
-    try:
-        file_path = document.final_pdf.path
-        
-        # Faylni ochib response ga beramiz
-        response = FileResponse(open(file_path, 'rb'), content_type='application/pdf')
-        
-        # Fayl nomini chiroyli qilish (masalan: approved_HujjatNomi.pdf)
-        filename = f"approved_{document.file_name}"
-        if not filename.lower().endswith('.pdf'):
-            filename += '.pdf'
-            
-        response['Content-Disposition'] = f'attachment; filename="{filename}"'
-        return response
-        
-    except FileNotFoundError:
-        raise Http404("Tasdiqlangan PDF fayl serverda topilmadi.")
+    # 4. Faylni foydalanuvchiga jo'natish (lokal, X-Accel yoki imzolangan S3 URL)
+    # Fayl nomini chiroyli qilish (masalan: approved_HujjatNomi.pdf)
+    filename = f"approved_{document.file_name}"
+    if not filename.lower().endswith('.pdf'):
+        filename += '.pdf'
+    return FileDelivery.serve(request, document.final_pdf, filename, content_type='application/pdf')
+
+@login_required
+def qr_code_svg(request, document_id):
+    """Hujjat sahifasi uchun QR kod (SVG) - matritsadan har safar chiziladi, fayl saqlanmaydi"""
+    document = get_object_or_404(Hujjat, id=document_id)
+    
+    if not request.user.can_view_document(document):
+        raise PermissionDenied("Hujjatni ko'rishga ruxsat yo'q")
+    if document.status != 'approved':
+        raise Http404("Hujjat tasdiqlanmagan")
+    
+    response = HttpResponse(QRCodeService.generate_qr_svg(document), content_type='image/svg+xml')
+    # QR faqat UUID'ga bog'liq - o'zgarmaydi
+    response['Cache-Control'] = 'private, max-age=86400'
+    return response
 # --- OTHER VIEWS ---
 
 @login_required
@@ -653,6 +758,11 @@ def notifications_list(request):
     # 1. Bildirishnomalarni olamiz (faol rol bo'yicha)
     notifications = _notifications_queryset(request.user).select_related(
         'document', 'document__document_type'
+    ).prefetch_related(
+        Prefetch(
+            'document__approval_steps',
+            queryset=ApprovalStep.objects.select_related('approver').order_by('step_order'),
+        )
     ).order_by('-created_at')
     
     # 2. Har bir bildirishnoma uchun hujjat jarayonini tayyorlaymiz
@@ -662,7 +772,7 @@ def notifications_list(request):
         workflow_steps = []
         if notif.document:
             # Hujjatning barcha bosqichlarini olamiz
-            steps = notif.document.approval_steps.all().order_by('step_order')
+            steps = notif.document.approval_steps.all()
             
             for step in steps:
                 workflow_steps.append({
@@ -699,11 +809,15 @@ def mark_all_notifications_read(request):
 def verify_document(request):
     # Logic for public verification form
     if request.method == 'GET' and request.GET.get('check') == '1':
-        code = request.GET.get('code', '').strip().upper()
+        code = VerificationCodeAllocator.normalize(request.GET.get('code', ''))
         if not code:
             return JsonResponse({'exists': False, 'error': 'Kod kiritilmadi.'}, status=400)
-        document = Hujjat.objects.filter(verification_code=code, status='approved').first()
+        document = None
+        if VerificationCodeAllocator.is_plausible(code):
+            document = VerificationLookupCache.get_by_code(code)
         if not document:
+            # RateLimitMiddleware: ketma-ket topilmagan kodlar IP'ni bloklaydi
+            request.verification_failed = True
             return JsonResponse({'exists': False, 'error': 'Hujjat topilmadi.'}, status=404)
         target_file = document.final_pdf if document.final_pdf else document.file
         file_url = getattr(target_file, 'url', None)
@@ -713,7 +827,9 @@ def verify_document(request):
             'status': document.get_status_display(),
             'file_url': file_url,
         })
-    return render(request, 'documents/verify.html')
+    return render(request, 'documents/verify.html', {
+        'verification_code_length': VerificationCodeAllocator.code_length() + 1,
+    })
 
 from django.http import FileResponse
 from django.shortcuts import render
@@ -729,18 +845,16 @@ def verify_by_uuid(request, uuid):
 
     def _serve_verified_document(document):
         target_file = document.final_pdf if document.final_pdf else document.file
-        if hasattr(target_file, 'path') and os.path.exists(target_file.path):
-            response = FileResponse(open(target_file.path, 'rb'), content_type='application/pdf')
-            filename = f"hujjat_{document.verification_code}.pdf"
-            response['Content-Disposition'] = f'attachment; filename="{filename}"'
-            return response
-        if target_file and getattr(target_file, 'url', None):
-            return redirect(target_file.url)
-        raise FileNotFoundError("Hujjat bazada bor, lekin fayl serverda topilmadi.")
-
-    document = Hujjat.objects.filter(uuid=uuid, status='approved').first()
+        filename = f"hujjat_{document.verification_code}.pdf"
+        try:
+            return FileDelivery.serve(request, target_file, filename, content_type='application/pdf')
+        except Http404:
+            raise FileNotFoundError("Hujjat bazada bor, lekin fayl serverda topilmadi.")
+
+    document = VerificationLookupCache.get_by_uuid(uuid)
     if request.method == 'GET' and request.GET.get('check') == '1':
         if not document:
+            request.verification_failed = True
             return JsonResponse({'exists': False, 'error': 'Hujjat topilmadi.'}, status=404)
         target_file = document.final_pdf if document.final_pdf else document.file
         file_url = getattr(target_file, 'url', None)
@@ -757,8 +871,10 @@ def verify_by_uuid(request, uuid):
             error = f"Faylni yuklashda xatolik: {str(e)}"
 
     if request.method == 'POST':
-        code = request.POST.get('verification_code', '').strip().upper()
-        document = Hujjat.objects.filter(verification_code=code, status='approved').first()
+        code = VerificationCodeAllocator.normalize(request.POST.get('verification_code', ''))
+        document = None
+        if VerificationCodeAllocator.is_plausible(code):
+            document = VerificationLookupCache.get_by_code(code)
 
         if document:
             try:
@@ -766,11 +882,16 @@ def verify_by_uuid(request, uuid):
             except Exception as e:
                 error = f"Faylni yuklashda xatolik: {str(e)}"
         else:
+            request.verification_failed = True
             error = "Bunday kodli hujjat topilmadi yoki hali tasdiqlanmagan."
     elif not document:
+        request.verification_failed = True
         error = "Bunday UUID li hujjat topilmadi yoki hali tasdiqlanmagan."
 
-    return render(request, 'documents/verify.html', {'error': error})
+    return render(request, 'documents/verify.html', {
+        'error': error,
+        'verification_code_length': VerificationCodeAllocator.code_length() + 1,
+    })
 
 # API Views
 @login_required
@@ -781,25 +902,35 @@ def api_document_status(request, document_id):
 
 @login_required
 def api_notification_count(request):
-    count = _notifications_queryset(request.user).filter(is_read=False).count()
+    count = NotificationService.get_unread_count(request.user)
     return JsonResponse({'unread_count': count})
 
 
 @login_required
-def api_notification_stream(request):
-    def event_stream():
-        last_count = None
-        poll_seconds = 30
+async def api_notification_stream(request):
+    """
+    Server-Sent Events: o'qilmagan xabarlar soni faqat o'zgarganda yuboriladi.
+    Ulanish oqim (thread) band qilmaydi - obunachi notification_bus'dan signal kutadi.
+    """
+    if 'wsgi.input' in request.META:
+        # WSGI ostida cheksiz oqim worker'ni band qiladi; brauzer polling'ga o'tadi
+        return HttpResponse(status=204)
 
-        while True:
-            count = NotificationService.get_unread_count(request.user)
-            if count != last_count:
-                payload = json.dumps({'unread_count': count})
-                yield f"event: count\ndata: {payload}\n\n"
-                last_count = count
+    # request.user middleware'larda yuklangan va faol roli o'rnatilgan
+    user = request.user
+    keepalive_seconds = getattr(settings, 'NOTIFICATION_STREAM_KEEPALIVE_SECONDS', 25)
 
-            yield ": keep-alive\n\n"
-            time.sleep(poll_seconds)
+    async def event_stream():
+        last_count = None
+        async with notification_bus.subscribe(user.pk) as subscription:
+            while True:
+                count = await NotificationService.aget_unread_count(user)
+                if count != last_count:
+                    payload = json.dumps({'unread_count': count})
+                    yield f"event: count\ndata: {payload}\n\n"
+                    last_count = count
+                if not await subscription.wait(keepalive_seconds):
+                    yield ": keep-alive\n\n"
 
     response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
     response['Cache-Control'] = 'no-cache'
@@ -822,9 +953,19 @@ def jobs_health(request):
             'last_success_at': job.last_success_at.isoformat() if job.last_success_at else None,
             'last_duration_ms': job.last_duration_ms,
             'last_error': job.last_error,
+            'metrics': job.metrics,
         })
 
-    return JsonResponse({'jobs': data})
+    from .audit import get_request_log_buffer
+    from .background import BackgroundRunner
+    from .ratelimit import TokenBucketLimiter
+
+    return JsonResponse({
+        'jobs': data,
+        'audit_buffer': get_request_log_buffer().stats(),
+        'rate_limiter': TokenBucketLimiter.stats(),
+        'background_queues': BackgroundRunner.stats(),
+    })
 
 
 
@@ -94,6 +94,121 @@ document.addEventListener('DOMContentLoaded', () => {
         updateDynamicFields();
     }
 
+    // Katta fayllar bo'laklab yuboriladi: uzilgan yuklash faqat yetishmagan bo'laklardan davom etadi
+    const CHUNKED_THRESHOLD = 10 * 1024 * 1024;
+    const CHUNK_RETRIES = 3;
+    const chunkedUrl = form.dataset.chunkedUrl;
+    const csrfInput = form.querySelector('input[name="csrfmiddlewaretoken"]');
+
+    function chunkedRequest(url, options = {}) {
+        return fetch(url, {
+            credentials: 'same-origin',
+            ...options,
+            headers: {
+                'X-CSRFToken': csrfInput ? csrfInput.value : '',
+                'X-Requested-With': 'XMLHttpRequest',
+                ...(options.headers || {})
+            }
+        }).then(async (res) => {
+            const data = await res.json().catch(() => ({}));
+            if (!res.ok) {
+                const error = new Error(data.error || `HTTP ${res.status}`);
+                error.status = res.status;
+                error.data = data;
+                throw error;
+            }
+            return data;
+        });
+    }
+
+    async function openUploadSession(file) {
+        const resumeKey = `chunked-upload:${documentTypeSelect.value}:${file.name}:${file.size}:${file.lastModified}`;
+        const savedId = window.localStorage.getItem(resumeKey);
+        if (savedId) {
+            try {
+                const session = await chunkedRequest(`${chunkedUrl}${savedId}/`);
+                if (session.status === 'active') return { session, resumeKey };
+            } catch (error) {
+                // Seans eskirgan yoki o'chirilgan - yangisini ochamiz
+            }
+            window.localStorage.removeItem(resumeKey);
+        }
+
+        const body = new FormData();
+        body.append('document_type', documentTypeSelect.value);
+        body.append('file_name', file.name);
+        body.append('total_size', file.size);
+        const session = await chunkedRequest(chunkedUrl, { method: 'POST', body });
+        window.localStorage.setItem(resumeKey, session.upload_id);
+        return { session, resumeKey };
+    }
+
+    async function sendChunk(session, file, index) {
+        const start = index * session.chunk_size;
+        const blob = file.slice(start, Math.min(start + session.chunk_size, file.size));
+        for (let attempt = 1; ; attempt++) {
+            try {
+                return await chunkedRequest(`${chunkedUrl}${session.upload_id}/chunks/${index}/`, {
+                    method: 'PUT',
+                    headers: { 'Content-Type': 'application/octet-stream' },
+                    body: blob
+                });
+            } catch (error) {
+                // 4xx - takrorlash foyda bermaydi
+                if (attempt >= CHUNK_RETRIES || (error.status && error.status < 500)) throw error;
+                await new Promise((resolve) => setTimeout(resolve, 1000 * attempt));
+            }
+        }
+    }
+
+    async function chunkedUpload(file) {
+        const submitButton = form.querySelector('[type="submit"]');
+        const originalLabel = submitButton ? submitButton.innerHTML : '';
+        const setProgress = (bytes) => {
+            if (submitButton) {
+                submitButton.innerHTML = `Yuklanmoqda... ${Math.floor((bytes / file.size) * 100)}%`;
+            }
+        };
+        if (submitButton) submitButton.disabled = true;
+
+        try {
+            const { session, resumeKey } = await openUploadSession(file);
+            let state = session;
+            setProgress(state.received_bytes);
+            for (const index of session.missing_chunks) {
+                state = await sendChunk(session, file, index);
+                setProgress(state.received_bytes);
+            }
+
+            const body = new FormData(form);
+            body.delete('file');
+            const result = await chunkedRequest(`${chunkedUrl}${session.upload_id}/complete/`, {
+                method: 'POST',
+                body
+            });
+            window.localStorage.removeItem(resumeKey);
+            window.location.href = result.redirect_url;
+        } catch (error) {
+            const errors = error.data && error.data.errors;
+            const message = errors
+                ? Object.values(errors).flat().join('\n')
+                : error.message;
+            alert(`Yuklashda xatolik: ${message}`);
+            if (submitButton) {
+                submitButton.disabled = false;
+                submitButton.innerHTML = originalLabel;
+            }
+        }
+    }
+
+    form.addEventListener('submit', (event) => {
+        const file = fileInput && fileInput.files[0];
+        if (!chunkedUrl || !file || file.size < CHUNKED_THRESHOLD || !window.fetch) return;
+        if (!form.checkValidity()) return;
+        event.preventDefault();
+        chunkedUpload(file);
+    });
+
     if (fileInput) {
         fileInput.addEventListener('change', (event) => {
             const file = event.target.files[0];
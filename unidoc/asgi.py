@@ -3,6 +3,13 @@ ASGI config for unidoc project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Only the Server-Sent Events stream runs as native async Django.  Under
+Django's ASGI handler every *sync* view and middleware is executed through
+sync_to_async(thread_sensitive=True), i.e. all ordinary page requests of a
+process would be serialized onto one thread.  Pages are therefore served by
+the regular WSGI handler inside a thread pool (a2wsgi), exactly as under
+gunicorn --threads, while idle SSE connections still hold no thread.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/6.0/howto/deployment/asgi/
 """
@@ -10,7 +17,28 @@ https://docs.djangoproject.com/en/6.0/howto/deployment/asgi/
 import os
 
 from django.core.asgi import get_asgi_application
+from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'unidoc.settings')
 
-application = get_asgi_application()
+django_asgi_application = get_asgi_application()
+
+from a2wsgi import WSGIMiddleware  # noqa: E402
+
+# Sahifalar uchun oqimlar soni (avvalgi gunicorn --threads o'rniga)
+page_application = WSGIMiddleware(
+    get_wsgi_application(),
+    workers=int(os.getenv('WSGI_THREADS', '4')),
+)
+
+# Faqat shu yo'llar async Django'ga boradi (uzoq ochiq turadigan ulanishlar)
+ASYNC_PATH_PREFIXES = (
+    '/api/notifications/stream/',
+)
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and not scope['path'].startswith(ASYNC_PATH_PREFIXES):
+        await page_application(scope, receive, send)
+    else:
+        await django_asgi_application(scope, receive, send)
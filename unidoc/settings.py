@@ -1,6 +1,7 @@
 
 from pathlib import Path
 import os
+import tempfile
 from urllib.parse import urlparse
 import dj_database_url
 from dotenv import load_dotenv
@@ -65,6 +66,7 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'documents.middleware.RateLimitMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -94,6 +96,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'unidoc.wsgi.application'
+ASGI_APPLICATION = 'unidoc.asgi.application'
 
 
 # Database
@@ -166,8 +169,11 @@ if S3_ENDPOINT_URL and S3_BUCKET_NAME and S3_ACCESS_KEY_ID and S3_SECRET_ACCESS_
     AWS_S3_REGION_NAME = os.getenv("S3_REGION", "")
     AWS_S3_SIGNATURE_VERSION = "s3v4"
     AWS_S3_ADDRESSING_STYLE = "path"
-    AWS_DEFAULT_ACL = "public-read"
-    AWS_QUERYSTRING_AUTH = False
+    # Obyektlar ochiq emas: fayl faqat imzolangan, qisqa muddatli URL orqali beriladi
+    # (public-read bilan imzosiz MEDIA_URL havolasi ham ochilib, ruxsat tekshiruvi chetlab o'tilardi).
+    # Avval public-read bilan yuklangan obyektlarning ACL'ini bucket tomonida private qilish kerak.
+    AWS_DEFAULT_ACL = "private"
+    AWS_QUERYSTRING_AUTH = True
     MEDIA_URL = f"{AWS_S3_ENDPOINT_URL}/{AWS_STORAGE_BUCKET_NAME}/"
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -229,9 +235,116 @@ LOGGING = {
     },
 }
 
+# Kesh: REDIS_URL berilsa barcha jarayonlar uchun umumiy Redis, aks holda jarayon xotirasi
+REDIS_URL = os.getenv('REDIS_URL', '')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Celery: broker sozlanmasa EmailOutbox commit'dan keyin shu jarayonning o'zida yuboriladi.
+# Faqat aniq berilgan CELERY_BROKER_URL ishlatiladi (REDIS_URL'dan olinmaydi): worker/beat
+# xizmati ishga tushirilmagan muhitda vazifalar brokerda yotib qolmasligi uchun.
+CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', '')
+
+# EmailOutbox: paket hajmi, urinishlar soni va qayta urinish oralig'i (soniya)
+EMAIL_OUTBOX_BATCH_SIZE = int(os.getenv('EMAIL_OUTBOX_BATCH_SIZE', '50'))
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.getenv('EMAIL_OUTBOX_MAX_ATTEMPTS', '5'))
+EMAIL_OUTBOX_BACKOFF_SECONDS = int(os.getenv('EMAIL_OUTBOX_BACKOFF_SECONDS', '60'))
+EMAIL_OUTBOX_MAX_BACKOFF_SECONDS = int(os.getenv('EMAIL_OUTBOX_MAX_BACKOFF_SECONDS', '3600'))
+
+# BulkMailDispatcher: bitta SMTP ulanishida bir chaqiruvda yuboriladigan xatlar soni
+BULK_MAIL_CHUNK_SIZE = int(os.getenv('BULK_MAIL_CHUNK_SIZE', '100'))
+
+# auto_approve_overdue_documents: bitta tranzaksiyada qayta ishlanadigan hujjatlar soni
+AUTO_APPROVE_BATCH_SIZE = int(os.getenv('AUTO_APPROVE_BATCH_SIZE', '500'))
+
+# process_deadline_events: bir tranzaksiyada olinadigan DeadlineEvent soni
+DEADLINE_EVENT_BATCH_SIZE = int(os.getenv('DEADLINE_EVENT_BATCH_SIZE', '1000'))
+
+# Yakuniy PDF: tasdiqlash sahifasi asl fayl oxiriga qo'shimcha yangilanish sifatida yoziladi
+FINAL_PDF_INCREMENTAL = _env_bool(os.getenv('FINAL_PDF_INCREMENTAL'), default=True)
+
+# Yakuniy PDF: shu muddatdan ortiq pending/processing qolgan hujjat (ishchi yiqilgan) qayta olinadi;
+# xato bilan tugaganlar soatlik vazifada ko'pi bilan FINAL_PDF_MAX_ATTEMPTS marta qayta uriniladi
+FINAL_PDF_LEASE_MINUTES = int(os.getenv('FINAL_PDF_LEASE_MINUTES', '15'))
+FINAL_PDF_MAX_ATTEMPTS = int(os.getenv('FINAL_PDF_MAX_ATTEMPTS', '5'))
+
+# Tasdiqlash varaqasi shablonining jarayonlararo keshi: har doim lokal katalog (MEDIA_ROOT yoki S3 emas).
+# Bo'sh qiymat - faqat jarayon xotirasi
+VERIFICATION_TEMPLATE_DIR = os.getenv(
+    'VERIFICATION_TEMPLATE_DIR', os.path.join(tempfile.gettempdir(), 'unidoc_verification_templates')
+)
+
+# generate_qr_codes_batch / generate_final_pdfs_batch: bitta ishchi vazifaga beriladigan hujjatlar soni
+MEDIA_BATCH_CHUNK_SIZE = int(os.getenv('MEDIA_BATCH_CHUNK_SIZE', '200'))
+
+# FileDelivery: '' (Django o'zi yuboradi), 'x-accel' (nginx) yoki 'x-sendfile' (Apache/lighttpd).
+# x-accel uchun nginx'da FILE_DELIVERY_ACCEL_PREFIX -> MEDIA_ROOT internal location bo'lishi kerak.
+FILE_DELIVERY_OFFLOAD = os.getenv('FILE_DELIVERY_OFFLOAD', '').strip().lower()
+FILE_DELIVERY_ACCEL_PREFIX = os.getenv('FILE_DELIVERY_ACCEL_PREFIX', '/protected-media/')
+# S3 uchun imzolangan yuklab olish havolasining amal qilish muddati (soniya)
+FILE_DELIVERY_URL_EXPIRE = int(os.getenv('FILE_DELIVERY_URL_EXPIRE', '300'))
+# FieldFile.url (tekshiruv sahifasidagi havola) ham shu muddat bilan imzolanadi
+AWS_QUERYSTRING_EXPIRE = FILE_DELIVERY_URL_EXPIRE
+
+# Bo'laklab (resumable) yuklash: bitta bo'lak hajmi (bayt) va tugallanmagan seans umri (soat)
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', str(5 * 1024 * 1024)))
+UPLOAD_SESSION_TTL_HOURS = int(os.getenv('UPLOAD_SESSION_TTL_HOURS', '24'))
+
+# Havolasiz qolgan blob (blobs/ ostidagi fayl) shuncha soatdan keyin o'chiriladi
+BLOB_GC_GRACE_HOURS = int(os.getenv('BLOB_GC_GRACE_HOURS', '24'))
+# Brokersiz rejimda GC jarayon ichidagi taymer bilan shu oraliqda ishga tushadi
+BLOB_GC_INTERVAL_HOURS = int(os.getenv('BLOB_GC_INTERVAL_HOURS', '24'))
+
+# Ommaviy tekshiruv keshi: tasdiqlangan hujjat yozuvi va topilmagan kod umri (soniya)
+VERIFICATION_CACHE_TTL = int(os.getenv('VERIFICATION_CACHE_TTL', str(24 * 60 * 60)))
+VERIFICATION_NEGATIVE_CACHE_TTL = int(os.getenv('VERIFICATION_NEGATIVE_CACHE_TTL', '60'))
+
+# RateLimitMiddleware: cheklanadigan yo'llar, kod prefiksi uzunligi va ishonchli proksilar soni
+# (Render kabi bitta proksi ortida 1). Parametrlar SecurityPolicy'dan olinadi.
+# Diqqat: proksi ortida 0 qoldirilsa barcha mijozlar proksining REMOTE_ADDR'ini oladi - bitta
+# chelak butun sayt uchun, bir necha xato kod esa /verify/'ni hammaga bloklaydi.
+RATE_LIMIT_PATHS = ('/verify/',)
+RATE_LIMIT_CODE_PREFIX_LENGTH = int(os.getenv('RATE_LIMIT_CODE_PREFIX_LENGTH', '2'))
+RATE_LIMIT_PROXY_COUNT = int(os.getenv('RATE_LIMIT_PROXY_COUNT', '1' if os.getenv('RENDER') else '0'))
+RATE_LIMIT_MAX_KEYS = int(os.getenv('RATE_LIMIT_MAX_KEYS', '10000'))
+RATE_LIMIT_POLICY_CHECK_SECONDS = float(os.getenv('RATE_LIMIT_POLICY_CHECK_SECONDS', '5'))
+
+# RoleRegistry keshdagi versiyani necha soniyada bir tekshiradi
+ROLE_REGISTRY_CHECK_SECONDS = float(os.getenv('ROLE_REGISTRY_CHECK_SECONDS', '2'))
+
+# Hujjat tasdiqlash kodi: uzunlik (+1 nazorat belgisi) va aralashtirish kaliti.
+# Kalit ishga tushgandan keyin HECH QACHON o'zgartirilmasligi kerak, aks holda yangi kodlar
+# eskilari (bosilgan QR varaqlar) bilan to'qnashadi. Shuning uchun u SECRET_KEY'dan alohida:
+# SECRET_KEY'ni almashtirish kodlarga ta'sir qilmaydi. Productionda majburiy; avval SECRET_KEY
+# bilan ishlagan o'rnatishda unga hozirgacha ishlatilgan SECRET_KEY qiymatini bering.
+VERIFICATION_CODE_LENGTH = int(os.getenv('VERIFICATION_CODE_LENGTH', '6'))
+VERIFICATION_CODE_KEY = os.getenv('VERIFICATION_CODE_KEY', '')
+
+# api_notification_stream: o'zgarish bo'lmasa shuncha soniyada keep-alive yuboriladi
+NOTIFICATION_STREAM_KEEPALIVE_SECONDS = int(os.getenv('NOTIFICATION_STREAM_KEEPALIVE_SECONDS', '25'))
+
+# AuditRequestMiddleware: RequestLog yozuvlari navbat orqali paketlab yoziladi
+AUDIT_LOG_ASYNC = _env_bool(os.getenv('AUDIT_LOG_ASYNC'), default=True)
+AUDIT_LOG_QUEUE_SIZE = int(os.getenv('AUDIT_LOG_QUEUE_SIZE', '10000'))
+AUDIT_LOG_BATCH_SIZE = int(os.getenv('AUDIT_LOG_BATCH_SIZE', '100'))
+AUDIT_LOG_FLUSH_INTERVAL_MS = int(os.getenv('AUDIT_LOG_FLUSH_INTERVAL_MS', '1000'))
+
 if not DEBUG:
     if SECRET_KEY == "dev-insecure-change-me":
         raise RuntimeError("SECRET_KEY must be set in production.")
+    if not VERIFICATION_CODE_KEY:
+        raise RuntimeError("VERIFICATION_CODE_KEY must be set in production (never rotate it).")
 
     SECURE_SSL_REDIRECT = _env_bool(os.getenv("SECURE_SSL_REDIRECT"), default=True)
     SESSION_COOKIE_SECURE = _env_bool(os.getenv("SESSION_COOKIE_SECURE"), default=True)